@@ -0,0 +1,103 @@
+# api_client.py (Client for api_server.py)
+import base64
+import json
+import threading
+
+
+class APIError(Exception):
+    def __init__(self, status_code, detail, retry_after=None):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class ChatAPIClient:
+    # Thin synchronous client used by the Streamlit app when "api_url" is
+    # configured; one keep-alive connection pool is shared by every session
+    def __init__(self, base_url, timeout=60.0):
+        import httpx
+        self.base_url = base_url.rstrip("/")
+        self._client = httpx.Client(base_url=self.base_url, timeout=timeout)
+
+    def _headers(self, session_id):
+        return {"Authorization": f"Bearer {session_id}"} if session_id else {}
+
+    def _check(self, response):
+        if response.status_code >= 400:
+            try:
+                detail = response.json().get("detail", response.text)
+            except ValueError:
+                detail = response.text
+            retry_after = response.headers.get("retry-after")
+            raise APIError(response.status_code, detail, float(retry_after) if retry_after else None)
+        return response.json()
+
+    def register(self, username, password):
+        return self._check(self._client.post("/auth/register", json={"username": username, "password": password}))
+
+    def login(self, username, password):
+        return self._check(self._client.post("/auth/login", json={"username": username, "password": password}))
+
+    def logout(self, session_id):
+        return self._check(self._client.post("/auth/logout", headers=self._headers(session_id)))
+
+    def conversations(self, session_id, limit=20, before_id=None):
+        params = {"limit": limit}
+        if before_id is not None:
+            params["before_id"] = before_id
+        return self._check(self._client.get("/conversations", params=params, headers=self._headers(session_id)))
+
+    def history(self, session_id, conversation_id, limit=100, before_id=None):
+        params = {"limit": limit}
+        if before_id is not None:
+            params["before_id"] = before_id
+        return self._check(self._client.get(
+            f"/conversations/{conversation_id}/messages", params=params, headers=self._headers(session_id)
+        ))
+
+    def retrieve(self, query, session_id=None, top_k=None):
+        return self._check(self._client.post(
+            "/retrieve", json={"query": query, "top_k": top_k}, headers=self._headers(session_id)
+        ))["chunks"]
+
+    def ingest(self, files, session_id=None):
+        # files: objects with name, type and getvalue(), e.g. Streamlit uploads
+        payload = {"files": [
+            {"name": f.name, "type": f.type, "content_base64": base64.b64encode(f.getvalue()).decode()}
+            for f in files
+        ]}
+        return self._check(self._client.post(
+            "/ingest", json=payload, headers=self._headers(session_id), timeout=None
+        ))
+
+    def stream_chat(self, question, session_id=None, **options):
+        # Yields (event, data) pairs from the server-sent event stream
+        body = {"question": question, "stream": True, **options}
+        with self._client.stream("POST", "/chat", json=body, headers=self._headers(session_id)) as response:
+            if response.status_code >= 400:
+                response.read()
+                self._check(response)
+            event, data = "message", []
+            for line in response.iter_lines():
+                if not line:
+                    if data:
+                        yield event, json.loads("\n".join(data))
+                    event, data = "message", []
+                elif line.startswith("event:"):
+                    event = line[len("event:"):].strip()
+                elif line.startswith("data:"):
+                    data.append(line[len("data:"):].strip())
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_api_client(base_url):
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = ChatAPIClient(base_url)
+    return _client
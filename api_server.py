@@ -0,0 +1,351 @@
+# api_server.py (Headless Chat API with SSE Streaming)
+# Serves the chat, retrieval, ingestion and auth flows over HTTP so the
+# backend can scale separately from the Streamlit UI. Workers keep no
+# per-client state, so several can run behind a load balancer:
+#   uvicorn api_server:app --host 0.0.0.0 --port 8000 --workers 4
+# With more than one worker, set "rate_limit_backend": "sqlite" so rate
+# limits are shared between them. Prometheus scrapes GET /metrics here;
+# metrics_port is ignored, since every worker would try to bind it.
+import asyncio
+import base64
+import json
+import os
+import sqlite3
+from typing import List, Literal, Optional
+from dotenv import load_dotenv
+from fastapi import Depends, FastAPI, Header, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel
+from chat_service import ChatService, UploadedDocument
+from telemetry import get_telemetry, span
+from utils import load_config, setup_logger
+
+load_dotenv()
+config = load_config(os.getenv("CHATBOT_CONFIG", "config.json"))
+logger = setup_logger()
+telemetry = get_telemetry(dict(config, metrics_port=None))
+service = ChatService(config)
+db = service.db
+
+MAX_STREAMS = config.get("api_max_streams", 64)
+MAX_INGESTS = config.get("api_max_ingests", 2)
+MAX_UPLOAD_BYTES = config.get("api_max_upload_mb", 50) * 1024 * 1024
+RETRY_AFTER_SECONDS = 2
+
+
+class BodyLimit:
+    # Reads the request body before the app does and answers 413 as soon as
+    # it passes max_bytes, so an oversized upload is never buffered whole or
+    # parsed. Counting received bytes also covers chunked uploads, which
+    # carry no Content-Length.
+    def __init__(self, app, max_bytes):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        headers = dict(scope["headers"])
+        too_large = JSONResponse({"detail": "Upload too large"}, status_code=413)
+        if int(headers.get(b"content-length") or 0) > self.max_bytes:
+            return await too_large(scope, receive, send)
+
+        body, more_body = [], True
+        size = 0
+        while more_body:
+            message = await receive()
+            if message["type"] != "http.request":
+                return  # Client went away
+            body.append(message.get("body", b""))
+            size += len(body[-1])
+            if size > self.max_bytes:
+                return await too_large(scope, receive, send)
+            more_body = message.get("more_body", False)
+
+        replayed = False
+
+        async def replay():
+            nonlocal replayed
+            if replayed:
+                return await receive()
+            replayed = True
+            return {"type": "http.request", "body": b"".join(body), "more_body": False}
+
+        await self.app(scope, replay, send)
+
+
+app = FastAPI(title=config['app_title'], description=config['app_description'])
+app.add_middleware(BodyLimit, max_bytes=MAX_UPLOAD_BYTES)
+# Per-worker admission control: requests beyond these limits are shed with
+# 503 + Retry-After instead of queueing without bound
+_active = {"streams": 0, "ingests": 0}
+
+
+class Credentials(BaseModel):
+    username: str
+    password: str
+
+
+class Message(BaseModel):
+    role: Literal["user", "assistant"]
+    content: str
+
+
+class ChatRequest(BaseModel):
+    question: str
+    conversation_id: Optional[int] = None
+    model: Optional[str] = None
+    temperature: Optional[float] = None
+    max_tokens: Optional[int] = None
+    # Only used for anonymous chats; signed-in history is loaded server-side
+    history: Optional[List[Message]] = None
+    stream: bool = True
+
+
+class RetrieveRequest(BaseModel):
+    query: str
+    top_k: Optional[int] = None
+
+
+class Document(BaseModel):
+    name: str
+    type: str
+    content_base64: str
+
+
+class IngestRequest(BaseModel):
+    files: List[Document]
+
+
+def _busy(detail):
+    return JSONResponse({"detail": detail}, status_code=503, headers={"Retry-After": str(RETRY_AFTER_SECONDS)})
+
+
+async def current_user(authorization: Optional[str] = Header(None)):
+    # Bearer <session_id>; None for anonymous requests
+    if not authorization:
+        return None
+    scheme, _, session_id = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not session_id:
+        raise HTTPException(401, "Invalid authorization header")
+    user_id = await asyncio.to_thread(db.validate_session, session_id)
+    if user_id is None:
+        raise HTTPException(401, "Session expired or invalid")
+    return {"user_id": user_id, "session_id": session_id}
+
+
+async def require_user(user=Depends(current_user)):
+    if user is None:
+        raise HTTPException(401, "Authentication required")
+    return user
+
+
+async def _require_conversation(user, conversation_id):
+    # Unknown and foreign conversations look the same to the caller
+    if not await asyncio.to_thread(db.owns_conversation, user["user_id"], conversation_id):
+        raise HTTPException(404, "Conversation not found")
+
+
+@app.get("/healthz")
+async def healthz():
+    return {"status": "ok", "active_streams": _active["streams"], "active_ingests": _active["ingests"]}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return telemetry.render_prometheus()
+
+
+@app.get("/router")
+async def router():
+    # Per-model EWMAs, SLOs and fallback counts behind "model": "auto"
+    return service.router.stats()
+
+
+@app.post("/auth/register")
+async def register(credentials: Credentials):
+    if not credentials.username or not credentials.password:
+        raise HTTPException(400, "Please enter username and password")
+    try:
+        user_id = await asyncio.to_thread(db.create_user, credentials.username, credentials.password)
+    except sqlite3.IntegrityError:
+        raise HTTPException(409, "Username already exists")
+    except RuntimeError as e:
+        return _busy(str(e))
+    return {"user_id": user_id}
+
+
+@app.post("/auth/login")
+async def login(credentials: Credentials):
+    retry_after = db.login_retry_after(credentials.username)
+    if retry_after:
+        return JSONResponse(
+            {"detail": "Too many failed attempts"}, status_code=429,
+            headers={"Retry-After": str(int(retry_after) + 1)}
+        )
+    try:
+        user_id = await asyncio.to_thread(db.verify_user, credentials.username, credentials.password)
+    except RuntimeError as e:
+        return _busy(str(e))
+    if not user_id:
+        raise HTTPException(401, "Invalid credentials")
+    session_id = await asyncio.to_thread(db.create_session, user_id, config.get('session_duration', 3600))
+    return {"user_id": user_id, "session_id": session_id}
+
+
+@app.post("/auth/logout")
+async def logout(user=Depends(require_user)):
+    await asyncio.to_thread(db.delete_session, user["session_id"])
+    return {"status": "ok"}
+
+
+@app.get("/conversations")
+async def conversations(limit: int = 20, before_id: Optional[int] = None, user=Depends(require_user)):
+    return await asyncio.to_thread(db.list_conversations, user["user_id"], limit, before_id)
+
+
+@app.get("/conversations/{conversation_id}/messages")
+async def messages(conversation_id: int, limit: int = 100, before_id: Optional[int] = None,
+                   user=Depends(require_user)):
+    await _require_conversation(user, conversation_id)
+    return await asyncio.to_thread(
+        db.get_history, user["user_id"], limit, before_id, conversation_id
+    )
+
+
+@app.get("/archive")
+async def archive(conversation_id: Optional[int] = None, limit: int = 100, before_id: Optional[int] = None,
+                  user=Depends(require_user)):
+    # Messages moved out of chat_history by retention.py
+    return await asyncio.to_thread(
+        service.retention.archived_history, user["user_id"], limit, before_id, conversation_id
+    )
+
+
+@app.post("/retrieve")
+async def retrieve(body: RetrieveRequest, user=Depends(current_user)):
+    kb_id = service.knowledge_base_id(user and user["user_id"])
+    chunks = await asyncio.to_thread(service.retrieve, body.query, kb_id, body.top_k)
+    return {"chunks": [{"content": content, "metadata": metadata} for content, metadata in chunks]}
+
+
+@app.post("/ingest")
+async def ingest(body: IngestRequest, user=Depends(require_user)):
+    # Oversized bodies were already refused by BodyLimit
+    if _active["ingests"] >= MAX_INGESTS:
+        return _busy("Ingestion is busy, please try again")
+    try:
+        uploads = [
+            UploadedDocument(document.name, document.type, base64.b64decode(document.content_base64))
+            for document in body.files
+        ]
+    except ValueError:
+        raise HTTPException(400, "Invalid base64 content")
+
+    _active["ingests"] += 1
+    try:
+        # Anonymous callers share the default knowledge base, so only
+        # signed-in users may add to one, and only to their own
+        kb_id = service.knowledge_base_id(user["user_id"])
+        _, summary = await asyncio.to_thread(service.ingest, uploads, kb_id)
+    finally:
+        _active["ingests"] -= 1
+    return summary
+
+
+@app.post("/chat")
+async def chat(body: ChatRequest, request: Request, user=Depends(current_user)):
+    user_id = user and user["user_id"]
+    if _active["streams"] >= MAX_STREAMS:
+        return _busy("Server is busy, please try again")
+    if body.conversation_id is not None:
+        if user is None:
+            raise HTTPException(401, "Authentication required")
+        await _require_conversation(user, body.conversation_id)
+    rate_key = user_id or f"ip:{request.client.host if request.client else 'unknown'}"
+    if not await asyncio.to_thread(service.rate_limiter.allow, rate_key):
+        return JSONResponse(
+            {"detail": f"Rate limit exceeded ({config['rate_limit']} requests per {config['rate_window']} seconds)"},
+            status_code=429, headers={"Retry-After": str(config['rate_window'])}
+        )
+
+    # Check and claim a slot with no await in between, so concurrent
+    # requests cannot all pass the check
+    if _active["streams"] >= MAX_STREAMS:
+        return _busy("Server is busy, please try again")
+    release = _claim_stream()
+    events = service.achat(
+        body.question,
+        user_id=user_id,
+        conversation_id=body.conversation_id,
+        model_name=body.model,
+        temperature=body.temperature,
+        max_tokens=body.max_tokens,
+        history=[{"role": message.role, "content": message.content} for message in body.history or ()]
+    )
+
+    if not body.stream:
+        answer = []
+        result = {}
+        with span("chat_request", model=body.model):
+            async for event, data in _tracked(events, release):
+                if event == "delta":
+                    answer.append(data["text"])
+                else:
+                    result.update(data)
+        result["answer"] = "".join(answer)
+        return result
+
+    async def sse():
+        with span("chat_request", model=body.model):
+            try:
+                async for event, data in _tracked(events, release):
+                    yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+            except Exception as e:
+                logger.error(f"API Error: {str(e)}")
+                yield f"event: error\ndata: {json.dumps({'detail': 'Failed to generate response'})}\n\n"
+
+    # Starlette sends each event before pulling the next one, so a slow
+    # client pauses the model stream rather than buffering the answer
+    return TrackedStreamingResponse(
+        sse(), release, media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+def _claim_stream():
+    # Returns a release function that is safe to call more than once
+    _active["streams"] += 1
+    released = False
+
+    def release():
+        nonlocal released
+        if not released:
+            released = True
+            _active["streams"] -= 1
+
+    return release
+
+
+class TrackedStreamingResponse(StreamingResponse):
+    # Starlette never starts the body of a response whose client has already
+    # gone, so _tracked's finally would not run; release the slot here too
+    def __init__(self, content, release, **kwargs):
+        super().__init__(content, **kwargs)
+        self.release = release
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.release()
+
+
+async def _tracked(events, release):
+    # The stream's slot was claimed when the request was admitted
+    try:
+        async for item in events:
+            yield item
+    finally:
+        release()
+        await events.aclose()
@@ -1,27 +1,50 @@
 # app.py (Main Application)
 import os
 import json
+import hashlib
+import uuid
 import streamlit as st
-from groq import Groq
 from dotenv import load_dotenv
-from data_processor import DataProcessor
-from model_handler import GroqModelHandler
+from vector_store_registry import DEFAULT_KB_ID
+from model_handler import GroqModelHandler, StreamRenderer
+from model_router import AUTO_MODEL
+from chat_service import ChatService
+from conversation import ConversationContext
+from api_client import APIError, get_api_client
 from utils import load_config, setup_logger
-from database import DatabaseManager
+from database import get_database
+from rate_limiter import get_rate_limiter
+from telemetry import get_telemetry, span
 import sqlite3
-# Add to existing imports
-db = DatabaseManager()
 
 # Load configurations and environment
 load_dotenv()
 config = load_config('config.json')
 logger = setup_logger()
+get_telemetry(config)  # Sampling and metrics export, applied once per process
+# With an API URL the UI is only a client of api_server.py: it opens no
+# database and starts no model, ingestion or retention machinery of its own
+api_url = os.getenv("CHATBOT_API_URL") or config.get('api_url')
+db = None if api_url else get_database()
+rate_limiter = None if api_url else get_rate_limiter(config, db)
 
 class ChatBot:
     def __init__(self):
-        self.client = Groq(api_key=os.getenv("GROQ_API_KEY"))
-        self.data_processor = DataProcessor()
-        self.model_handler = GroqModelHandler(self.client)
+        self.api = get_api_client(api_url) if api_url else None
+        if self.api:
+            # Only used to trim anonymous history before it is sent
+            self.conversation = ConversationContext(None, None, config)
+        else:
+            self.chat_service = ChatService(config, db)
+            self.client_pool = self.chat_service.client_pool
+            self.data_processor = self.chat_service.data_processor
+            self.conversation = self.chat_service.conversation
+            self.model_handler = GroqModelHandler(
+                self.client_pool,
+                stream_fps=config.get('stream_fps', 15),
+                flush_tokens=config.get('stream_flush_tokens', 32),
+                router=self.chat_service.router
+            )
         self.initialize_session()
         self.initialize_auth()
     def initialize_auth(self):
@@ -29,6 +52,8 @@ class ChatBot:
             st.session_state.user_id = None
         if "session_id" not in st.session_state:
             st.session_state.session_id = None
+        if "conversation_id" not in st.session_state:
+            st.session_state.conversation_id = None
 
     def render_user_auth(self):
         st.subheader("User Authentication")
@@ -50,7 +75,17 @@ class ChatBot:
                 self.handle_registration(username, password)
 
     def handle_login(self, username, password):
-        user_id = db.verify_user(username, password)
+        if self.api:
+            return self.handle_api_login(username, password)
+        retry_after = db.login_retry_after(username)
+        if retry_after:
+            st.error(f"Too many failed attempts. Try again in {retry_after:.0f} seconds")
+            return
+        try:
+            user_id = db.verify_user(username, password)
+        except RuntimeError as e:
+            st.error(str(e))
+            return
         if user_id:
             session_id = db.create_session(user_id)
             st.session_state.user_id = user_id
@@ -60,10 +95,28 @@ class ChatBot:
         else:
             st.error("Invalid credentials")
 
+    def handle_api_login(self, username, password):
+        try:
+            result = self.api.login(username, password)
+        except APIError as e:
+            st.error("Invalid credentials" if e.status_code == 401 else e.detail)
+            return
+        st.session_state.user_id = result["user_id"]
+        st.session_state.session_id = result["session_id"]
+        st.success("Login successful!")
+        st.rerun()
+
     def handle_registration(self, username, password):
         if not username or not password:
             st.error("Please enter username and password")
             return
+        if self.api:
+            try:
+                self.api.register(username, password)
+                st.success("Registration successful! Please login")
+            except APIError as e:
+                st.error("Username already exists" if e.status_code == 409 else e.detail)
+            return
         try:
             user_id = db.create_user(username, password)
             st.success("Registration successful! Please login")
@@ -71,36 +124,114 @@ class ChatBot:
             st.error("Username already exists")
 
     def logout(self):
+        if st.session_state.session_id:
+            if self.api:
+                try:
+                    self.api.logout(st.session_state.session_id)
+                except APIError:
+                    pass  # Already expired
+            else:
+                db.delete_session(st.session_state.session_id)
         st.session_state.user_id = None
         st.session_state.session_id = None
+        st.session_state.conversation_id = None
         st.session_state.history = []
+        st.session_state.conversation_summary = ""
+        st.session_state.conversation_folded = 0
+        st.session_state.vector_store = None
         st.rerun()
 
     def process_user_input(self, prompt):
-        # Rate limiting check
-        if not db.check_rate_limit(st.session_state.user_id, limit=10, window=60):
-            st.error("Rate limit exceeded (10 requests/minute)")
+        # Rate limiting check (the API server applies its own)
+        # Guests are limited per browser session, not as one shared bucket
+        rate_key = st.session_state.user_id or f"anon:{st.session_state.anonymous_id}"
+        if not self.api and not rate_limiter.allow(rate_key):
+            st.error(
+                f"Rate limit exceeded ({config['rate_limit']} requests per "
+                f"{config['rate_window']} seconds)"
+            )
             return
             
+        # Earlier turns, read before this prompt joins them
+        history = self.conversation_history()
+        st.session_state.history.append({"role": "user", "content": prompt})
+        # Signed-in chats are saved here, or by the API server when it is used
+        save = not self.api and st.session_state.user_id
+
         # Save user message
-        db.save_message(st.session_state.user_id, "user", prompt)
+        if save:
+            db.save_message(
+                st.session_state.user_id, "user", prompt, st.session_state.conversation_id
+            )
         
-        # Existing processing
-        try:
-            response = self.generate_response(prompt)
-            # Save assistant response
-            db.save_message(st.session_state.user_id, "assistant", response)
-        except Exception as e:
-            logger.error(f"API Error: {str(e)}")
-            st.error("Failed to generate response. Please try again.")
+        with st.chat_message("user"):
+            st.markdown(prompt)
+
+        with st.chat_message("assistant"):
+            try:
+                with span("chat_request", model=st.session_state.model_name):
+                    response = self.generate_response(prompt, history)
+                st.session_state.history.append({"role": "assistant", "content": response})
+                # Save assistant response
+                if save:
+                    db.save_message(
+                        st.session_state.user_id, "assistant", response, st.session_state.conversation_id
+                    )
+            except Exception as e:
+                logger.error(f"API Error: {str(e)}")
+                st.error("Failed to generate response. Please try again.")
 
     def render_chat_interface(self):
-        # Load history from database
-        if st.session_state.user_id:
-            history = db.get_history(st.session_state.user_id)
-            st.session_state.history = history[::-1]  # Reverse for display
+        # Load only the active conversation from the database
+        if st.session_state.user_id and self.api:
+            self.load_api_history()
+        elif st.session_state.user_id:
+            if st.session_state.conversation_id is None:
+                st.session_state.conversation_id = db.get_active_conversation(
+                    st.session_state.user_id
+                )
+            st.session_state.history = db.get_history(
+                st.session_state.user_id,
+                limit=config['max_history'],
+                conversation_id=st.session_state.conversation_id
+            )
+
+        st.title(config['app_title'])
+        st.markdown(config['app_description'])
+
+        for message in st.session_state.history:
+            with st.chat_message(message["role"]):
+                st.markdown(message["content"])
+
+        if prompt := st.chat_input("Ask me anything..."):
+            self.process_user_input(prompt)
+
+    def load_api_history(self):
+        try:
+            if st.session_state.conversation_id is None:
+                # Until the server starts one, the first chat message picks
+                # the active conversation
+                conversations = self.api.conversations(st.session_state.session_id, limit=1)
+                if conversations:
+                    st.session_state.conversation_id = conversations[0]["id"]
+            if st.session_state.conversation_id is not None:
+                st.session_state.history = self.api.history(
+                    st.session_state.session_id,
+                    st.session_state.conversation_id,
+                    limit=config['max_history']
+                )
+        except APIError as e:
+            if e.status_code == 401:
+                st.session_state.user_id = None
+                st.session_state.session_id = None
+                st.session_state.conversation_id = None
+                st.warning("Your session has expired. Please login again")
+            else:
+                st.error(e.detail)
 
     def initialize_session(self):
+        if "anonymous_id" not in st.session_state:
+            st.session_state.anonymous_id = uuid.uuid4().hex
         if "history" not in st.session_state:
             st.session_state.history = []
         if "dataset" not in st.session_state:
@@ -113,8 +244,9 @@ class ChatBot:
             st.title("Configuration")
             st.session_state.model_name = st.selectbox(
                 "Select Model",
-                config['available_models'],
-                index=0
+                config['available_models'] + [AUTO_MODEL],
+                index=0,
+                help="auto picks a model per request from prompt size and recent latency"
             )
             st.session_state.temperature = st.slider(
                 "Temperature", 0.0, 1.0, config['default_temp'], 0.1
@@ -132,65 +264,112 @@ class ChatBot:
             type=["pdf", "txt", "csv"],
             accept_multiple_files=True
         )
-        if uploaded_files:
-            with st.spinner("Processing documents..."):
-                st.session_state.dataset = self.data_processor.process_files(uploaded_files)
-                st.session_state.vector_store = self.data_processor.create_vector_store(
-                    st.session_state.dataset
-                )
-            st.success(f"Processed {len(uploaded_files)} files!")
-
-    def render_user_auth(self):
-        st.subheader("User Authentication")
-        username = st.text_input("Username")
-        password = st.text_input("Password", type="password")
-        if st.button("Login"):
-            # Implement proper authentication logic
-            st.success(f"Welcome {username}!")
-
-    def render_chat_interface(self):
-        st.title(config['app_title'])
-        st.markdown(config['app_description'])
-
-        for message in st.session_state.history:
-            with st.chat_message(message["role"]):
-                st.markdown(message["content"])
+        if uploaded_files and self.api and not st.session_state.session_id:
+            st.warning("Please login to upload documents")
+        elif uploaded_files and self.api:
+            # The uploader returns the same files on every rerun; send each
+            # file once per session
+            sent = st.session_state.setdefault("uploaded_files", set())
+            keys = {
+                file.name: (st.session_state.session_id, file.name, hashlib.sha256(file.getvalue()).hexdigest())
+                for file in uploaded_files
+            }
+            new_files = [file for file in uploaded_files if keys[file.name] not in sent]
+            if new_files:
+                with st.spinner("Processing documents..."):
+                    summary = self.api.ingest(new_files, st.session_state.session_id)
+                sent.update(keys[file.name] for file in new_files)
+                for error in summary["errors"]:
+                    st.error(f"Failed to process {error}")
+                st.success(f"Processed {len(new_files)} files!")
+        elif uploaded_files:
+            progress = st.progress(0.0, text="Processing documents...")
 
-        if prompt := st.chat_input("Ask me anything..."):
-            self.process_user_input(prompt)
+            def report(done, total, chunks):
+                progress.progress(done / total, text=f"Processed {done}/{total} files ({chunks} chunks)")
 
-    def process_user_input(self, prompt):
-        st.session_state.history.append({"role": "user", "content": prompt})
-        
-        with st.chat_message("user"):
-            st.markdown(prompt)
+            vector_store, summary = self.data_processor.ingest(
+                uploaded_files, self.knowledge_base_id(), report
+            )
+            st.session_state.vector_store = vector_store
+            progress.empty()
+            for error in summary["errors"]:
+                st.error(f"Failed to process {error}")
+            st.success(f"Processed {len(uploaded_files)} files!")
+            if summary["parsed_files"]:
+                st.caption(
+                    f"{summary['chunks']} chunks in {summary['seconds']:.1f}s "
+                    f"({summary['files_per_sec']:.1f} files/s, {summary['chunks_per_sec']:.0f} chunks/s)"
+                )
+            if summary.get("duplicate_chunks"):
+                st.caption(
+                    f"Skipped {summary['duplicate_chunks']} duplicate chunks "
+                    f"(~{summary['embedding_seconds_saved']:.1f}s of embedding saved)"
+                )
 
-        with st.chat_message("assistant"):
-            try:
-                response = self.generate_response(prompt)
-                st.session_state.history.append({"role": "assistant", "content": response})
-            except Exception as e:
-                logger.error(f"API Error: {str(e)}")
-                st.error("Failed to generate response. Please try again.")
+    def knowledge_base_id(self):
+        return st.session_state.user_id or DEFAULT_KB_ID
 
-    def generate_response(self, prompt):
-        context = ""
-        if st.session_state.vector_store:
-            context = self.data_processor.retrieve_context(
-                prompt, 
-                st.session_state.vector_store,
-                top_k=config['retrieval_top_k']
+    def conversation_history(self):
+        # Recent turns verbatim plus a running summary of older ones
+        if self.api:
+            # The API keeps signed-in history itself; anonymous chats send theirs
+            if st.session_state.session_id:
+                return None
+            return st.session_state.history[-self.conversation.recent_messages:]
+        model_name = self.chat_service.resolve_model(st.session_state.model_name)
+        if st.session_state.user_id and st.session_state.conversation_id:
+            return self.conversation.for_conversation(
+                st.session_state.user_id, st.session_state.conversation_id, model_name
             )
+        return self.conversation.for_session(st.session_state.history, st.session_state, model_name)
+
+    def generate_response(self, prompt, history=None):
+        if self.api:
+            return self.stream_from_api(prompt, history)
 
-        full_prompt = f"Context: {context}\n\nQuestion: {prompt}\n\nAnswer:"
+        turn = self.chat_service.prepare(
+            prompt,
+            self.knowledge_base_id(),
+            st.session_state.model_name,
+            st.session_state.temperature,
+            st.session_state.max_tokens,
+            history
+        )
+        if turn["cached"] is not None:
+            return self.model_handler.replay(turn["cached"])
         
-        return self.model_handler.generate(
-            prompt=full_prompt,
-            model_name=st.session_state.model_name,
+        response = self.model_handler.generate(
+            prompt=turn["prompt"],
+            model_name=turn["model_name"],
+            temperature=turn["temperature"],
+            max_tokens=turn["max_tokens"],
+            stream=True,
+            history=turn["history"],
+            fallbacks=turn["fallbacks"]
+        )
+        self.chat_service.finish(turn, response, self.model_handler.last_metrics)
+        return response
+
+    def stream_from_api(self, prompt, history=None):
+        renderer = StreamRenderer(config.get('stream_fps', 15), config.get('stream_flush_tokens', 32))
+        for event, data in self.api.stream_chat(
+            prompt,
+            st.session_state.session_id,
+            conversation_id=st.session_state.conversation_id,
+            model=st.session_state.model_name,
             temperature=st.session_state.temperature,
             max_tokens=st.session_state.max_tokens,
-            stream=True
-        )
+            history=history
+        ):
+            if event == "delta":
+                renderer.write(data["text"])
+            elif event == "meta" and data["conversation_id"]:
+                st.session_state.conversation_id = data["conversation_id"]
+            elif event == "error":
+                raise RuntimeError(data["detail"])
+        renderer.flush(final=True)
+        return renderer.text()
 
 if __name__ == "__main__":
     st.set_page_config(page_title="Enterprise AI Chatbot", layout="wide")
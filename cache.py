@@ -0,0 +1,81 @@
+# cache.py (Bounded LRU/TTL Caches)
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+
+def _default_sizeof(value):
+    nbytes = getattr(value, "nbytes", None)
+    if nbytes is not None:
+        return nbytes
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(_default_sizeof(item) for item in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(_default_sizeof(item) for item in value.values())
+    return sys.getsizeof(value)
+
+
+class LRUTTLCache:
+    def __init__(self, maxsize=1024, ttl=3600, sizeof=_default_sizeof):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.sizeof = sizeof
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, expires_at, size = entry
+                if time.monotonic() < expires_at:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                self._remove(key)
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            size = self.sizeof(value)
+            self._data[key] = (value, time.monotonic() + self.ttl, size)
+            self._bytes += size
+            while len(self._data) > self.maxsize:
+                self._remove(next(iter(self._data)))
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+
+    def invalidate(self, predicate=None):
+        with self._lock:
+            keys = [k for k in self._data if predicate is None or predicate(k)]
+            for key in keys:
+                self._remove(key)
+
+    def _remove(self, key):
+        _, _, size = self._data.pop(key)
+        self._bytes -= size
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / total if total else 0.0,
+                "evictions": self.evictions,
+                "memory_bytes": self._bytes,
+            }
@@ -0,0 +1,203 @@
+# chat_service.py (UI-Independent Chat, Retrieval and Ingestion Flows)
+import asyncio
+import logging
+from context_builder import ContextAssembler
+from conversation import ConversationContext
+from data_processor import DataProcessor
+from database import get_database
+from groq_client import get_client_pool
+from model_handler import BufferRenderer, GroqModelHandler
+from model_router import AUTO_MODEL, get_model_router
+from rate_limiter import get_rate_limiter
+from response_cache import get_response_cache
+from retention import get_retention_manager
+from vector_store_registry import DEFAULT_KB_ID
+
+logger = logging.getLogger("chatbot")
+
+
+class UploadedDocument:
+    # Mimics the Streamlit UploadedFile attributes the ingestion pipeline reads
+    def __init__(self, name, type, data):
+        self.name = name
+        self.type = type
+        self._data = data
+
+    def getvalue(self):
+        return self._data
+
+
+class ChatService:
+    # Everything a chat turn needs, without Streamlit: the Streamlit app uses
+    # it in-process and api_server.py exposes it over HTTP. It keeps no
+    # per-user state of its own; conversations live in the database and
+    # knowledge bases in the vector store, so any worker can serve any request.
+    def __init__(self, config, db=None):
+        self.config = config
+        self.db = db or get_database()
+        self.client_pool = get_client_pool(config)
+        self.data_processor = DataProcessor(config)
+        self.context_assembler = ContextAssembler(config)
+        self.rate_limiter = get_rate_limiter(config, self.db)
+        self.router = get_model_router(config)
+        self.conversation = ConversationContext(self.db, self.model_handler(), config)
+        self.retention = get_retention_manager(config, self.db)
+
+    def model_handler(self):
+        # Handlers record last_metrics, so concurrent turns each get their own
+        return GroqModelHandler(
+            self.client_pool,
+            stream_fps=self.config.get("stream_fps", 15),
+            flush_tokens=self.config.get("stream_flush_tokens", 32),
+            renderer=BufferRenderer,
+            router=self.router
+        )
+
+    def knowledge_base_id(self, user_id):
+        return user_id or DEFAULT_KB_ID
+
+    def retrieve(self, question, kb_id=DEFAULT_KB_ID, top_k=None):
+        vector_store = self.data_processor.get_vector_store(kb_id, create=False)
+        if vector_store is None:
+            return ()
+        chunks = self.data_processor.retrieve_documents(
+            question,
+            vector_store,
+            top_k=top_k or self.config['retrieval_top_k'],
+            kb_id=kb_id
+        )
+        dedup = self.data_processor.dedup_index(kb_id, vector_store)
+        if dedup is None:
+            return chunks
+        # A deduplicated chunk stands for every file it was found in
+        return tuple(
+            (content, dict(metadata or {}, sources=dedup.sources(content)))
+            for content, metadata in chunks
+        )
+
+    def ingest(self, uploads, kb_id=DEFAULT_KB_ID, progress_callback=None):
+        return self.data_processor.ingest(uploads, kb_id, progress_callback)
+
+    def resolve_model(self, model_name):
+        # "auto" picks a model per request; summaries just take the best one
+        return self.router.resolve(model_name)
+
+    def prepare(self, question, kb_id, model_name, temperature, max_tokens, history=None):
+        # Retrieval, prompt assembly and the semantic cache lookup. Returns a
+        # turn dict; if turn["cached"] is set the model does not need to run.
+        # With model_name "auto" the router orders the models and the prompt
+        # is packed for each, so the model handler can fall back mid-request.
+        chunks = self.retrieve(question, kb_id)
+        context = "\n".join(content for content, _ in chunks)
+
+        fallbacks = []
+        # Every attempt is sent the same history, so it is trimmed as far as
+        # the tightest model needs
+        history_dropped = 0
+        if model_name == AUTO_MODEL:
+            model_name, *others = self.router.rank(question, chunks, history, max_tokens)
+            self.router.routed(model_name)
+            for other in others:
+                other_prompt, other_max_tokens, other_packing = self.context_assembler.build(
+                    question, chunks, other, max_tokens, history
+                )
+                fallbacks.append((other, other_prompt, other_max_tokens))
+                history_dropped = max(history_dropped, other_packing["history_dropped"])
+
+        prompt, max_tokens, packing = self.context_assembler.build(
+            question, chunks, model_name, max_tokens, history
+        )
+        history_dropped = max(history_dropped, packing["history_dropped"])
+        if history_dropped:
+            logger.info(f"Dropped {history_dropped} oldest history messages to fit the context window")
+            history = history[history_dropped:]
+        logger.info(
+            f"Packed {packing['packed_chunks']}/{packing['retrieved_chunks']} chunks "
+            f"({packing['context_tokens']}/{packing['budget_tokens']} tokens), "
+            f"history={packing['history_tokens']} tokens, max_tokens={max_tokens}"
+        )
+        # A follow-up only matches answers given after the same earlier turns
+        if history:
+            context = "\n".join(message["content"] for message in history) + "\n" + context
+
+        turn = {
+            "prompt": prompt,
+            "model_name": model_name,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "fallbacks": fallbacks,
+            "history": history,
+            "packing": packing,
+            "context": context,
+            "embedding": None,
+            "cached": None,
+        }
+
+        # Near-identical questions over the same context reuse a prior answer
+        response_cache = get_response_cache(self.config)
+        if response_cache.is_cacheable(temperature):
+            turn["embedding"] = self.data_processor.embed_query(question)
+            turn["cached"] = response_cache.lookup(turn["embedding"], context, model_name, temperature)
+        return turn
+
+    def finish(self, turn, answer, metrics):
+        if turn["embedding"] is not None and turn["cached"] is None:
+            get_response_cache(self.config).store(
+                turn["embedding"], turn["context"], metrics["model"], turn["temperature"], answer,
+                seconds=metrics["total_seconds"], tokens=metrics["tokens"]
+            )
+
+    async def achat(self, question, user_id=None, conversation_id=None, model_name=None,
+                    temperature=None, max_tokens=None, history=None):
+        # Async generator of (event, data) pairs: one "meta", then "delta"
+        # events with answer text, then "done". Signed-in users get their
+        # conversation loaded and saved; anonymous callers pass their own
+        # recent history. Rate limits are checked by the caller beforehand.
+        model_name = model_name or self.config['available_models'][0]
+        summary_model = self.resolve_model(model_name)
+        temperature = self.config['default_temp'] if temperature is None else temperature
+        max_tokens = max_tokens or self.config['default_max_tokens']
+
+        if user_id:
+            if conversation_id is None:
+                conversation_id = await asyncio.to_thread(self.db.get_active_conversation, user_id)
+            elif not await asyncio.to_thread(self.db.owns_conversation, user_id, conversation_id):
+                raise PermissionError("Conversation not found")
+            history = await asyncio.to_thread(
+                self.conversation.for_conversation, user_id, conversation_id, summary_model
+            )
+            self.db.save_message(user_id, "user", question, conversation_id)
+        else:
+            history = list(history or [])[-self.conversation.recent_messages:]
+
+        turn = await asyncio.to_thread(
+            self.prepare, question, self.knowledge_base_id(user_id), model_name,
+            temperature, max_tokens, history
+        )
+        yield "meta", {
+            "conversation_id": conversation_id,
+            "model": turn["model_name"],
+            "max_tokens": turn["max_tokens"],
+            "packing": turn["packing"],
+            "cached": turn["cached"] is not None,
+        }
+
+        if turn["cached"] is not None:
+            answer = turn["cached"]
+            metrics = None
+            yield "delta", {"text": answer}
+        else:
+            model_handler = self.model_handler()
+            parts = []
+            async for delta in model_handler.astream(
+                turn["prompt"], turn["model_name"], temperature, turn["max_tokens"], turn["history"], turn["fallbacks"]
+            ):
+                parts.append(delta)
+                yield "delta", {"text": delta}
+            answer = "".join(parts)
+            metrics = model_handler.last_metrics
+            await asyncio.to_thread(self.finish, turn, answer, metrics)
+
+        if user_id:
+            self.db.save_message(user_id, "assistant", answer, conversation_id)
+        yield "done", {"conversation_id": conversation_id, "metrics": metrics}
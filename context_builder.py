@@ -0,0 +1,174 @@
+# context_builder.py (Token-Budgeted Context Assembly)
+import math
+import re
+from telemetry import span
+
+PROMPT_TEMPLATE = "Context: {context}\n\nQuestion: {question}\n\nAnswer:"
+DEFAULT_LIMITS = {"context_window": 8192, "context_budget": 3000, "chars_per_token": 3.5}
+DEFAULT_RESERVE_TOKENS = 256
+MIN_OVERLAP = 20
+MAX_OVERLAP = 400
+MIN_ANSWER_TOKENS = 256
+MESSAGE_OVERHEAD_TOKENS = 4
+TRUNCATION_MARKER = "\n[...]\n"
+
+_PIECES = re.compile(r"\w+|[^\w\s]")
+
+
+class ContextAssembler:
+    # Token counts are estimates: words are split into pieces of roughly
+    # chars_per_token characters (per model, from config.json) and every
+    # punctuation mark counts as its own token. The reserve absorbs the error.
+    def __init__(self, config=None):
+        config = config or {}
+        self.model_limits = config.get("model_limits", {})
+        self.reserve_tokens = config.get("context_reserve_tokens", DEFAULT_RESERVE_TOKENS)
+
+    def limits(self, model_name):
+        return {**DEFAULT_LIMITS, **self.model_limits.get(model_name, {})}
+
+    def count_tokens(self, text, model_name):
+        chars_per_token = self.limits(model_name)["chars_per_token"]
+        return sum(math.ceil(len(piece) / chars_per_token) for piece in _PIECES.findall(text))
+
+    def truncate(self, text, max_tokens, model_name):
+        # Keeps the start and the end of text, about max_tokens in total, and
+        # drops the middle: a long paste usually says what is wanted first
+        # or last
+        chars_per_token = self.limits(model_name)["chars_per_token"]
+        costs = [
+            (match.start(), match.end(), math.ceil(len(match.group()) / chars_per_token))
+            for match in _PIECES.finditer(text)
+        ]
+        if sum(cost for _, _, cost in costs) <= max_tokens:
+            return text
+        budget = max(max_tokens - self.count_tokens(TRUNCATION_MARKER, model_name), 0)
+        head = tail = 0
+        used = 0
+        for _, end, cost in costs:
+            if used + cost > budget // 2:
+                break
+            head, used = end, used + cost
+        for start, _, cost in reversed(costs):
+            if used + cost > budget or start < head:
+                break
+            tail, used = start, used + cost
+        tail = tail or len(text)
+        return text[:head] + TRUNCATION_MARKER + text[tail:]
+
+    def build(self, question, chunks, model_name, max_tokens, history=None):
+        # chunks: (content, metadata) pairs, most relevant first. Returns the
+        # prompt, a max_tokens value that fits the model, and packing stats.
+        # Context gets up to context_budget tokens; the answer gets the rest
+        # of the window, capped at the requested max_tokens. Conversation
+        # history is sent ahead of the prompt, so it is paid for first; the
+        # oldest messages are dropped if it would not leave room for the
+        # answer, and stats["history_dropped"] says how many. Callers must
+        # send history[stats["history_dropped"]:] along with the prompt.
+        with span("assemble_prompt", model=model_name):
+            return self._build(question, chunks, model_name, max_tokens, history)
+
+    def _build(self, question, chunks, model_name, max_tokens, history):
+        limits = self.limits(model_name)
+        # A question that would leave no room for an answer is cut down
+        template_tokens = self.count_tokens(PROMPT_TEMPLATE.format(context="", question=""), model_name)
+        question_limit = limits["context_window"] - self.reserve_tokens - MIN_ANSWER_TOKENS - template_tokens
+        question_tokens = self.count_tokens(question, model_name)
+        if question_tokens > question_limit:
+            question = self.truncate(question, question_limit, model_name)
+        prompt_tokens = self.count_tokens(PROMPT_TEMPLATE.format(context="", question=question), model_name)
+
+        history_costs = [
+            self.count_tokens(message["content"], model_name) + MESSAGE_OVERHEAD_TOKENS
+            for message in history or ()
+        ]
+        history_limit = limits["context_window"] - self.reserve_tokens - MIN_ANSWER_TOKENS - prompt_tokens
+        history_tokens = sum(history_costs)
+        history_dropped = 0
+        while history_tokens > history_limit:
+            history_tokens -= history_costs[history_dropped]
+            history_dropped += 1
+        base_tokens = history_tokens + prompt_tokens
+        available = limits["context_window"] - base_tokens - self.reserve_tokens
+        budget = min(limits["context_budget"], available - MIN_ANSWER_TOKENS)
+
+        merged = merge_overlapping(chunks)
+        packed = []
+        used = 0
+        for rank, content in merged:
+            tokens = self.count_tokens(content, model_name) + 1  # newline separator
+            if used + tokens <= budget:
+                packed.append((rank, content))
+                used += tokens
+
+        max_tokens = max(min(max_tokens, available - used), 1)
+
+        # Keep the packed chunks in relevance order
+        context = "\n".join(content for _, content in sorted(packed))
+        stats = {
+            "retrieved_chunks": len(chunks),
+            "merged_chunks": len(merged),
+            "packed_chunks": len(packed),
+            "context_tokens": used,
+            "history_tokens": history_tokens,
+            "history_dropped": history_dropped,
+            "budget_tokens": max(budget, 0),
+            "max_tokens": max_tokens,
+            "question_tokens": question_tokens,
+            "question_truncated": question_tokens > question_limit,
+        }
+        return PROMPT_TEMPLATE.format(context=context, question=question), max_tokens, stats
+
+
+def _overlap(first, second):
+    # Length of the longest suffix of `first` that is a prefix of `second`
+    for size in range(min(len(first), len(second), MAX_OVERLAP), MIN_OVERLAP - 1, -1):
+        if first.endswith(second[:size]):
+            return size
+    return 0
+
+
+def merge_overlapping(chunks):
+    # Neighbouring splitter chunks from the same source repeat up to
+    # chunk_overlap characters; stitch them together and drop exact repeats so
+    # those tokens are only paid for once. Returns (rank, content) pairs where
+    # rank is the best relevance rank of the merged pieces.
+    entries = [
+        {"rank": rank, "source": (metadata or {}).get("source"), "content": content.strip()}
+        for rank, (content, metadata) in enumerate(chunks)
+    ]
+    # A merge can make two earlier entries overlap, so repeat until stable
+    while True:
+        merged = _merge_pass(entries)
+        if len(merged) == len(entries):
+            return [(entry["rank"], entry["content"]) for entry in merged]
+        entries = merged
+
+
+def _merge_pass(entries):
+    merged = []
+    for candidate in entries:
+        content = candidate["content"]
+        for entry in merged:
+            if entry["source"] != candidate["source"]:
+                continue
+            if content in entry["content"]:
+                break
+            if entry["content"] in content:
+                entry["content"] = content
+                break
+            if entry["source"] is None:
+                continue
+            size = _overlap(entry["content"], content)
+            if size:
+                entry["content"] += content[size:]
+                break
+            size = _overlap(content, entry["content"])
+            if size:
+                entry["content"] = content + entry["content"][size:]
+                break
+        else:
+            merged.append(dict(candidate))
+            continue
+        entry["rank"] = min(entry["rank"], candidate["rank"])
+    return merged
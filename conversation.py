@@ -0,0 +1,99 @@
+# conversation.py (Bounded Multi-Turn Context)
+import logging
+
+logger = logging.getLogger("chatbot")
+
+DEFAULT_RECENT_TURNS = 4
+DEFAULT_FOLD_TURNS = 4
+DEFAULT_SUMMARY_MAX_TOKENS = 256
+SUMMARY_PROMPT = (
+    "Update the running summary of a conversation between a user and an assistant. "
+    "Keep facts, names, decisions and open questions; drop pleasantries. "
+    "Answer with the updated summary only, in at most {words} words.\n\n"
+    "Current summary:\n{summary}\n\nNew messages:\n{messages}\n\nUpdated summary:"
+)
+
+
+class ConversationContext:
+    # The last `recent_turns` turns go to the model verbatim; anything older is
+    # folded into a running summary. Folding waits until `fold_turns` turns have
+    # aged out so the summarizer runs once per fold rather than once per
+    # request, and each fold only reads the summary plus the newly aged-out
+    # messages. The prompt therefore stays bounded however long the chat gets.
+    def __init__(self, db, model_handler, config=None):
+        config = config or {}
+        self.db = db
+        self.model_handler = model_handler
+        self.recent_messages = 2 * config.get("conversation_recent_turns", DEFAULT_RECENT_TURNS)
+        self.fold_messages = 2 * config.get("conversation_fold_turns", DEFAULT_FOLD_TURNS)
+        self.summary_max_tokens = config.get("summary_max_tokens", DEFAULT_SUMMARY_MAX_TOKENS)
+        self.folds = 0
+
+    def for_conversation(self, user_id, conversation_id, model_name):
+        # History for a persisted conversation; the summary lives in the
+        # conversation_summaries table next to chat_history
+        stored = self.db.get_summary(user_id, conversation_id) or {}
+        summary = stored.get("summary", "")
+        messages = self._unfolded(user_id, conversation_id, stored.get("folded_through_id"))
+
+        if len(messages) >= self.recent_messages + self.fold_messages:
+            if any(message["id"] is None for message in messages[:-self.recent_messages]):
+                # Messages still in the write-behind log have no id yet
+                self.db.flush()
+                messages = self._unfolded(user_id, conversation_id, stored.get("folded_through_id"))
+            aged, messages = messages[:-self.recent_messages], messages[-self.recent_messages:]
+            summary = self._fold(summary, aged, model_name)
+            self.db.save_summary(user_id, conversation_id, summary, aged[-1]["id"])
+
+        return self._messages(summary, messages)
+
+    def for_session(self, history, state, model_name):
+        # History for an anonymous chat kept in st.session_state; `state`
+        # holds the running summary and how many messages it already covers
+        summary = state.get("conversation_summary", "")
+        folded = state.get("conversation_folded", 0)
+        messages = history[folded:]
+
+        if len(messages) >= self.recent_messages + self.fold_messages:
+            aged, messages = messages[:-self.recent_messages], messages[-self.recent_messages:]
+            summary = self._fold(summary, aged, model_name)
+            state["conversation_summary"] = summary
+            state["conversation_folded"] = folded + len(aged)
+
+        return self._messages(summary, messages)
+
+    def _unfolded(self, user_id, conversation_id, folded_through_id):
+        # Bounded even if earlier folds failed: older stragglers are skipped
+        return self.db.get_history(
+            user_id,
+            limit=self.recent_messages + self.fold_messages,
+            conversation_id=conversation_id,
+            after_id=folded_through_id
+        )
+
+    def _fold(self, summary, messages, model_name):
+        transcript = "\n".join(f"{message['role']}: {message['content']}" for message in messages)
+        prompt = SUMMARY_PROMPT.format(
+            words=int(self.summary_max_tokens * 0.75),
+            summary=summary or "(none)",
+            messages=transcript
+        )
+        try:
+            summary = self.model_handler.complete(
+                [{"role": "user", "content": prompt}],
+                model_name,
+                temperature=0.0,
+                max_tokens=self.summary_max_tokens
+            ).strip()
+            self.folds += 1
+        except Exception as e:
+            # Keep the previous summary; the aged-out turns are dropped
+            logger.error(f"Summary Error: {str(e)}")
+        return summary
+
+    def _messages(self, summary, messages):
+        history = []
+        if summary:
+            history.append({"role": "system", "content": f"Summary of the earlier conversation: {summary}"})
+        history.extend({"role": message["role"], "content": message["content"]} for message in messages)
+        return history
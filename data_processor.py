@@ -1,33 +1,77 @@
 # data_processor.py (Data Management Layer)
-from langchain_community.document_loaders import PyPDFLoader, TextLoader, CSVLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import Chroma
-from langchain_huggingface import HuggingFaceEmbeddings
-import tempfile
+# Heavy dependencies (loaders, embedding model, ingestion workers) are imported
+# on the code paths that need them so the app starts without loading them.
+from cache import LRUTTLCache
+from telemetry import span
+from vector_store_registry import get_registry, collection_name, DEFAULT_KB_ID
+import threading
+
+# Query embeddings and retrieval results are shared by every session. Result
+# keys carry the collection version, which is bumped whenever documents are
+# added, so stale results are never served.
+_cache_lock = threading.Lock()
+_query_embedding_cache = None
+_retrieval_cache = None
+_collection_versions = {}
+
+
+def _get_caches(config):
+    global _query_embedding_cache, _retrieval_cache
+    if _retrieval_cache is None:
+        with _cache_lock:
+            if _retrieval_cache is None:
+                _query_embedding_cache = LRUTTLCache(
+                    maxsize=config.get("query_cache_size", 2048),
+                    ttl=config.get("query_cache_ttl", 3600)
+                )
+                _retrieval_cache = LRUTTLCache(
+                    maxsize=config.get("retrieval_cache_size", 1024),
+                    ttl=config.get("retrieval_cache_ttl", 600)
+                )
+    return _query_embedding_cache, _retrieval_cache
+
+
+def collection_version(kb_id):
+    return _collection_versions.get(collection_name(kb_id), 0)
+
+
+def bump_collection_version(kb_id):
+    store_key = collection_name(kb_id)
+    with _cache_lock:
+        _collection_versions[store_key] = _collection_versions.get(store_key, 0) + 1
+    if _retrieval_cache is not None:
+        _retrieval_cache.invalidate(lambda key: key[1] == store_key)
+
+
+def normalize_query(query):
+    return " ".join(query.lower().split())
+
+
+def cache_stats():
+    embedding_cache, retrieval_cache = _get_caches({})
+    return {
+        "query_embeddings": embedding_cache.stats(),
+        "retrieval_results": retrieval_cache.stats(),
+    }
 
 class DataProcessor:
-    def __init__(self):
-        self.embedder = HuggingFaceEmbeddings(
-        model_name="all-MiniLM-L6-v2",
-        model_kwargs={"device": "cpu"}  # Or "cuda" if you have GPU available
-        )
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200
-        )
+    def __init__(self, config=None):
+        self.config = config or {}
+
+    # The embedding model and splitter are process-wide singletons, loaded on
+    # first use, so constructing a DataProcessor on every rerun is cheap.
+    @property
+    def embedder(self):
+        from embeddings import get_embedder
+        return get_embedder(self.config)
 
-    def process_files(self, uploaded_files):
-        documents = []
-        
-        for file in uploaded_files:
-            with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-                temp_file.write(file.getvalue())
-                loader = self._get_loader(file.type, temp_file.name)
-                documents.extend(loader.load())
-        
-        return self.text_splitter.split_documents(documents)
+    @property
+    def text_splitter(self):
+        from embeddings import get_text_splitter
+        return get_text_splitter()
 
     def _get_loader(self, file_type, file_path):
+        from langchain_community.document_loaders import PyPDFLoader, TextLoader, CSVLoader
         loaders = {
             "application/pdf": PyPDFLoader,
             "text/plain": TextLoader,
@@ -35,13 +79,86 @@ class DataProcessor:
         }
         return loaders[file_type](file_path)
 
-    def create_vector_store(self, documents):
-        return Chroma.from_documents(
-            documents=documents,
-            embedding=self.embedder,
-            persist_directory="./chroma_db"
+    # Each knowledge base (tenant) lives in its own persisted collection
+    def get_vector_store(self, kb_id=DEFAULT_KB_ID, create=True):
+        registry = get_registry(self.config)
+        # Don't load the embedding model just to find there is no store
+        if not create and not registry.exists(kb_id):
+            return None
+        return registry.get(kb_id, self.embedder, create=create)
+
+    # Repeated boilerplate and rows are caught before they reach the embedder
+    def dedup_index(self, kb_id=DEFAULT_KB_ID, vector_store=None):
+        if not self.config.get("dedup_enabled", True):
+            return None
+        from dedup import get_dedup_index
+        return get_dedup_index(collection_name(kb_id), vector_store, self.config)
+
+    def ingest(self, uploaded_files, kb_id=DEFAULT_KB_ID, progress_callback=None):
+        from ingestion import IngestionPipeline, DEFAULT_WORKERS, DEFAULT_BATCH_SIZE, DEFAULT_QUEUE_SIZE
+        vector_store = self.get_vector_store(kb_id)
+        pipeline = IngestionPipeline(
+            workers=self.config.get("ingest_workers", DEFAULT_WORKERS),
+            batch_size=self.config.get("ingest_batch_size", DEFAULT_BATCH_SIZE),
+            queue_size=self.config.get("ingest_queue_size", DEFAULT_QUEUE_SIZE),
+            progress_callback=progress_callback,
+            dedup=self.dedup_index(kb_id, vector_store)
         )
+        summary = pipeline.run(uploaded_files, vector_store, collection_name(kb_id))
+        if summary["chunks"]:
+            bump_collection_version(kb_id)
+        return vector_store, summary
+
+    def delete_source(self, source, kb_id=DEFAULT_KB_ID):
+        registry = get_registry(self.config)
+        vector_store = registry.get(kb_id, self.embedder, create=False)
+        dedup = self.dedup_index(kb_id, vector_store) if vector_store is not None else None
+        handovers = []
+        if dedup is not None:
+            # Chunks this file shared with others stay, under one of those
+            stored = vector_store.get(where={"source": source})["documents"]
+            handovers = dedup.remove_source(source, stored)
+
+        deleted = registry.delete_source(kb_id, self.embedder, source)
+        if handovers:
+            from langchain_core.documents import Document
+            vector_store.add_documents([
+                Document(page_content=text, metadata={"source": new_source, "content_hash": content_hash})
+                for text, new_source, content_hash in handovers
+            ])
+        if deleted:
+            from ingestion_cache import get_ingestion_cache
+            # Let the file be ingested again if it is re-uploaded
+            get_ingestion_cache().forget_indexed(collection_name(kb_id))
+            bump_collection_version(kb_id)
+        return deleted
+
+    def embed_query(self, query):
+        embedding_cache, _ = _get_caches(self.config)
+        normalized = normalize_query(query)
+        embedding = embedding_cache.get(normalized)
+        if embedding is None:
+            with span("embed_query"):
+                embedding = tuple(self.embedder.embed_query(normalized))
+            embedding_cache.put(normalized, embedding)
+        return embedding
+
+    def retrieve_documents(self, query, vector_store, top_k=3, kb_id=DEFAULT_KB_ID):
+        # Returns (content, metadata) pairs, most relevant first
+        _, retrieval_cache = _get_caches(self.config)
+        normalized = normalize_query(query)
+        key = (normalized, collection_name(kb_id), collection_version(kb_id), top_k)
+
+        results = retrieval_cache.get(key)
+        if results is None:
+            embedding = self.embed_query(normalized)
+            with span("similarity_search", k=top_k):
+                documents = vector_store.similarity_search_by_vector(list(embedding), k=top_k)
+            results = tuple((doc.page_content, doc.metadata) for doc in documents)
+            retrieval_cache.put(key, results)
+
+        return results
 
-    def retrieve_context(self, query, vector_store, top_k=3):
-        results = vector_store.similarity_search(query, k=top_k)
-        return "\n".join([doc.page_content for doc in results])
+    def retrieve_context(self, query, vector_store, top_k=3, kb_id=DEFAULT_KB_ID):
+        results = self.retrieve_documents(query, vector_store, top_k, kb_id)
+        return "\n".join(content for content, _ in results)
@@ -1,162 +1,778 @@
-# database.py (New File)
-import sqlite3
-import bcrypt
-import os
-from datetime import datetime, timedelta
-from contextlib import contextmanager
-
-DATABASE_NAME = "chatbot.db"
-
-class DatabaseManager:
-    def __init__(self):
-        self._init_db()
-    
-    @contextmanager
-    def _get_connection(self):
-        conn = sqlite3.connect(DATABASE_NAME)
-        try:
-            yield conn
-        finally:
-            conn.close()
-
-    def _init_db(self):
-        with self._get_connection() as conn:
-            cursor = conn.cursor()
-            # Users table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    username TEXT UNIQUE NOT NULL,
-                    password_hash TEXT NOT NULL,
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            # Sessions table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS sessions (
-                    session_id TEXT PRIMARY KEY,
-                    user_id INTEGER,
-                    expires_at DATETIME,
-                    FOREIGN KEY(user_id) REFERENCES users(id)
-                )
-            ''')
-            
-            # Rate limits table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS rate_limits (
-                    user_id INTEGER PRIMARY KEY,
-                    request_count INTEGER DEFAULT 0,
-                    last_request DATETIME,
-                    FOREIGN KEY(user_id) REFERENCES users(id)
-                )
-            ''')
-            
-            # Chat history table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS chat_history (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER,
-                    role TEXT NOT NULL,
-                    content TEXT NOT NULL,
-                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY(user_id) REFERENCES users(id)
-                )
-            ''')
-            conn.commit()
-
-    # User management methods
-    def create_user(self, username, password):
-        with self._get_connection() as conn:
-            hashed = bcrypt.hashpw(password.encode(), bcrypt.gensalt())
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT INTO users (username, password_hash)
-                VALUES (?, ?)
-            ''', (username, hashed))
-            return cursor.lastrowid
-
-    def verify_user(self, username, password):
-        with self._get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT id, password_hash FROM users WHERE username = ?
-            ''', (username,))
-            result = cursor.fetchone()
-            if result and bcrypt.checkpw(password.encode(), result[1]):
-                return result[0]
-            return None
-
-    # Session management methods
-    def create_session(self, user_id, session_duration=3600):
-        session_id = os.urandom(16).hex()
-        expires_at = datetime.now() + timedelta(seconds=session_duration)
-        with self._get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT INTO sessions (session_id, user_id, expires_at)
-                VALUES (?, ?, ?)
-            ''', (session_id, user_id, expires_at))
-            return session_id
-
-    def validate_session(self, session_id):
-        with self._get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT user_id, expires_at FROM sessions WHERE session_id = ?
-            ''', (session_id,))
-            result = cursor.fetchone()
-            if result and datetime.now() < datetime.fromisoformat(result[1]):
-                return result[0]
-            return None
-
-    # Rate limiting methods
-    def check_rate_limit(self, user_id, limit=10, window=60):
-        with self._get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT request_count, last_request 
-                FROM rate_limits 
-                WHERE user_id = ?
-            ''', (user_id,))
-            result = cursor.fetchone()
-            
-            now = datetime.now()
-            if not result or (now - datetime.fromisoformat(result[1]) > timedelta(seconds=window)):
-                cursor.execute('''
-                    REPLACE INTO rate_limits (user_id, request_count, last_request)
-                    VALUES (?, 1, ?)
-                ''', (user_id, now))
-                conn.commit()
-                return True
-            elif result[0] < limit:
-                cursor.execute('''
-                    UPDATE rate_limits 
-                    SET request_count = request_count + 1, last_request = ?
-                    WHERE user_id = ?
-                ''', (now, user_id))
-                conn.commit()
-                return True
-            return False
-
-    # Chat history methods
-    def save_message(self, user_id, role, content):
-        with self._get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT INTO chat_history (user_id, role, content)
-                VALUES (?, ?, ?)
-            ''', (user_id, role, content))
-            conn.commit()
-
-    def get_history(self, user_id, limit=100):
-        with self._get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT role, content 
-                FROM chat_history 
-                WHERE user_id = ? 
-                ORDER BY timestamp DESC 
-                LIMIT ?
-            ''', (user_id, limit))
-            return [{"role": row[0], "content": row[1]} for row in cursor.fetchall()]
+# database.py (New File)
+import sqlite3
+import bcrypt
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from contextlib import contextmanager
+from cache import LRUTTLCache
+import telemetry
+
+DATABASE_NAME = "chatbot.db"
+POOL_SIZE = 16
+WRITE_BATCH_SIZE = 64
+WRITE_FLUSH_INTERVAL = 0.5
+# Taking the write lock quicker than this did not wait on busy_timeout
+BUSY_WAIT_MIN_SECONDS = 0.001
+# bcrypt takes ~250 ms of CPU per hash at the default cost; at most
+# AUTH_WORKERS run at once and AUTH_QUEUE_SIZE more may wait for a worker
+AUTH_WORKERS = 4
+AUTH_QUEUE_SIZE = 32
+LOGIN_MAX_FAILURES = 5
+LOGIN_FAILURE_WINDOW = 300
+LOGIN_THROTTLE_MAX_NAMES = 100000
+SESSION_CACHE_SIZE = 10000
+SESSION_CACHE_TTL = 60
+SESSION_PURGE_INTERVAL = 600
+SESSION_PURGE_BATCH = 500
+
+logger = logging.getLogger("chatbot")
+
+# WAL lets readers run alongside the single writer; NORMAL sync is durable
+# across application crashes and only fsyncs at checkpoints.
+PRAGMAS = (
+    # Lets retention.py free pages a few at a time. It must come before WAL
+    # and only takes effect on a new database; for older ones see
+    # retention.enable_incremental_vacuum
+    "PRAGMA auto_vacuum=INCREMENTAL",
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=67108864",
+)
+
+# Schema migrations, applied in order; PRAGMA user_version records progress
+MIGRATIONS = [
+    # 1: conversation threads and indexes for keyset-paginated history
+    (
+        '''
+            CREATE TABLE IF NOT EXISTS conversations (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                title TEXT,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY(user_id) REFERENCES users(id)
+            )
+        ''',
+        "ALTER TABLE chat_history ADD COLUMN conversation_id INTEGER REFERENCES conversations(id)",
+        # Existing messages become one imported conversation per user
+        '''
+            INSERT INTO conversations (user_id, title)
+            SELECT DISTINCT user_id, 'Imported history' FROM chat_history WHERE user_id IS NOT NULL
+        ''',
+        '''
+            UPDATE chat_history SET conversation_id = (
+                SELECT id FROM conversations WHERE conversations.user_id = chat_history.user_id
+            )
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_chat_history_user ON chat_history(user_id, id)",
+        "CREATE INDEX IF NOT EXISTS idx_chat_history_conversation ON chat_history(user_id, conversation_id, id)",
+        "CREATE INDEX IF NOT EXISTS idx_conversations_user ON conversations(user_id, id)",
+    ),
+    # 2: per-window counters for the atomic sliding-window rate limiter
+    (
+        '''
+            CREATE TABLE IF NOT EXISTS rate_limit_windows (
+                key TEXT NOT NULL,
+                window_start INTEGER NOT NULL,
+                request_count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (key, window_start)
+            ) WITHOUT ROWID
+        ''',
+    ),
+    # 3: running summaries of older conversation turns
+    (
+        '''
+            CREATE TABLE IF NOT EXISTS conversation_summaries (
+                conversation_id INTEGER PRIMARY KEY,
+                user_id INTEGER,
+                summary TEXT NOT NULL,
+                folded_through_id INTEGER NOT NULL,
+                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY(conversation_id) REFERENCES conversations(id)
+            )
+        ''',
+    ),
+    # 4: expired-session purges
+    (
+        "CREATE INDEX IF NOT EXISTS idx_sessions_expires_at ON sessions(expires_at)",
+    ),
+    # 5: byte ranges of archived messages in the compressed segment files
+    (
+        '''
+            CREATE TABLE IF NOT EXISTS archive_segments (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                segment TEXT NOT NULL,
+                byte_offset INTEGER NOT NULL,
+                byte_length INTEGER NOT NULL,
+                first_id INTEGER NOT NULL,
+                last_id INTEGER NOT NULL,
+                message_count INTEGER NOT NULL,
+                archived_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_archive_segments_user ON archive_segments(user_id, last_id)",
+    ),
+]
+
+
+class ConnectionPool:
+    def __init__(self, database, size=POOL_SIZE, timeout=30.0):
+        self.database = database
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._metrics_lock = threading.Lock()
+        self.wait_seconds = 0.0
+        self.lock_errors = 0
+        self.write_transactions = 0
+        self.busy_waits = 0
+        self.busy_seconds = 0.0
+        self.query_stats = {}
+
+    def _connect(self):
+        # cached_statements keeps prepared statements around for reuse
+        conn = sqlite3.connect(
+            self.database,
+            timeout=self.timeout,
+            check_same_thread=False,
+            cached_statements=256
+        )
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                create = True
+            else:
+                create = False
+        if create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        start = time.perf_counter()
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise RuntimeError("Database connection pool exhausted")
+        finally:
+            self._record_wait(time.perf_counter() - start)
+
+    @contextmanager
+    def connection(self, name=None, write=False):
+        # write: take the write lock up front with BEGIN IMMEDIATE, so the
+        # time SQLite spends in busy_timeout is measured on its own
+        conn = self._acquire()
+        start = time.perf_counter()
+        try:
+            if write:
+                conn.execute("BEGIN IMMEDIATE")
+                self._record_busy(time.perf_counter() - start)
+            yield conn
+            conn.commit()
+        except sqlite3.OperationalError as e:
+            conn.rollback()
+            if "locked" in str(e):
+                with self._metrics_lock:
+                    self.lock_errors += 1
+            raise
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            self._idle.put(conn)
+            if name:
+                self._record_query(name, time.perf_counter() - start)
+
+    def _record_wait(self, elapsed):
+        with self._metrics_lock:
+            self.wait_seconds += elapsed
+
+    def _record_busy(self, elapsed):
+        with self._metrics_lock:
+            self.write_transactions += 1
+            if elapsed >= BUSY_WAIT_MIN_SECONDS:
+                self.busy_waits += 1
+                self.busy_seconds += elapsed
+        telemetry.record("db.busy_wait", elapsed)
+
+    def _record_query(self, name, elapsed):
+        with self._metrics_lock:
+            stats = self.query_stats.setdefault(name, {"count": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+            stats["count"] += 1
+            stats["total_seconds"] += elapsed
+            stats["max_seconds"] = max(stats["max_seconds"], elapsed)
+        telemetry.record(f"db.{name}", elapsed)
+
+    def metrics(self):
+        with self._metrics_lock:
+            queries = {
+                name: dict(stats, avg_seconds=stats["total_seconds"] / stats["count"])
+                for name, stats in self.query_stats.items()
+            }
+            return {
+                "connections": self._created,
+                "idle": self._idle.qsize(),
+                "pool_wait_seconds": self.wait_seconds,
+                "lock_errors": self.lock_errors,
+                "write_transactions": self.write_transactions,
+                "busy_waits": self.busy_waits,
+                "busy_wait_seconds": self.busy_seconds,
+                "queries": queries,
+            }
+
+
+# Pools are shared per database file across every session in the process
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(database=DATABASE_NAME):
+    with _pools_lock:
+        pool = _pools.get(database)
+        if pool is None:
+            pool = _pools[database] = ConnectionPool(database)
+        return pool
+
+
+class MessageWriter:
+    # Write-behind log for chat_history: messages from every session are
+    # queued and inserted with one executemany transaction when a batch fills
+    # up or the flush interval passes, instead of one commit per message.
+    def __init__(self, pool, batch_size=WRITE_BATCH_SIZE, flush_interval=WRITE_FLUSH_INTERVAL):
+        self.pool = pool
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._pending = []
+        self._pending_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        # Held while a batch moves from _pending into the table, so readers
+        # never see a message twice or miss it
+        self.visibility_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        self.batches = 0
+        self.written = 0
+        self._thread = threading.Thread(target=self._run, name="message-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def enqueue(self, user_id, role, content, conversation_id):
+        timestamp = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+        with self._pending_lock:
+            self._pending.append((user_id, role, content, timestamp, conversation_id))
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self._wake.set()
+
+    def has_pending(self, user_id):
+        with self._pending_lock:
+            return any(row[0] == user_id for row in self._pending)
+
+    def pending_for(self, user_id, conversation_id=None):
+        with self._pending_lock:
+            return [
+                {"id": None, "role": row[1], "content": row[2]}
+                for row in self._pending
+                if row[0] == user_id and (conversation_id is None or row[4] == conversation_id)
+            ]
+
+    def flush(self):
+        with self._write_lock:
+            with self._pending_lock:
+                batch = list(self._pending)
+            if not batch:
+                return
+            with self.visibility_lock:
+                with self.pool.connection("save_message_batch", write=True) as conn:
+                    conn.executemany('''
+                        INSERT INTO chat_history (user_id, role, content, timestamp, conversation_id)
+                        VALUES (?, ?, ?, ?, ?)
+                    ''', batch)
+                with self._pending_lock:
+                    del self._pending[:len(batch)]
+            self.batches += 1
+            self.written += len(batch)
+
+    def _run(self):
+        while not self._closed:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                # Messages stay queued and are retried on the next cycle
+                logger.error(f"Chat history flush failed: {str(e)}")
+
+    def close(self):
+        self._closed = True
+        self._wake.set()
+        self.flush()
+
+
+_writers = {}
+# Databases whose schema is known to be current in this process
+_initialized = set()
+_init_lock = threading.Lock()
+_login_throttles = {}
+_session_caches = {}
+
+
+class AuthWorkers:
+    # bcrypt releases the GIL, so a small thread pool bounds how much CPU
+    # password hashing can take; a login storm gets "busy" errors instead
+    # of starving every other session.
+    def __init__(self, workers=AUTH_WORKERS, queue_size=AUTH_QUEUE_SIZE):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="auth")
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+
+    def run(self, func, *args, timeout=30.0):
+        if not self._slots.acquire(timeout=timeout):
+            raise RuntimeError("Authentication is busy, please try again")
+        try:
+            future = self._executor.submit(func, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future.result()
+
+
+_auth_workers = None
+
+
+def get_auth_workers():
+    global _auth_workers
+    if _auth_workers is None:
+        with _init_lock:
+            if _auth_workers is None:
+                _auth_workers = AuthWorkers()
+    return _auth_workers
+
+
+class LoginThrottle:
+    # Per-username sliding log of failed logins. Once a name has max_failures
+    # within window seconds, further attempts are refused without hashing.
+    # Logs expire a window after their last failure, and at most max_names
+    # are kept, so guessing at many names cannot grow memory without bound.
+    def __init__(self, max_failures=LOGIN_MAX_FAILURES, window=LOGIN_FAILURE_WINDOW,
+                 max_names=LOGIN_THROTTLE_MAX_NAMES):
+        self.max_failures = max_failures
+        self.window = window
+        self._lock = threading.Lock()
+        self._failures = LRUTTLCache(maxsize=max_names, ttl=window)
+
+    def retry_after(self, username):
+        now = time.monotonic()
+        with self._lock:
+            failures = self._failures.get(username)
+            if not failures:
+                return 0
+            while failures and failures[0] <= now - self.window:
+                failures.popleft()
+            if len(failures) < self.max_failures:
+                return 0
+            return failures[0] + self.window - now
+
+    def record_failure(self, username):
+        now = time.monotonic()
+        with self._lock:
+            failures = self._failures.get(username) or deque(maxlen=self.max_failures)
+            failures.append(now)
+            self._failures.put(username, failures)
+
+    def reset(self, username):
+        with self._lock:
+            self._failures.delete(username)
+
+
+def get_message_writer(database=DATABASE_NAME):
+    pool = get_pool(database)
+    with _pools_lock:
+        writer = _writers.get(database)
+        if writer is None:
+            writer = _writers[database] = MessageWriter(pool)
+        return writer
+
+
+class DatabaseManager:
+    def __init__(self, database=DATABASE_NAME, write_behind=True):
+        self.pool = get_pool(database)
+        # DDL and migrations run once per process, not on every rerun
+        with _init_lock:
+            if database not in _initialized:
+                self._init_db()
+                _initialized.add(database)
+            self.login_throttle = _login_throttles.setdefault(database, LoginThrottle())
+            self.session_cache = _session_caches.setdefault(
+                database, LRUTTLCache(maxsize=SESSION_CACHE_SIZE, ttl=SESSION_CACHE_TTL)
+            )
+        self.writer = get_message_writer(database) if write_behind else None
+        self._purge_lock = threading.Lock()
+        self._last_purge = 0.0
+    
+    def _get_connection(self, name=None, write=False):
+        return self.pool.connection(name, write)
+
+    def query_metrics(self):
+        metrics = self.pool.metrics()
+        if self.writer:
+            metrics["message_batches"] = self.writer.batches
+            metrics["messages_written"] = self.writer.written
+        return metrics
+
+    def flush(self):
+        if self.writer:
+            self.writer.flush()
+
+    def _init_db(self):
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            # Users table
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS users (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    username TEXT UNIQUE NOT NULL,
+                    password_hash TEXT NOT NULL,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            
+            # Sessions table
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS sessions (
+                    session_id TEXT PRIMARY KEY,
+                    user_id INTEGER,
+                    expires_at DATETIME,
+                    FOREIGN KEY(user_id) REFERENCES users(id)
+                )
+            ''')
+            
+            # Rate limits table
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS rate_limits (
+                    user_id INTEGER PRIMARY KEY,
+                    request_count INTEGER DEFAULT 0,
+                    last_request DATETIME,
+                    FOREIGN KEY(user_id) REFERENCES users(id)
+                )
+            ''')
+            
+            # Chat history table
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS chat_history (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER,
+                    role TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY(user_id) REFERENCES users(id)
+                )
+            ''')
+            conn.commit()
+            self._migrate(conn)
+
+    def _migrate(self, conn):
+        # IMMEDIATE stops two processes from applying the same migration
+        conn.execute("BEGIN IMMEDIATE")
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for target, statements in enumerate(MIGRATIONS[version:], start=version + 1):
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {target}")
+        conn.commit()
+
+    # User management methods
+    # Hashing happens on the auth workers and outside any pooled connection
+    def create_user(self, username, password):
+        hashed = get_auth_workers().run(bcrypt.hashpw, password.encode(), bcrypt.gensalt())
+        with self._get_connection("create_user", write=True) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO users (username, password_hash)
+                VALUES (?, ?)
+            ''', (username, hashed))
+            return cursor.lastrowid
+
+    def verify_user(self, username, password):
+        # Returns None for bad credentials and while the name is throttled;
+        # check login_retry_after() to tell the two apart
+        if self.login_throttle.retry_after(username):
+            return None
+        with self._get_connection("verify_user") as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT id, password_hash FROM users WHERE username = ?
+            ''', (username,))
+            result = cursor.fetchone()
+        if result and get_auth_workers().run(bcrypt.checkpw, password.encode(), result[1]):
+            self.login_throttle.reset(username)
+            return result[0]
+        self.login_throttle.record_failure(username)
+        return None
+
+    def login_retry_after(self, username):
+        # Seconds until a throttled username may try again, 0 if not throttled
+        return self.login_throttle.retry_after(username)
+
+    # Session management methods
+    def create_session(self, user_id, session_duration=3600):
+        session_id = os.urandom(16).hex()
+        expires_at = datetime.now() + timedelta(seconds=session_duration)
+        with self._get_connection("create_session", write=True) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO sessions (session_id, user_id, expires_at)
+                VALUES (?, ?, ?)
+            ''', (session_id, user_id, expires_at))
+        self.session_cache.put(session_id, (user_id, expires_at))
+        self._maybe_purge_sessions()
+        return session_id
+
+    def validate_session(self, session_id):
+        # Valid sessions are cached for SESSION_CACHE_TTL seconds; logout
+        # removes the entry, so only the database row needs to expire
+        cached = self.session_cache.get(session_id)
+        if cached is None:
+            with self._get_connection("validate_session") as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT user_id, expires_at FROM sessions WHERE session_id = ?
+                ''', (session_id,))
+                result = cursor.fetchone()
+            if not result:
+                return None
+            cached = (result[0], datetime.fromisoformat(result[1]))
+            self.session_cache.put(session_id, cached)
+        user_id, expires_at = cached
+        if datetime.now() < expires_at:
+            return user_id
+        self.session_cache.invalidate(lambda key: key == session_id)
+        return None
+
+    def delete_session(self, session_id):
+        self.session_cache.invalidate(lambda key: key == session_id)
+        with self._get_connection("delete_session", write=True) as conn:
+            conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def purge_expired_sessions(self, batch_size=SESSION_PURGE_BATCH):
+        # Small batches keep each write transaction short, so purging a
+        # large backlog never blocks logins for long
+        deleted = 0
+        while True:
+            with self._get_connection("purge_sessions", write=True) as conn:
+                cursor = conn.execute('''
+                    DELETE FROM sessions WHERE rowid IN (
+                        SELECT rowid FROM sessions WHERE expires_at < ? LIMIT ?
+                    )
+                ''', (datetime.now(), batch_size))
+                count = cursor.rowcount
+            deleted += count
+            if count < batch_size:
+                break
+        if deleted:
+            logger.info(f"Purged {deleted} expired sessions")
+        return deleted
+
+    def _maybe_purge_sessions(self):
+        # At most once per SESSION_PURGE_INTERVAL, off the request thread
+        now = time.monotonic()
+        with self._purge_lock:
+            if now - self._last_purge < SESSION_PURGE_INTERVAL:
+                return
+            self._last_purge = now
+        threading.Thread(target=self._purge_sessions_quietly, name="session-purge", daemon=True).start()
+
+    def _purge_sessions_quietly(self):
+        try:
+            self.purge_expired_sessions()
+        except Exception as e:
+            logger.error(f"Session purge failed: {str(e)}")
+
+    # Rate limiting methods
+    def check_rate_limit(self, user_id, limit=10, window=60, global_limit=None):
+        # Sliding-window counter: the previous window's count is weighted by
+        # how much of it still overlaps the sliding window. Each key is checked
+        # and incremented by a single conditional upsert, and the per-user and
+        # global keys commit or roll back together.
+        now = time.time()
+        window_start = int(now // window) * window
+        weight = 1 - (now - window_start) / window
+        keys = [(f"user:{user_id}", limit)]
+        if global_limit:
+            keys.append(("global", global_limit))
+
+        with self._get_connection("check_rate_limit", write=True) as conn:
+            for key, key_limit in keys:
+                cursor = conn.execute('''
+                    INSERT INTO rate_limit_windows (key, window_start, request_count)
+                    SELECT :key, :start, 1
+                    WHERE COALESCE((
+                        SELECT request_count FROM rate_limit_windows
+                        WHERE key = :key AND window_start = :prev
+                    ), 0) * :weight < :limit
+                    ON CONFLICT(key, window_start) DO UPDATE
+                    SET request_count = request_count + 1
+                    WHERE request_count + COALESCE((
+                        SELECT w.request_count FROM rate_limit_windows AS w
+                        WHERE w.key = :key AND w.window_start = :prev
+                    ), 0) * :weight < :limit
+                ''', {"key": key, "start": window_start, "prev": window_start - window,
+                      "weight": weight, "limit": key_limit})
+                if cursor.rowcount == 0:
+                    conn.rollback()
+                    return False
+            conn.commit()
+            return True
+
+    # Conversation methods
+    def create_conversation(self, user_id, title=None):
+        with self._get_connection("create_conversation", write=True) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO conversations (user_id, title)
+                VALUES (?, ?)
+            ''', (user_id, title))
+            return cursor.lastrowid
+
+    def list_conversations(self, user_id, limit=20, before_id=None):
+        with self._get_connection("list_conversations") as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT id, title, created_at
+                FROM conversations
+                WHERE user_id = ? AND id < ?
+                ORDER BY id DESC
+                LIMIT ?
+            ''', (user_id, before_id if before_id is not None else 2**63 - 1, limit))
+            return [{"id": row[0], "title": row[1], "created_at": row[2]} for row in cursor.fetchall()]
+
+    def get_active_conversation(self, user_id):
+        conversations = self.list_conversations(user_id, limit=1)
+        if conversations:
+            return conversations[0]["id"]
+        return self.create_conversation(user_id)
+
+    def owns_conversation(self, user_id, conversation_id):
+        with self._get_connection("owns_conversation") as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT 1 FROM conversations WHERE id = ? AND user_id = ?", (conversation_id, user_id)
+            )
+            return cursor.fetchone() is not None
+
+    # Summaries are always scoped by user as well, so a conversation id taken
+    # from another account can neither read nor overwrite its summary
+    def get_summary(self, user_id, conversation_id):
+        with self._get_connection("get_summary") as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT summary, folded_through_id
+                FROM conversation_summaries
+                WHERE conversation_id = ? AND user_id = ?
+            ''', (conversation_id, user_id))
+            result = cursor.fetchone()
+            if result:
+                return {"summary": result[0], "folded_through_id": result[1]}
+            return None
+
+    def save_summary(self, user_id, conversation_id, summary, folded_through_id):
+        with self._get_connection("save_summary", write=True) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO conversation_summaries (conversation_id, user_id, summary, folded_through_id)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(conversation_id) DO UPDATE SET
+                    summary = excluded.summary,
+                    folded_through_id = excluded.folded_through_id,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE conversation_summaries.user_id = excluded.user_id
+            ''', (conversation_id, user_id, summary, folded_through_id))
+
+    # Chat history methods
+    def save_message(self, user_id, role, content, conversation_id=None):
+        if self.writer:
+            self.writer.enqueue(user_id, role, content, conversation_id)
+            return
+        with self._get_connection("save_message", write=True) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO chat_history (user_id, role, content, conversation_id)
+                VALUES (?, ?, ?, ?)
+            ''', (user_id, role, content, conversation_id))
+            conn.commit()
+
+    def get_history(self, user_id, limit=100, before_id=None, conversation_id=None, after_id=None):
+        # Keyset pagination: pass the smallest id of the current page as
+        # before_id to fetch the previous page. Messages come back oldest first.
+        conditions = ["user_id = ?"]
+        params = [user_id]
+        if conversation_id is not None:
+            conditions.append("conversation_id = ?")
+            params.append(conversation_id)
+        if before_id is not None:
+            conditions.append("id < ?")
+            params.append(before_id)
+        if after_id is not None:
+            conditions.append("id > ?")
+            params.append(after_id)
+        params.append(limit)
+        query = f'''
+            SELECT id, role, content FROM (
+                SELECT id, role, content
+                FROM chat_history
+                WHERE {" AND ".join(conditions)}
+                ORDER BY id DESC
+                LIMIT ?
+            ) ORDER BY id
+        '''
+
+        # Read-your-writes: the newest page includes messages still queued
+        # in the write-behind log
+        if before_id is None and self.writer and self.writer.has_pending(user_id):
+            with self.writer.visibility_lock:
+                history = self._fetch_history(query, params)
+                pending = self.writer.pending_for(user_id, conversation_id)
+            return (history + pending)[-limit:]
+        return self._fetch_history(query, params)
+
+    def _fetch_history(self, query, params):
+        with self._get_connection("get_history") as conn:
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+            return [{"id": row[0], "role": row[1], "content": row[2]} for row in cursor.fetchall()]
+
+
+_managers = {}
+
+
+def get_database(database=DATABASE_NAME):
+    # One manager per database per process, shared across Streamlit reruns
+    with _init_lock:
+        manager = _managers.get(database)
+    if manager is None:
+        manager = DatabaseManager(database)
+        with _init_lock:
+            manager = _managers.setdefault(database, manager)
+    return manager
@@ -0,0 +1,398 @@
+# dedup.py (Exact and Near-Duplicate Chunk Elimination)
+import base64
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import zlib
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows
+    fcntl = None
+
+logger = logging.getLogger("chatbot")
+
+DEDUP_DIRECTORY = "./dedup_index"
+DEFAULT_NUM_PERM = 64
+DEFAULT_BANDS = 16
+DEFAULT_THRESHOLD = 0.85
+SHINGLE_WORDS = 3
+SEED = 1
+COMPACT_MIN_RECORDS = 10000
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+
+_WORDS = re.compile(r"\w+")
+
+
+def normalize(text):
+    return " ".join(text.lower().split())
+
+
+def exact_hash(text):
+    return hashlib.sha1(normalize(text).encode("utf-8")).hexdigest()
+
+
+class MinHasher:
+    # Word 3-shingles hashed with crc32, then num_perm universal hashes
+    # (a * x + b) mod p applied to all shingles at once; the signature is the
+    # column-wise minimum. The fixed seed keeps signatures comparable across
+    # processes and restarts.
+    def __init__(self, num_perm=DEFAULT_NUM_PERM, seed=SEED):
+        self.num_perm = num_perm
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+        self._b = rng.randint(0, MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+
+    def signature(self, text):
+        words = _WORDS.findall(text.lower())
+        shingles = {
+            " ".join(words[i:i + SHINGLE_WORDS])
+            for i in range(max(len(words) - SHINGLE_WORDS + 1, 1))
+        }
+        x = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles))
+        # uint64 products wrap around, which is fine for hashing
+        hashes = (np.outer(x, self._a) + self._b) % MERSENNE_PRIME & MAX_HASH
+        return hashes.min(axis=0).astype(np.uint32)
+
+
+class DedupIndex:
+    # Exact hash and MinHash/LSH index over one knowledge base's chunks.
+    # Every stored chunk is indexed by the hash of its normalized text and by
+    # its MinHash signature split into LSH bands; a new chunk sharing a band
+    # with a stored one is compared on the full signature. Duplicates are not
+    # embedded or stored. Instead their (source, content_hash) reference is
+    # added to the chunk they duplicate, so deleting a source can hand a
+    # shared chunk over to a file that still contains it. Only exact
+    # duplicates can take a chunk over; a file that held just a near
+    # duplicate is marked stale instead, so it is ingested again.
+    #
+    # filter() only decides; its records are applied and logged by commit()
+    # once the kept chunks are in the vector store, so a failed write cannot
+    # leave chunks marked as stored that never were.
+    #
+    # The index is kept in memory and replayed from an append-only log,
+    # which is rewritten from the live state once mostly dead records. Worker
+    # processes each keep their own copy, so duplicates ingested concurrently
+    # by two processes can both be stored; they are caught on the next load.
+    def __init__(self, path, num_perm=DEFAULT_NUM_PERM, bands=DEFAULT_BANDS, threshold=DEFAULT_THRESHOLD):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.path = path
+        self.hasher = MinHasher(num_perm)
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._reset()
+        self.stats = {"checked": 0, "exact_duplicates": 0, "near_duplicates": 0}
+
+    def _reset(self):
+        self._canonical = {}   # exact hash -> hash of the stored chunk it maps to
+        self._aliases = {}     # stored chunk hash -> other exact hashes mapped to it
+        self._signatures = {}  # stored chunk hash -> MinHash signature
+        self._buckets = [{} for _ in range(self.bands)]
+        self.references = {}   # stored chunk hash -> [[source, content_hash, near], ...]
+        self.stale = set()     # content hashes of files missing a dropped near duplicate
+        self._log_records = 0
+
+    # Loading
+    def load(self, vector_store=None):
+        # Replays the log; a knowledge base built before deduplication is
+        # indexed once from the store itself
+        with self._lock, self._file_lock():
+            if os.path.exists(self.path):
+                self._replay()
+                self._compact_if_needed()
+            elif vector_store is not None:
+                self._index_store(vector_store)
+        return self
+
+    def _index_store(self, vector_store):
+            stored = vector_store.get(include=["documents", "metadatas"])
+            records = []
+            for text, metadata in zip(stored["documents"], stored["metadatas"]):
+                metadata = metadata or {}
+                record = self._match(text, [metadata.get("source"), metadata.get("content_hash")])[1]
+                self._apply(record)
+                records.append(record)
+            self._write(records)
+            logger.info(f"Indexed {len(records)} existing chunks for deduplication")
+
+    def _replay(self):
+        # A writer killed mid-append can leave a partial last line; it is cut
+        # off so the next append starts on a fresh line
+        offset = 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    if line.endswith(b"\n"):
+                        logger.warning(f"Skipping unreadable record in {self.path}")
+                        offset += len(line)
+                        continue
+                    logger.warning(f"Truncating partial record at the end of {self.path}")
+                    break
+                self._apply(record)
+                self._log_records += 1
+                offset += len(line)
+        if offset < os.path.getsize(self.path):
+            with open(self.path, "r+b") as f:
+                f.truncate(offset)
+
+    def _apply(self, record):
+        if "drop" in record:
+            self._drop(record["drop"], content_hash=record.get("content_hash"))
+        elif "ingested" in record:
+            self.stale.discard(record["ingested"])
+        elif "stale" in record:
+            self.stale.add(record["stale"])
+        elif "of" in record:
+            if record["of"] not in self.references:
+                # What it duplicates was dropped before this was committed
+                return
+            self._alias(record["h"], record["of"])
+            if "r" in record:
+                self._reference(record["of"], record["r"] + [record.get("near", False)])
+        elif record["h"] in self._canonical:
+            # Stored twice by concurrent writers; keep the first
+            self._reference(self._canonical[record["h"]], record["r"] + [False])
+        else:
+            signature = np.frombuffer(base64.b64decode(record["s"]), dtype=np.uint32)
+            self._add(record["h"], signature, record["r"] + [False])
+
+    def _file_lock(self):
+        # Held around every read and write of the log, so appends from other
+        # processes never interleave and compaction never loses one
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        handle = open(self.path + ".lock", "a")
+        if fcntl:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+        return handle
+
+    def _append(self, records):
+        if records:
+            with self._file_lock():
+                self._write(records)
+
+    def _write(self, records):
+        # One write per batch; the caller holds the file lock
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(record) + "\n" for record in records))
+        self._log_records += len(records)
+
+    def _live_records(self):
+        # The log records that rebuild the current state
+        records = []
+        for key, references in self.references.items():
+            signature = base64.b64encode(self._signatures[key].tobytes()).decode("ascii")
+            records.append({"h": key, "s": signature, "r": references[0][:2]})
+            for reference in references[1:]:
+                record = {"h": key, "of": key, "r": reference[:2]}
+                if reference[2]:
+                    record["near"] = True
+                records.append(record)
+            records.extend({"h": alias, "of": key} for alias in self._aliases.get(key, ()))
+        records.extend({"stale": content_hash} for content_hash in sorted(self.stale))
+        return records
+
+    def _should_compact(self):
+        return self._log_records >= max(COMPACT_MIN_RECORDS, 2 * len(self._live_records()))
+
+    def _compact_if_needed(self):
+        # Called with the file lock held right after a full replay, so the
+        # in-memory state includes every other process's records
+        if not self._should_compact():
+            return
+        records = self._live_records()
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write("".join(json.dumps(record) + "\n" for record in records))
+        os.replace(temp_path, self.path)
+        logger.info(f"Compacted {self.path} from {self._log_records} to {len(records)} records")
+        self._log_records = len(records)
+
+    # Indexing
+    def _band_keys(self, signature):
+        return [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+    def _add(self, key, signature, reference):
+        self._canonical[key] = key
+        self._signatures[key] = signature
+        self.references[key] = [reference]
+        for bucket, band in zip(self._buckets, self._band_keys(signature)):
+            bucket.setdefault(band, []).append(key)
+
+    def _remove(self, key):
+        signature = self._signatures.pop(key)
+        for bucket, band in zip(self._buckets, self._band_keys(signature)):
+            keys = bucket[band]
+            keys.remove(key)
+            if not keys:
+                del bucket[band]
+        del self.references[key]
+        del self._canonical[key]
+        for alias in self._aliases.pop(key, ()):
+            del self._canonical[alias]
+
+    def _reference(self, key, reference):
+        # Re-ingesting a file must not list it twice
+        if reference not in self.references[key]:
+            self.references[key].append(reference)
+
+    def _alias(self, key, canonical):
+        if key != canonical and key not in self._canonical:
+            self._canonical[key] = canonical
+            self._aliases.setdefault(canonical, []).append(key)
+
+    def _similar(self, signature, pending=None):
+        # pending: {key: signature} of new chunks not yet committed
+        candidates = set()
+        for bucket, band in zip(self._buckets, self._band_keys(signature)):
+            candidates.update(bucket.get(band, ()))
+        signatures = dict(pending or {})
+        signatures.update((key, self._signatures[key]) for key in candidates)
+        best, best_score = None, self.threshold
+        for key, other in signatures.items():
+            score = float(np.mean(other == signature))
+            if score >= best_score:
+                best, best_score = key, score
+        return best
+
+    def _match(self, text, reference, pending=None):
+        # Returns (kind, log record): kind is None for a new chunk, else
+        # "exact" or "near". Does not change the index.
+        key = exact_hash(text)
+        canonical = self._canonical.get(key)
+        if canonical is None and pending and key in pending:
+            canonical = key
+        if canonical is not None:
+            return "exact", {"h": key, "of": canonical, "r": reference}
+
+        signature = self.hasher.signature(text)
+        similar = self._similar(signature, pending)
+        if similar is not None:
+            return "near", {"h": key, "of": similar, "r": reference, "near": True}
+
+        if pending is not None:
+            pending[key] = signature
+        return None, {"h": key, "s": base64.b64encode(signature.tobytes()).decode("ascii"), "r": reference}
+
+    def filter(self, documents):
+        # Returns the documents that still need embedding, in order, how many
+        # of the others were exact and near duplicates, and the records to
+        # pass to commit() once the kept documents are stored
+        kept = []
+        records = []
+        pending = {}
+        duplicates = {"exact_duplicates": 0, "near_duplicates": 0}
+        with self._lock:
+            for document in documents:
+                metadata = document.metadata
+                kind, record = self._match(
+                    document.page_content, [metadata.get("source"), metadata.get("content_hash")], pending
+                )
+                records.append(record)
+                if kind is None:
+                    kept.append(document)
+                else:
+                    duplicates[f"{kind}_duplicates"] += 1
+            self.stats["checked"] += len(documents)
+            for name, count in duplicates.items():
+                self.stats[name] += count
+        return kept, duplicates, records
+
+    def commit(self, records):
+        with self._lock:
+            for record in records:
+                self._apply(record)
+            self._append(records)
+
+    # Sources
+    def sources(self, text):
+        # Every file the chunk (or a near-duplicate of it) was found in
+        with self._lock:
+            canonical = self._canonical.get(exact_hash(text))
+            return [reference[0] for reference in self.references.get(canonical, ())]
+
+    def is_stale(self, content_hash):
+        with self._lock:
+            return content_hash in self.stale
+
+    def ingested(self, content_hash):
+        # A stale file was ingested again
+        with self._lock:
+            if content_hash in self.stale:
+                record = {"ingested": content_hash}
+                self._apply(record)
+                self._append([record])
+
+    def remove_source(self, source, documents, content_hash=None):
+        # documents: the stored chunks of `source`, about to be deleted.
+        # Returns the (text, source, content_hash) copies to store again for
+        # chunks another file still contains exactly. Files that only held a
+        # near duplicate of a dropped chunk are added to self.stale. With
+        # content_hash, only that version of the file is dropped.
+        record = {"drop": source}
+        if content_hash is not None:
+            record["content_hash"] = content_hash
+        with self._lock, self._file_lock():
+            self._write([record])
+            handovers = self._drop(source, {exact_hash(text): text for text in documents}, content_hash)
+            if self._should_compact():
+                # Deletions leave most of the dead records behind; replaying
+                # first picks up what other processes appended since load
+                self._reset()
+                self._replay()
+                self._compact_if_needed()
+            return handovers
+
+    def _drop(self, source, texts=None, content_hash=None):
+        def dropped(reference):
+            return reference[0] == source and content_hash in (None, reference[1])
+
+        handovers = []
+        for key in list(self.references):
+            owned = dropped(self.references[key][0])
+            remaining = [reference for reference in self.references[key] if not dropped(reference)]
+            if owned:
+                # Only a file with the exact text can own the stored copy
+                exact = [reference for reference in remaining if not reference[2]]
+                if not exact:
+                    self.stale.update(reference[1] for reference in remaining if reference[1])
+                    remaining = []
+                else:
+                    remaining.remove(exact[0])
+                    remaining.insert(0, exact[0])
+            if not remaining:
+                self._remove(key)
+                continue
+            self.references[key] = remaining
+            if owned and texts is not None and key in texts:
+                handovers.append((texts[key], remaining[0][0], remaining[0][1]))
+        return handovers
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_dedup_index(store_key, vector_store=None, config=None):
+    # One index per knowledge base per process, loaded on first use
+    with _indexes_lock:
+        index = _indexes.get(store_key)
+        if index is None:
+            config = config or {}
+            num_perm = config.get("dedup_num_perm", DEFAULT_NUM_PERM)
+            index = _indexes[store_key] = DedupIndex(
+                os.path.join(config.get("dedup_directory", DEDUP_DIRECTORY), f"{store_key}.minhash{num_perm}.jsonl"),
+                num_perm=num_perm,
+                bands=config.get("dedup_bands", DEFAULT_BANDS),
+                threshold=config.get("dedup_threshold", DEFAULT_THRESHOLD)
+            ).load(vector_store)
+        return index
@@ -0,0 +1,215 @@
+# embeddings.py (Shared Embedding Model)
+import threading
+import time
+import os
+import queue
+import numpy as np
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from langchain_core.embeddings import Embeddings
+import telemetry
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
+EMBEDDING_DEVICE = "cpu"  # Or "cuda" if you have GPU available
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+
+DEFAULT_BATCH_SIZE = 64
+DEFAULT_MAX_WAIT_MS = 5
+DEFAULT_QUERY_TIMEOUT = 5.0
+
+# One embedder and splitter per process, shared by every Streamlit session
+_init_lock = threading.Lock()
+_embedder = None
+_text_splitter = None
+_metrics = {
+    "pid": os.getpid(),
+    "model_name": EMBEDDING_MODEL_NAME,
+    "load_count": 0,
+    "load_seconds": 0.0,
+    "rss_before_load_mb": None,
+    "rss_after_load_mb": None,
+    "embed_calls": 0,
+    "embedded_texts": 0,
+    "embed_seconds": 0.0,
+    "query_batches": 0,
+    "batched_queries": 0,
+    "query_fallbacks": 0,
+}
+
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class EmbeddingService(Embeddings):
+    """Batched, thread-safe front end for a single SentenceTransformer model.
+
+    Documents are encoded in large batches straight to normalized float32
+    arrays. Queries from concurrent sessions are coalesced into micro-batches
+    that are flushed when full or when the oldest query has waited max_wait_ms.
+    A query the batcher has not answered within query_timeout seconds is
+    encoded directly instead. Documents are encoded one batch at a time and
+    give way to waiting queries between batches, so a large upload delays a
+    query by one batch at most.
+    """
+
+    def __init__(self, model, batch_size=DEFAULT_BATCH_SIZE, max_wait_ms=DEFAULT_MAX_WAIT_MS,
+                 query_timeout=DEFAULT_QUERY_TIMEOUT):
+        self.model = model
+        self.batch_size = batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.query_timeout = query_timeout
+        # HF fast tokenizers raise "Already borrowed" when used concurrently
+        self._lock = threading.Lock()
+        self._turn = threading.Condition(self._lock)
+        self._queries_waiting = 0
+        self._queries = queue.Queue()
+        self._batcher = None
+        self._batcher_lock = threading.Lock()
+
+    def encode(self, texts, query=False):
+        texts = list(texts)
+        start = time.perf_counter()
+        if query:
+            with self._batcher_lock:
+                self._queries_waiting += 1
+            try:
+                with self._turn:
+                    vectors = self._encode(texts)
+            finally:
+                with self._batcher_lock:
+                    self._queries_waiting -= 1
+                with self._turn:
+                    self._turn.notify_all()
+        else:
+            parts = []
+            for offset in range(0, max(len(texts), 1), self.batch_size):
+                with self._turn:
+                    self._turn.wait_for(lambda: not self._queries_waiting)
+                    parts.append(self._encode(texts[offset:offset + self.batch_size]))
+            vectors = np.concatenate(parts) if len(parts) > 1 else parts[0]
+        self._record(len(texts), time.perf_counter() - start)
+        return vectors
+
+    def _encode(self, texts):
+        return self.model.encode(
+            texts,
+            batch_size=self.batch_size,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=False
+        ).astype("float32", copy=False)
+
+    def embed_documents(self, texts):
+        if not texts:
+            return []
+        return self.encode(texts).tolist()
+
+    def embed_query(self, text):
+        self._ensure_batcher()
+        future = Future()
+        self._queries.put((text, future))
+        try:
+            return future.result(timeout=self.query_timeout).tolist()
+        except FutureTimeout:
+            # Not cancelled: the batcher may still resolve it, and must not
+            # fail doing so
+            with self._batcher_lock:
+                if not self._batcher.is_alive():
+                    self._batcher = None
+            _metrics["query_fallbacks"] += 1
+            return self.encode([text], query=True)[0].tolist()
+
+    def _ensure_batcher(self):
+        if self._batcher is None:
+            with self._batcher_lock:
+                if self._batcher is None:
+                    self._batcher = threading.Thread(
+                        target=self._run_batcher, name="embedding-batcher", daemon=True
+                    )
+                    self._batcher.start()
+
+    def _run_batcher(self):
+        while True:
+            batch = [self._queries.get()]
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queries.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            try:
+                vectors = self.encode([text for text, _ in batch], query=True)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            _metrics["query_batches"] += 1
+            _metrics["batched_queries"] += len(batch)
+            for (_, future), vector in zip(batch, vectors):
+                future.set_result(vector)
+
+    def _record(self, count, elapsed):
+        _metrics["embed_calls"] += 1
+        _metrics["embedded_texts"] += count
+        _metrics["embed_seconds"] += elapsed
+        telemetry.record("embedding", elapsed, texts=count)
+
+
+def get_embedder(config=None):
+    # Settings only take effect on the first call in a process
+    global _embedder
+    if _embedder is None:
+        with _init_lock:
+            if _embedder is None:
+                config = config or {}
+                from sentence_transformers import SentenceTransformer
+
+                threads = config.get("embedding_threads")
+                if threads:
+                    import torch
+                    torch.set_num_threads(threads)
+
+                _metrics["rss_before_load_mb"] = _peak_rss_mb()
+                start = time.perf_counter()
+                model = SentenceTransformer(EMBEDDING_MODEL_NAME, device=EMBEDDING_DEVICE)
+                _metrics["load_seconds"] = time.perf_counter() - start
+                _metrics["rss_after_load_mb"] = _peak_rss_mb()
+                _metrics["load_count"] += 1
+                _embedder = EmbeddingService(
+                    model,
+                    batch_size=config.get("embedding_batch_size", DEFAULT_BATCH_SIZE),
+                    max_wait_ms=config.get("embedding_max_wait_ms", DEFAULT_MAX_WAIT_MS),
+                    query_timeout=config.get("embedding_query_timeout", DEFAULT_QUERY_TIMEOUT)
+                )
+    return _embedder
+
+
+def get_text_splitter():
+    global _text_splitter
+    if _text_splitter is None:
+        with _init_lock:
+            if _text_splitter is None:
+                from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+                _text_splitter = RecursiveCharacterTextSplitter(
+                    chunk_size=CHUNK_SIZE,
+                    chunk_overlap=CHUNK_OVERLAP
+                )
+    return _text_splitter
+
+
+def embedder_metrics():
+    return dict(_metrics)
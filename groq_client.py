@@ -0,0 +1,172 @@
+# groq_client.py (Pooled Groq Clients with Retries)
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+import weakref
+from contextlib import contextmanager, asynccontextmanager
+
+logger = logging.getLogger("chatbot")
+
+DEFAULT_MAX_CONNECTIONS = 20
+DEFAULT_MAX_CONCURRENCY = 16
+DEFAULT_MAX_RETRIES = 4
+DEFAULT_TIMEOUT = 60.0
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 20.0
+
+_retryable_errors = None
+
+
+def retryable_errors():
+    # groq is imported on the first request rather than at startup
+    global _retryable_errors
+    if _retryable_errors is None:
+        import groq
+        _retryable_errors = (
+            groq.RateLimitError,
+            groq.InternalServerError,
+            groq.APIConnectionError,  # Includes APITimeoutError
+        )
+    return _retryable_errors
+
+
+def retry_delay(error, attempt):
+    # Honour the server's retry-after when it sends one, otherwise use
+    # exponential backoff with full jitter
+    response = getattr(error, "response", None)
+    if response is not None:
+        retry_after = response.headers.get("retry-after")
+        if retry_after:
+            try:
+                return min(float(retry_after), BACKOFF_CAP)
+            except ValueError:
+                pass
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+
+class GroqClientPool:
+    # One sync client per process and one async client per event loop, each
+    # backed by a keep-alive httpx connection pool. The SDK's own retries are
+    # disabled so that backoff is applied here, uniformly.
+    def __init__(self, config=None):
+        config = config or {}
+        self.api_key = os.getenv("GROQ_API_KEY")
+        self.base_url = os.getenv("GROQ_BASE_URL") or None
+        self.max_retries = config.get("llm_max_retries", DEFAULT_MAX_RETRIES)
+        self.timeout = config.get("llm_timeout", DEFAULT_TIMEOUT)
+        self.max_concurrency = config.get("llm_max_concurrency", DEFAULT_MAX_CONCURRENCY)
+        self.max_connections = config.get("llm_max_connections", DEFAULT_MAX_CONNECTIONS)
+        self._lock = threading.Lock()
+        self._client = None
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+        self._async_clients = weakref.WeakKeyDictionary()
+        self.retries = 0
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    import groq
+                    import httpx
+                    self._client = groq.Groq(
+                        api_key=self.api_key,
+                        base_url=self.base_url,
+                        max_retries=0,
+                        timeout=self.timeout,
+                        http_client=httpx.Client(limits=self._limits(), timeout=self.timeout)
+                    )
+        return self._client
+
+    def _limits(self):
+        import httpx
+        return httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_connections
+        )
+
+    def _async_state(self):
+        loop = asyncio.get_running_loop()
+        state = self._async_clients.get(loop)
+        if state is None:
+            import groq
+            import httpx
+            client = groq.AsyncGroq(
+                api_key=self.api_key,
+                base_url=self.base_url,
+                max_retries=0,
+                timeout=self.timeout,
+                http_client=httpx.AsyncClient(limits=self._limits(), timeout=self.timeout)
+            )
+            state = self._async_clients[loop] = (client, asyncio.Semaphore(self.max_concurrency))
+        return state
+
+    @property
+    def async_client(self):
+        return self._async_state()[0]
+
+    async def aclose(self):
+        # Closes this event loop's client. A loop that ends, e.g. one from
+        # asyncio.run(), must await this first or its sockets stay open
+        state = self._async_clients.pop(asyncio.get_running_loop(), None)
+        if state is not None:
+            await state[0].close()
+
+    @contextmanager
+    def slot(self):
+        with self._slots:
+            yield
+
+    @asynccontextmanager
+    async def async_slot(self):
+        async with self._async_state()[1]:
+            yield
+
+    def create_completion(self, retries=None, **kwargs):
+        # retries=0 lets a caller with somewhere else to go (the model
+        # router) move on at once instead of backing off
+        retries = self.max_retries if retries is None else retries
+        for attempt in range(retries + 1):
+            try:
+                return self.client.chat.completions.create(**kwargs)
+            except retryable_errors() as e:
+                if attempt == retries:
+                    raise
+                delay = retry_delay(e, attempt)
+                self._log_retry(e, attempt, retries, delay)
+                time.sleep(delay)
+
+    async def acreate_completion(self, retries=None, **kwargs):
+        retries = self.max_retries if retries is None else retries
+        for attempt in range(retries + 1):
+            try:
+                return await self.async_client.chat.completions.create(**kwargs)
+            except retryable_errors() as e:
+                if attempt == retries:
+                    raise
+                delay = retry_delay(e, attempt)
+                self._log_retry(e, attempt, retries, delay)
+                await asyncio.sleep(delay)
+
+    def _log_retry(self, error, attempt, retries, delay):
+        self.retries += 1
+        logger.warning(
+            f"Groq request failed ({type(error).__name__}), "
+            f"retry {attempt + 1}/{retries} in {delay:.2f}s"
+        )
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_client_pool(config=None):
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = GroqClientPool(config)
+    return _pool
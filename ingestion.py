@@ -0,0 +1,265 @@
+# ingestion.py (Parallel Document Ingestion Pipeline)
+import logging
+import multiprocessing
+import os
+import queue
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from embeddings import embedder_metrics
+from ingestion_cache import get_ingestion_cache
+
+logger = logging.getLogger("chatbot")
+
+DEFAULT_WORKERS = max(1, min(4, (os.cpu_count() or 2) - 1))
+DEFAULT_BATCH_SIZE = 64
+DEFAULT_QUEUE_SIZE = 8
+DRAIN_TIMEOUT = 30
+
+# Parser processes are expensive to spawn, so they are shared per process
+_pool_lock = threading.Lock()
+_pool = None
+_pool_workers = 0
+_manager = None
+
+
+def _get_pool(workers):
+    global _pool, _pool_workers, _manager
+    with _pool_lock:
+        # A worker that died leaves the executor broken for every later submit
+        broken = _pool is not None and getattr(_pool, "_broken", False)
+        if _pool is None or _pool_workers != workers or broken:
+            if _pool is not None:
+                _pool.shutdown(wait=False, cancel_futures=True)
+            # Forking a process that already holds the embedding model is unsafe
+            context = multiprocessing.get_context("spawn")
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+            _pool_workers = workers
+            if _manager is None:
+                _manager = context.Manager()
+        return _pool, _manager
+
+
+def _retire_pool(pool):
+    # Workers that are still running after a drain are wedged; kill them so
+    # the next ingest gets a fresh executor instead of waiting behind them
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    for process in list(getattr(pool, "_processes", {}).values()):
+        process.terminate()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+class IngestionCancelled(Exception):
+    pass
+
+
+def _put(chunk_queue, cancel, item):
+    # A bounded put that gives up once the consumer has gone away
+    while not cancel.is_set():
+        try:
+            chunk_queue.put(item, timeout=1)
+            return
+        except queue.Full:
+            continue
+    raise IngestionCancelled()
+
+
+def _parse_worker(path, file_type, key, source, chunk_queue, batch_size, cancel):
+    # Runs in a pool process: stream pages/rows, split them and hand chunks
+    # back in small batches so neither side holds a whole document.
+    from data_processor import DataProcessor
+    from embeddings import get_text_splitter
+
+    splitter = get_text_splitter()
+    batch = []
+    total = 0
+    try:
+        loader = DataProcessor()._get_loader(file_type, path)
+        for document in loader.lazy_load():
+            document.metadata["source"] = source
+            for chunk in splitter.split_documents([document]):
+                chunk.metadata["content_hash"] = key
+                batch.append(chunk)
+            if len(batch) >= batch_size:
+                _put(chunk_queue, cancel, ("chunks", key, batch))
+                total += len(batch)
+                batch = []
+        if batch:
+            _put(chunk_queue, cancel, ("chunks", key, batch))
+            total += len(batch)
+        _put(chunk_queue, cancel, ("done", key, total))
+    except IngestionCancelled:
+        pass
+    except Exception as e:
+        _put(chunk_queue, cancel, ("error", key, f"{source}: {str(e)}"))
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+class IngestionPipeline:
+    def __init__(self, workers=DEFAULT_WORKERS, batch_size=DEFAULT_BATCH_SIZE,
+                 queue_size=DEFAULT_QUEUE_SIZE, progress_callback=None, dedup=None):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.progress_callback = progress_callback
+        # Optional dedup.DedupIndex for the target knowledge base
+        self.dedup = dedup
+
+    def run(self, uploaded_files, vector_store, store_key):
+        cache = get_ingestion_cache()
+        start = time.perf_counter()
+        summary = {"files": len(uploaded_files), "parsed_files": 0, "cached_files": 0,
+                   "chunks": 0, "exact_duplicates": 0, "near_duplicates": 0, "errors": []}
+
+        jobs = []
+        for file in uploaded_files:
+            data = file.getvalue()
+            key = cache.make_key(data)
+            # A file that lost a near-duplicate chunk with a deleted source
+            # is ingested again to restore it
+            stale = self.dedup is not None and self.dedup.is_stale(key)
+            if not stale and (cache.check_indexed(store_key, key) or self._in_store(vector_store, key)):
+                cache.mark_indexed(store_key, [key])
+                summary["cached_files"] += 1
+                continue
+            with tempfile.NamedTemporaryFile(delete=False) as temp_file:
+                temp_file.write(data)
+            jobs.append((temp_file.name, file.type, key, file.name))
+
+        self._report(summary)
+        if jobs:
+            self._ingest(jobs, vector_store, store_key, summary)
+
+        elapsed = time.perf_counter() - start
+        summary["seconds"] = elapsed
+        summary["files_per_sec"] = summary["parsed_files"] / elapsed if elapsed else 0.0
+        summary["chunks_per_sec"] = summary["chunks"] / elapsed if elapsed else 0.0
+        # Skipped chunks are priced at this process's average embedding cost
+        metrics = embedder_metrics()
+        per_text = metrics["embed_seconds"] / metrics["embedded_texts"] if metrics["embedded_texts"] else 0.0
+        summary["duplicate_chunks"] = summary["exact_duplicates"] + summary["near_duplicates"]
+        summary["embedding_seconds_saved"] = summary["duplicate_chunks"] * per_text
+        logger.info(
+            f"Ingested {summary['parsed_files']} files ({summary['cached_files']} cached), "
+            f"{summary['chunks']} chunks in {elapsed:.2f}s "
+            f"({summary['files_per_sec']:.2f} files/s, {summary['chunks_per_sec']:.1f} chunks/s), "
+            f"skipped {summary['exact_duplicates']} exact and {summary['near_duplicates']} near duplicates "
+            f"(~{summary['embedding_seconds_saved']:.2f}s of embedding)"
+        )
+        return summary
+
+    def _ingest(self, jobs, vector_store, store_key, summary):
+        cache = get_ingestion_cache()
+        pool, manager = _get_pool(self.workers)
+        # Bounded queue: parsers block once the embedder falls behind
+        chunk_queue = manager.Queue(maxsize=self.queue_size)
+        cancel = manager.Event()
+        futures = [
+            pool.submit(_parse_worker, path, file_type, key, source, chunk_queue, self.batch_size, cancel)
+            for path, file_type, key, source in jobs
+        ]
+
+        sources = {key: source for _, _, key, source in jobs}
+        partial = set()  # Files with chunks stored but not finished
+        remaining = len(jobs)
+        try:
+            while remaining:
+                try:
+                    kind, key, payload = chunk_queue.get(timeout=1)
+                except queue.Empty:
+                    # A worker that died without reporting would hang us forever
+                    crashed = [f for f in futures if f.done() and f.exception()]
+                    if crashed:
+                        raise RuntimeError(f"Ingestion worker failed: {crashed[0].exception()}")
+                    continue
+
+                if kind == "chunks":
+                    records = ()
+                    if self.dedup is not None:
+                        payload, duplicates, records = self.dedup.filter(payload)
+                        for name, count in duplicates.items():
+                            summary[name] += count
+                    if payload:
+                        vector_store.add_documents(payload)
+                    if records:
+                        self.dedup.commit(records)
+                    summary["chunks"] += len(payload)
+                    partial.add(key)
+                elif kind == "done":
+                    partial.discard(key)
+                    cache.mark_indexed(store_key, [key])
+                    if self.dedup is not None:
+                        self.dedup.ingested(key)
+                    summary["parsed_files"] += 1
+                    remaining -= 1
+                else:
+                    logger.error(f"Ingestion error: {payload}")
+                    summary["errors"].append(payload)
+                    if key in partial:
+                        partial.discard(key)
+                        self._discard(vector_store, key, sources[key])
+                    remaining -= 1
+                self._report(summary)
+        finally:
+            if remaining:
+                # Stopped early: workers blocked on the full queue would
+                # otherwise hold the shared pool forever
+                cancel.set()
+                for future in futures:
+                    future.cancel()
+                self._drain(chunk_queue, futures, pool)
+            for key in partial:
+                try:
+                    self._discard(vector_store, key, sources[key])
+                except Exception as e:
+                    logger.error(f"Could not remove partial chunks of {sources[key]}: {str(e)}")
+            for path, _, _, _ in jobs:
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def _drain(self, chunk_queue, futures, pool):
+        deadline = time.monotonic() + DRAIN_TIMEOUT
+        while not all(future.done() for future in futures):
+            if time.monotonic() >= deadline:
+                logger.error("Ingestion workers did not stop; replacing the pool")
+                _retire_pool(pool)
+                return
+            try:
+                chunk_queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+            except Exception:
+                break  # The manager went away with the interpreter
+
+    def _in_store(self, vector_store, key):
+        # The store may already hold this file from a previous process.
+        # Files that fail part way are discarded, so any chunk means the
+        # whole file is there.
+        return bool(vector_store.get(where={"content_hash": key}, limit=1)["ids"])
+
+    def _discard(self, vector_store, key, source):
+        # Removes the chunks already stored for a file that failed to parse,
+        # so it is ingested in full when uploaded again
+        stored = vector_store.get(where={"content_hash": key})
+        handovers = []
+        if self.dedup is not None:
+            handovers = self.dedup.remove_source(source, stored["documents"], key)
+        if stored["ids"]:
+            vector_store.delete(ids=stored["ids"])
+        if handovers:
+            from langchain_core.documents import Document
+            vector_store.add_documents([
+                Document(page_content=text, metadata={"source": new_source, "content_hash": content_hash})
+                for text, new_source, content_hash in handovers
+            ])
+
+    def _report(self, summary):
+        if self.progress_callback:
+            done = summary["parsed_files"] + summary["cached_files"] + len(summary["errors"])
+            self.progress_callback(done, summary["files"], summary["chunks"])
@@ -0,0 +1,56 @@
+# ingestion_cache.py (Content-Addressed Ingestion Cache)
+import hashlib
+import threading
+from embeddings import EMBEDDING_MODEL_NAME, CHUNK_SIZE, CHUNK_OVERLAP
+
+# Any change to how chunks are produced or embedded must change the key
+SETTINGS_FINGERPRINT = f"{EMBEDDING_MODEL_NAME}|normalized|{CHUNK_SIZE}|{CHUNK_OVERLAP}"
+
+
+class IngestionCache:
+    # A file whose key was already added to the store is skipped before it
+    # is parsed or embedded
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._indexed = set()
+        self.hits = 0
+        self.misses = 0
+
+    def make_key(self, data):
+        digest = hashlib.sha256(data).hexdigest()
+        return hashlib.sha256(f"{digest}|{SETTINGS_FINGERPRINT}".encode()).hexdigest()
+
+    # Tracks which content hashes were already added to a given vector store
+    def check_indexed(self, store_key, key):
+        with self._lock:
+            indexed = (store_key, key) in self._indexed
+            if indexed:
+                self.hits += 1
+            else:
+                self.misses += 1
+            return indexed
+
+    def mark_indexed(self, store_key, keys):
+        with self._lock:
+            self._indexed.update((store_key, key) for key in keys)
+
+    def forget_indexed(self, store_key):
+        with self._lock:
+            self._indexed = {entry for entry in self._indexed if entry[0] != store_key}
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / total if total else 0.0,
+                "indexed_files": len(self._indexed),
+            }
+
+
+_cache = IngestionCache()
+
+
+def get_ingestion_cache():
+    return _cache
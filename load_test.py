@@ -0,0 +1,376 @@
+# load_test.py (End-to-End Load Test and Benchmark Harness)
+# Drives the chat flow headlessly through ChatService -- rate limit check,
+# load the conversation history, save the question, prepare the turn
+# (retrieval, prompt assembly, response cache), stream the answer, finish the
+# turn, save the answer -- for N concurrent simulated users against the local
+# Groq stub, over a generated
+# PDF/CSV/TXT corpus. Results are written as JSON so runs can be compared
+# between commits:
+#   python load_test.py --users 16 --requests 10 --corpus medium --output base.json
+#   python load_test.py --users 16 --requests 10 --corpus medium --baseline base.json
+import argparse
+import json
+import math
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+STAGES = ("rate_limit", "history", "save_question", "prepare", "ttft", "generate", "finish", "save_answer", "total")
+# files per type, paragraphs per file
+CORPUS_SIZES = {"small": (1, 40), "medium": (4, 150), "large": (12, 400)}
+VOCABULARY = (
+    "patient fever cough headache fatigue nausea dosage ibuprofen paracetamol infection "
+    "symptoms diagnosis treatment chronic acute pressure blood sugar insulin allergy rash "
+    "antibiotic viral bacterial hydration rest clinic referral follow-up screening vaccine "
+    "cholesterol cardiology respiratory asthma inhaler migraine dizziness sleep diet exercise"
+).split()
+
+
+def _sentence(rng, words=12):
+    return " ".join(rng.choice(VOCABULARY) for _ in range(words)).capitalize() + "."
+
+
+def _paragraph(rng):
+    return " ".join(_sentence(rng, rng.randint(8, 16)) for _ in range(rng.randint(3, 6)))
+
+
+def make_pdf(lines, lines_per_page=45):
+    # Minimal single-font PDF, enough for PyPDFLoader to extract the text
+    def escape(text):
+        return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+    pages = [lines[i:i + lines_per_page] for i in range(0, len(lines), lines_per_page)] or [[]]
+    objects = {1: b"<< /Type /Catalog /Pages 2 0 R >>", 3: b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"}
+    kids = []
+    for index, page_lines in enumerate(pages):
+        page_id, content_id = 4 + 2 * index, 5 + 2 * index
+        kids.append(f"{page_id} 0 R")
+        stream = "BT /F1 9 Tf 11 TL 40 800 Td " + " ".join(f"({escape(line)}) Tj T*" for line in page_lines) + " ET"
+        stream = stream.encode("latin-1", "replace")
+        objects[page_id] = (
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {content_id} 0 R >>"
+        ).encode()
+        objects[content_id] = f"<< /Length {len(stream)} >>\nstream\n".encode() + stream + b"\nendstream"
+    objects[2] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>".encode()
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = {}
+    for obj_id in sorted(objects):
+        offsets[obj_id] = len(out)
+        out += f"{obj_id} 0 obj\n".encode() + objects[obj_id] + b"\nendobj\n"
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    for obj_id in sorted(objects):
+        out += f"{offsets[obj_id]:010d} 00000 n \n".encode()
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return bytes(out)
+
+
+def make_corpus(size, seed=0):
+    from chat_service import UploadedDocument
+
+    files_per_type, paragraphs = CORPUS_SIZES[size]
+    rng = random.Random(seed)
+    uploads = []
+    for n in range(files_per_type):
+        text = "\n\n".join(_paragraph(rng) for _ in range(paragraphs))
+        uploads.append(UploadedDocument(f"notes_{n}.txt", "text/plain", text.encode()))
+
+        rows = ["patient_id,age,symptom,treatment,notes"]
+        for row in range(paragraphs * 4):
+            rows.append(
+                f"{n * 100000 + row},{rng.randint(1, 95)},{rng.choice(VOCABULARY)},"
+                f"{rng.choice(VOCABULARY)},\"{_sentence(rng)}\""
+            )
+        uploads.append(UploadedDocument(f"records_{n}.csv", "text/csv", "\n".join(rows).encode()))
+
+        lines = []
+        for _ in range(paragraphs):
+            words = _paragraph(rng).split()
+            lines.extend(" ".join(words[i:i + 14]) for i in range(0, len(words), 14))
+            lines.append("")
+        uploads.append(UploadedDocument(f"guide_{n}.pdf", "application/pdf", make_pdf(lines)))
+    return uploads
+
+
+def percentiles(values):
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+
+    def rank(p):
+        # Nearest-rank percentile
+        return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)] * 1000
+
+    return {
+        "count": len(ordered),
+        "mean_ms": sum(ordered) / len(ordered) * 1000,
+        "p50_ms": rank(50),
+        "p95_ms": rank(95),
+        "p99_ms": rank(99),
+        "max_ms": ordered[-1] * 1000,
+    }
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    # ru_maxrss is reported in kilobytes on Linux
+    return {
+        "self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=APP_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class LoadTest:
+    def __init__(self, config, users, requests, think_ms=0, seed=0):
+        # Imported here so the stub URL and working directory are in place first
+        from chat_service import ChatService
+        from vector_store_registry import DEFAULT_KB_ID
+
+        self.config = config
+        self.users = users
+        self.requests = requests
+        self.think = think_ms / 1000
+        self.seed = seed
+        self.service = ChatService(config)
+        self.db = self.service.db
+        self.client_pool = self.service.client_pool
+        self.model_name = config["available_models"][0]
+        # Every simulated user asks about the same shared knowledge base
+        self.kb_id = DEFAULT_KB_ID
+        self.samples = {stage: [] for stage in STAGES}
+        self.rejected = 0
+        self.cached = 0
+        self.errors = []
+        self._lock = threading.Lock()
+
+    def ingest(self, corpus):
+        _, summary = self.service.ingest(corpus, self.kb_id)
+        return summary
+
+    def run_user(self, index):
+        rng = random.Random(self.seed * 1000 + index)
+        user_id = self.db.create_user(f"load_user_{index}_{rng.random()}", "password")
+        conversation_id = self.db.create_conversation(user_id)
+        # One handler per user, as ChatBot keeps one per session
+        model_handler = self.service.model_handler()
+
+        for _ in range(self.requests):
+            question = " ".join(rng.choice(VOCABULARY) for _ in range(rng.randint(4, 9))) + "?"
+            timings = {}
+            start = time.perf_counter()
+            try:
+                stage = time.perf_counter()
+                allowed = self.service.rate_limiter.allow(user_id)
+                timings["rate_limit"] = time.perf_counter() - stage
+                if not allowed:
+                    with self._lock:
+                        self.rejected += 1
+                    continue
+
+                stage = time.perf_counter()
+                history = self.service.conversation.for_conversation(
+                    user_id, conversation_id, self.service.resolve_model(self.model_name)
+                )
+                timings["history"] = time.perf_counter() - stage
+
+                stage = time.perf_counter()
+                self.db.save_message(user_id, "user", question, conversation_id)
+                timings["save_question"] = time.perf_counter() - stage
+
+                stage = time.perf_counter()
+                turn = self.service.prepare(
+                    question, self.kb_id, self.model_name, self.config["default_temp"],
+                    self.config["default_max_tokens"], history
+                )
+                timings["prepare"] = time.perf_counter() - stage
+
+                if turn["cached"] is not None:
+                    answer = turn["cached"]
+                    with self._lock:
+                        self.cached += 1
+                else:
+                    stage = time.perf_counter()
+                    answer = model_handler.generate(
+                        turn["prompt"], turn["model_name"], turn["temperature"], turn["max_tokens"],
+                        stream=True, history=turn["history"], fallbacks=turn["fallbacks"]
+                    )
+                    timings["generate"] = time.perf_counter() - stage
+                    if model_handler.last_metrics["ttft_seconds"] is not None:
+                        timings["ttft"] = model_handler.last_metrics["ttft_seconds"]
+
+                    stage = time.perf_counter()
+                    self.service.finish(turn, answer, model_handler.last_metrics)
+                    timings["finish"] = time.perf_counter() - stage
+
+                stage = time.perf_counter()
+                self.db.save_message(user_id, "assistant", answer, conversation_id)
+                timings["save_answer"] = time.perf_counter() - stage
+                timings["total"] = time.perf_counter() - start
+            except Exception as e:
+                with self._lock:
+                    self.errors.append(f"{type(e).__name__}: {str(e)}")
+                continue
+            finally:
+                with self._lock:
+                    for name, seconds in timings.items():
+                        self.samples[name].append(seconds)
+            if self.think:
+                time.sleep(rng.uniform(0, 2 * self.think))
+
+    def run(self):
+        pool_before = self.db.query_metrics()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.users) as executor:
+            list(executor.map(self.run_user, range(self.users)))
+        self.db.flush()
+        elapsed = time.perf_counter() - start
+        pool_after = self.db.query_metrics()
+
+        completed = len(self.samples["total"])
+        return {
+            "seconds": elapsed,
+            "requests": self.users * self.requests,
+            "completed": completed,
+            "rejected": self.rejected,
+            "cached": self.cached,
+            "errors": len(self.errors),
+            "error_samples": self.errors[:5],
+            "throughput_rps": completed / elapsed if elapsed else 0.0,
+            "stages": {stage: percentiles(values) for stage, values in self.samples.items()},
+            "database": {
+                "pool_wait_seconds": pool_after["pool_wait_seconds"] - pool_before["pool_wait_seconds"],
+                "lock_errors": pool_after["lock_errors"] - pool_before["lock_errors"],
+                # Time write transactions spent waiting on busy_timeout for
+                # the write lock
+                "write_transactions": pool_after["write_transactions"] - pool_before["write_transactions"],
+                "busy_waits": pool_after["busy_waits"] - pool_before["busy_waits"],
+                "busy_wait_seconds": pool_after["busy_wait_seconds"] - pool_before["busy_wait_seconds"],
+                "connections": pool_after["connections"],
+                "write_batches": self.db.writer.batches if self.db.writer else None,
+            },
+            "llm_retries": self.client_pool.retries,
+        }
+
+
+def compare(result, baseline):
+    print(f"{'stage':<14}{'p95 ms':>10}{'baseline':>10}{'change':>9}")
+    for stage in STAGES:
+        now = result["stages"][stage].get("p95_ms")
+        before = baseline.get("stages", {}).get(stage, {}).get("p95_ms")
+        if now is None or not before:
+            continue
+        print(f"{stage:<14}{now:>10.1f}{before:>10.1f}{(now - before) / before:>+9.1%}")
+    before = baseline.get("throughput_rps")
+    if before:
+        change = (result["throughput_rps"] - before) / before
+        print(f"{'throughput':<14}{result['throughput_rps']:>10.2f}{before:>10.2f}{change:>+9.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless end-to-end load test against the Groq stub")
+    parser.add_argument("--users", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=5, help="Requests per user")
+    parser.add_argument("--think-ms", type=float, default=0, help="Mean pause between a user's requests")
+    parser.add_argument("--corpus", choices=sorted(CORPUS_SIZES), default="small")
+    parser.add_argument("--first-token-ms", type=float, default=200)
+    parser.add_argument("--token-ms", type=float, default=10)
+    parser.add_argument("--tokens", type=int, default=64)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--config", default=os.path.join(APP_DIR, "config.json"))
+    parser.add_argument("--workdir", help="Where the database and vector stores go (default: temp dir)")
+    parser.add_argument("--output", default="load_test_results.json")
+    parser.add_argument("--baseline", help="Earlier results file to compare p95 latencies against")
+    args = parser.parse_args()
+
+    sys.path.insert(0, APP_DIR)
+    from stub_groq_server import start_stub_server
+    from utils import load_config
+
+    config = dict(load_config(args.config))
+    # Load is limited by the harness, not by the app's per-user limits
+    config["rate_limit"] = max(config["rate_limit"], args.requests)
+    config["global_rate_limit"] = max(config.get("global_rate_limit") or 0, args.users * args.requests)
+
+    server, base_url = start_stub_server(
+        first_token_ms=args.first_token_ms, token_ms=args.token_ms, tokens=args.tokens,
+        error_rate=args.error_rate
+    )
+    os.environ["GROQ_BASE_URL"] = base_url
+    os.environ.setdefault("GROQ_API_KEY", "stub")
+
+    output = os.path.abspath(args.output)
+    workdir = args.workdir or tempfile.mkdtemp(prefix="load_test_")
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    try:
+        test = LoadTest(config, args.users, args.requests, args.think_ms, args.seed)
+        corpus = make_corpus(args.corpus, args.seed)
+        print(f"Ingesting {len(corpus)} files ({args.corpus} corpus)...")
+        ingest = test.ingest(corpus)
+        print(f"Running {args.users} users x {args.requests} requests against {base_url}...")
+        result = test.run()
+    finally:
+        server.shutdown()
+        os.chdir(APP_DIR)
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    from embeddings import embedder_metrics
+    result.update({
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "settings": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+        "ingest": ingest,
+        "embedder": embedder_metrics(),
+        "peak_rss_mb": peak_rss_mb(),
+    })
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+
+    for stage in STAGES:
+        stats = result["stages"][stage]
+        if stats["count"]:
+            print(
+                f"{stage:<14} p50={stats['p50_ms']:8.1f}ms p95={stats['p95_ms']:8.1f}ms "
+                f"p99={stats['p99_ms']:8.1f}ms (n={stats['count']})"
+            )
+    print(
+        f"throughput={result['throughput_rps']:.2f} req/s rejected={result['rejected']} "
+        f"errors={result['errors']} pool_wait={result['database']['pool_wait_seconds']:.3f}s "
+        f"lock_errors={result['database']['lock_errors']} busy_waits={result['database']['busy_waits']} "
+        f"busy_wait={result['database']['busy_wait_seconds']:.3f}s peak_rss={result['peak_rss_mb']}"
+    )
+    print(f"Results written to {output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            compare(result, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
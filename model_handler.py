@@ -1,31 +1,316 @@
 # model_handler.py (Model Interaction Layer)
-from groq import Groq
-import streamlit as st
+import asyncio
+import itertools
+import logging
+import re
+import time
+from groq_client import retryable_errors
+from telemetry import get_telemetry
+
+logger = logging.getLogger("chatbot")
+
+CURSOR = "▌"
+
+
+class StreamRenderer:
+    # Streamlit can only replace an element's content, so re-rendering the
+    # whole answer per token costs O(n^2). Deltas are buffered and painted at
+    # most `fps` times a second (or every `flush_tokens` tokens), and finished
+    # paragraphs are moved into their own element so only the tail is resent.
+    def __init__(self, fps=15, flush_tokens=32):
+        import streamlit as st  # Only the UI needs Streamlit; the API server does not
+        self.min_interval = 1 / fps if fps else 0
+        self.flush_tokens = flush_tokens
+        self._container = st.container()
+        self._placeholder = self._container.empty()
+        self._blocks = []
+        self._tail = []
+        self._unflushed = 0
+        self._last_flush = 0.0
+        self.flushes = 0
+
+    def write(self, delta):
+        self._tail.append(delta)
+        self._unflushed += 1
+        now = time.perf_counter()
+        if self._unflushed >= self.flush_tokens or now - self._last_flush >= self.min_interval:
+            self.flush()
+
+    def flush(self, final=False):
+        tail = "".join(self._tail)
+        split = self._completed_prefix(tail)
+        if split:
+            self._placeholder.markdown(tail[:split])
+            self._blocks.append(tail[:split])
+            self._placeholder = self._container.empty()
+            tail = tail[split:]
+        self._tail = [tail]
+        self._placeholder.markdown(tail if final else tail + CURSOR)
+        self._unflushed = 0
+        self._last_flush = time.perf_counter()
+        self.flushes += 1
+
+    def text(self):
+        return "".join(self._blocks) + "".join(self._tail)
+
+    def _completed_prefix(self, text):
+        # Last paragraph break that is not inside a fenced code block
+        end = text.rfind("\n\n")
+        while end > 0:
+            if text.count("```", 0, end) % 2 == 0:
+                return end + 2
+            end = text.rfind("\n\n", 0, end)
+        return 0
+
+
+class BufferRenderer:
+    # Headless stand-in for StreamRenderer (benchmarks, background jobs)
+    def __init__(self, fps=15, flush_tokens=32):
+        self._parts = []
+        self.flushes = 0
+
+    def write(self, delta):
+        self._parts.append(delta)
+
+    def flush(self, final=False):
+        self.flushes += 1
+
+    def text(self):
+        return "".join(self._parts)
+
 
 class GroqModelHandler:
-    def __init__(self, client):
-        self.client = client
-    
-    def generate(self, prompt, model_name, temperature, max_tokens, stream=True):
-        full_response = ""
-        message_placeholder = st.empty()
-        
+    def __init__(self, client_pool, stream_fps=15, flush_tokens=32, renderer=StreamRenderer, router=None):
+        self.client_pool = client_pool
+        self.stream_fps = stream_fps
+        self.flush_tokens = flush_tokens
+        self.renderer = renderer
+        # Optional model_router.ModelRouter, fed with every attempt's outcome
+        self.router = router
+        self.last_metrics = None
+
+    def generate(self, prompt, model_name, temperature, max_tokens, stream=True, history=None, fallbacks=()):
+        # fallbacks: (model_name, prompt, max_tokens) attempts to move on to
+        # if this one fails with a 429, 5xx or timeout before its first token
+        renderer = self.renderer(self.stream_fps, self.flush_tokens)
+        start = time.perf_counter()
+        first_token_at = None
+        tokens = 0
+
         try:
-            response = self.client.chat.completions.create(
+            with self.client_pool.slot():
+                model_name, skipped, response = self._open(
+                    [(model_name, prompt, max_tokens)] + list(fallbacks), temperature, stream, history
+                )
+
+                for chunk in response:
+                    delta = self._delta(chunk)
+                    if delta:
+                        if first_token_at is None:
+                            first_token_at = time.perf_counter()
+                        tokens += 1
+                        renderer.write(delta)
+                    tokens = self._usage_tokens(chunk, tokens)
+
+            renderer.flush(final=True)
+            self._record_metrics(model_name, start, first_token_at, tokens, renderer.flushes, skipped)
+            return renderer.text()
+
+        except Exception as e:
+            raise RuntimeError(f"Model Error: {str(e)}")
+
+    def complete(self, messages, model_name, temperature, max_tokens):
+        # Non-streaming completion for background work such as summaries
+        with self.client_pool.slot():
+            response = self.client_pool.create_completion(
                 model=model_name,
-                messages=[{"role": "user", "content": prompt}],
+                messages=messages,
                 temperature=temperature,
                 max_tokens=max_tokens,
-                stream=stream
+                stream=False
             )
+        return response.choices[0].message.content or ""
+
+    def replay(self, text):
+        # Stream a cached answer through the same renderer as a live one
+        renderer = self.renderer(self.stream_fps, self.flush_tokens)
+        for token in re.findall(r"\S+\s*|\s+", text):
+            renderer.write(token)
+        renderer.flush(final=True)
+        return renderer.text()
+
+    async def astream(self, prompt, model_name, temperature, max_tokens, history=None, fallbacks=()):
+        # Headless async variant: yields deltas as they arrive, so a slow
+        # consumer (e.g. an SSE client) pauses reading from the model
+        start = time.perf_counter()
+        first_token_at = None
+        tokens = 0
+
+        try:
+            async with self.client_pool.async_slot():
+                model_name, skipped, response = await self._aopen(
+                    [(model_name, prompt, max_tokens)] + list(fallbacks), temperature, history
+                )
+
+                async for chunk in response:
+                    delta = self._delta(chunk)
+                    if delta:
+                        if first_token_at is None:
+                            first_token_at = time.perf_counter()
+                        tokens += 1
+                        yield delta
+                    tokens = self._usage_tokens(chunk, tokens)
+
+            self._record_metrics(model_name, start, first_token_at, tokens, 0, skipped)
 
-            for chunk in response:
-                if chunk.choices[0].delta.content:
-                    full_response += chunk.choices[0].delta.content
-                    message_placeholder.markdown(full_response + "▌")
-            
-            message_placeholder.markdown(full_response)
-            return full_response
-        
         except Exception as e:
-            raise RuntimeError(f"Model Error: {str(e)}")
\ No newline at end of file
+            raise RuntimeError(f"Model Error: {str(e)}")
+
+    async def agenerate(self, prompt, model_name, temperature, max_tokens, on_delta=None, history=None):
+        # Deltas go to on_delta instead of the UI
+        parts = []
+        async for delta in self.astream(prompt, model_name, temperature, max_tokens, history):
+            parts.append(delta)
+            if on_delta:
+                on_delta(delta)
+        return "".join(parts)
+
+    async def agenerate_many(self, requests):
+        # Fan out several completions at once, e.g. one per model to compare.
+        # Each request is a dict of agenerate keyword arguments; failures are
+        # returned in place rather than cancelling the other requests.
+        return await asyncio.gather(
+            *(self.agenerate(**request) for request in requests),
+            return_exceptions=True
+        )
+
+    def compare_models(self, prompt, model_names, temperature, max_tokens):
+        async def compare():
+            # The loop is gone after asyncio.run, so its client is closed here
+            try:
+                return await self.agenerate_many([
+                    {"prompt": prompt, "model_name": name, "temperature": temperature, "max_tokens": max_tokens}
+                    for name in model_names
+                ])
+            finally:
+                await self.client_pool.aclose()
+
+        return dict(zip(model_names, asyncio.run(compare())))
+
+    def _open(self, attempts, temperature, stream, history):
+        # Reads each attempt up to its first token; nothing has reached the
+        # renderer yet, so a failed attempt can still be swapped for the next.
+        # Returns the model used, how many attempts were skipped, and its
+        # chunks with the ones already read put back in front.
+        for index, (model_name, prompt, max_tokens) in enumerate(attempts):
+            last = index == len(attempts) - 1
+            attempt_start = time.perf_counter()
+            head = []
+            try:
+                response = iter(self.client_pool.create_completion(
+                    model=model_name,
+                    messages=self._messages(prompt, history),
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    stream=stream,
+                    **self._attempt_options(last)
+                ))
+                for chunk in response:
+                    head.append(chunk)
+                    if self._delta(chunk):
+                        break
+            except Exception as e:
+                if self._abandon(model_name, e, None if last else attempts[index + 1][0]):
+                    continue
+                raise
+            self._observe(model_name, time.perf_counter() - attempt_start)
+            return model_name, index, itertools.chain(head, response)
+
+    async def _aopen(self, attempts, temperature, history):
+        for index, (model_name, prompt, max_tokens) in enumerate(attempts):
+            last = index == len(attempts) - 1
+            attempt_start = time.perf_counter()
+            head = []
+            try:
+                response = (await self.client_pool.acreate_completion(
+                    model=model_name,
+                    messages=self._messages(prompt, history),
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    stream=True,
+                    **self._attempt_options(last)
+                )).__aiter__()
+                async for chunk in response:
+                    head.append(chunk)
+                    if self._delta(chunk):
+                        break
+            except Exception as e:
+                if self._abandon(model_name, e, None if last else attempts[index + 1][0]):
+                    continue
+                raise
+            self._observe(model_name, time.perf_counter() - attempt_start)
+            return model_name, index, _achain(head, response)
+
+    def _attempt_options(self, last):
+        # Attempts with a fallback behind them do not retry, and give up on a
+        # silent upstream after the router's first-token timeout
+        if last:
+            return {}
+        options = {"retries": 0}
+        if self.router:
+            options["timeout"] = self.router.first_token_timeout
+        return options
+
+    def _abandon(self, model_name, error, next_model):
+        fall_back = next_model is not None and isinstance(error, retryable_errors())
+        if self.router:
+            self.router.observe_error(model_name, error, fell_back=fall_back)
+        if fall_back:
+            logger.warning(
+                f"{model_name} failed before its first token ({type(error).__name__}), "
+                f"falling back to {next_model}"
+            )
+        return fall_back
+
+    def _observe(self, model_name, ttft_seconds):
+        if self.router:
+            self.router.observe(model_name, ttft_seconds)
+
+    def _messages(self, prompt, history):
+        # Earlier turns (and their summary) precede the current prompt
+        return list(history or []) + [{"role": "user", "content": prompt}]
+
+    def _delta(self, chunk):
+        if chunk.choices:
+            return chunk.choices[0].delta.content
+        return None
+
+    def _usage_tokens(self, chunk, tokens):
+        # Groq reports exact usage on the final chunk
+        usage = getattr(getattr(chunk, "x_groq", None), "usage", None)
+        return usage.completion_tokens if usage is not None else tokens
+
+    def _record_metrics(self, model_name, start, first_token_at, tokens, flushes, fallbacks=0):
+        end = time.perf_counter()
+        streaming = end - first_token_at if first_token_at else 0.0
+        self.last_metrics = {
+            "model": model_name,
+            "ttft_seconds": first_token_at - start if first_token_at else None,
+            "total_seconds": end - start,
+            "tokens": tokens,
+            "tokens_per_sec": tokens / streaming if streaming else 0.0,
+            "render_flushes": flushes,
+            "fallbacks": fallbacks,
+        }
+        get_telemetry().record_llm(model_name, self.last_metrics["ttft_seconds"], end - start)
+        logger.info(
+            f"{model_name}: ttft={self.last_metrics['ttft_seconds'] or 0:.3f}s "
+            f"tokens={tokens} ({self.last_metrics['tokens_per_sec']:.1f}/s) flushes={flushes}"
+        )
+
+
+async def _achain(head, rest):
+    for chunk in head:
+        yield chunk
+    async for chunk in rest:
+        yield chunk
@@ -0,0 +1,201 @@
+# model_router.py (Latency-Aware "auto" Model Selection)
+import logging
+import threading
+import time
+from context_builder import MESSAGE_OVERHEAD_TOKENS, MIN_ANSWER_TOKENS, ContextAssembler
+from telemetry import get_telemetry
+
+logger = logging.getLogger("chatbot")
+
+AUTO_MODEL = "auto"
+DEFAULT_ALPHA = 0.2
+DEFAULT_TTFT_SLO = 2.0
+DEFAULT_ERROR_SLO = 0.2
+DEFAULT_FIRST_TOKEN_TIMEOUT = 10.0
+DEFAULT_COOLDOWN = 10.0
+DEFAULT_RECOVERY = 120.0
+MAX_ERROR_EWMA = 0.95
+
+
+class ModelStats:
+    __slots__ = ("ttft", "errors", "updated", "cooldown_until", "requests", "failures", "routed", "fallbacks")
+
+    def __init__(self):
+        self.ttft = None
+        self.errors = 0.0
+        self.updated = 0.0
+        self.cooldown_until = 0.0
+        self.requests = 0
+        self.failures = 0
+        self.routed = 0
+        self.fallbacks = 0
+
+
+class ModelRouter:
+    # Ranks the configured models for each request. A model whose prompt
+    # would not fit its context window goes last, then models cooling down
+    # after a 429, then models outside their latency/error SLO; the rest are
+    # ordered by expected time to first token, i.e. the TTFT EWMA inflated by
+    # the error EWMA. Models without measurements start at their SLO, and
+    # measurements fade back towards it over recovery_seconds so a model that
+    # had a bad minute is tried again rather than starved forever.
+    def __init__(self, config=None):
+        config = config or {}
+        self.models = [name for name in config.get("available_models", []) if name != AUTO_MODEL]
+        self.slos = config.get("model_slos", {})
+        self.alpha = config.get("router_ewma_alpha", DEFAULT_ALPHA)
+        self.first_token_timeout = config.get("router_first_token_timeout", DEFAULT_FIRST_TOKEN_TIMEOUT)
+        self.cooldown = config.get("router_cooldown_seconds", DEFAULT_COOLDOWN)
+        self.recovery = config.get("router_recovery_seconds", DEFAULT_RECOVERY)
+        self.assembler = ContextAssembler(config)
+        self._lock = threading.Lock()
+        self._stats = {name: ModelStats() for name in self.models}
+
+    def slo(self, model_name):
+        slo = self.slos.get(model_name, {})
+        return slo.get("ttft_seconds", DEFAULT_TTFT_SLO), slo.get("error_rate", DEFAULT_ERROR_SLO)
+
+    def _current(self, model_name, stats, now):
+        # (ttft, error rate), decayed towards the SLO prior with age
+        ttft_slo, _ = self.slo(model_name)
+        if stats.ttft is None:
+            return ttft_slo, 0.0
+        weight = 0.5 ** ((now - stats.updated) / self.recovery) if self.recovery else 1.0
+        return stats.ttft * weight + ttft_slo * (1 - weight), stats.errors * weight
+
+    def prompt_tokens(self, question, chunks, history, model_name):
+        # Everything the prompt could contain before packing trims it
+        return (
+            self.assembler.count_tokens(question, model_name)
+            + sum(self.assembler.count_tokens(content, model_name) + 1 for content, _ in chunks)
+            + sum(
+                self.assembler.count_tokens(message["content"], model_name) + MESSAGE_OVERHEAD_TOKENS
+                for message in history or ()
+            )
+        )
+
+    def rank(self, question="", chunks=(), history=None, max_tokens=MIN_ANSWER_TOKENS):
+        now = time.monotonic()
+        ranked = []
+        with self._lock:
+            for index, model_name in enumerate(self.models):
+                stats = self._stats[model_name]
+                limits = self.assembler.limits(model_name)
+                needed = (
+                    self.prompt_tokens(question, chunks, history, model_name)
+                    + min(max_tokens, MIN_ANSWER_TOKENS) + self.assembler.reserve_tokens
+                )
+                ttft, errors = self._current(model_name, stats, now)
+                ttft_slo, error_slo = self.slo(model_name)
+                expected = ttft / (1 - min(errors, MAX_ERROR_EWMA))
+                ranked.append((
+                    needed > limits["context_window"],
+                    stats.cooldown_until > now,
+                    ttft > ttft_slo or errors > error_slo,
+                    expected,
+                    index,
+                    model_name
+                ))
+        return [entry[-1] for entry in sorted(ranked)]
+
+    def resolve(self, model_name):
+        # A concrete model for work that is not routed per attempt, such as
+        # conversation summaries
+        if model_name != AUTO_MODEL:
+            return model_name
+        return self.rank()[0]
+
+    def routed(self, model_name):
+        with self._lock:
+            if model_name in self._stats:
+                self._stats[model_name].routed += 1
+        get_telemetry().router_routes.inc(model=model_name)
+
+    def observe(self, model_name, ttft_seconds):
+        stats = self._stats.get(model_name)
+        if stats is None or ttft_seconds is None:
+            return
+        with self._lock:
+            stats.ttft = ttft_seconds if stats.ttft is None else self._ewma(stats.ttft, ttft_seconds)
+            stats.errors = self._ewma(stats.errors, 0.0)
+            stats.updated = time.monotonic()
+            stats.requests += 1
+        get_telemetry().router_ttft.set(stats.ttft, model=model_name)
+
+    def observe_error(self, model_name, error, fell_back=False):
+        stats = self._stats.get(model_name)
+        if stats is None:
+            return
+        now = time.monotonic()
+        with self._lock:
+            stats.errors = self._ewma(stats.errors, 1.0)
+            if _is_timeout(error):
+                # A timed-out attempt took at least this long to say nothing
+                stats.ttft = self._ewma(stats.ttft or self.first_token_timeout, self.first_token_timeout)
+            if _status_code(error) == 429:
+                stats.cooldown_until = now + (_retry_after(error) or self.cooldown)
+            stats.updated = now
+            stats.requests += 1
+            stats.failures += 1
+            if fell_back:
+                stats.fallbacks += 1
+        telemetry = get_telemetry()
+        telemetry.router_errors.set(stats.errors, model=model_name)
+        if fell_back:
+            telemetry.router_fallbacks.inc(model=model_name, reason=type(error).__name__)
+
+    def _ewma(self, current, value):
+        return self.alpha * value + (1 - self.alpha) * current
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            result = {}
+            for model_name, stats in self._stats.items():
+                ttft, errors = self._current(model_name, stats, now)
+                ttft_slo, error_slo = self.slo(model_name)
+                result[model_name] = {
+                    "ttft_ewma_seconds": ttft,
+                    "error_ewma": errors,
+                    "ttft_slo_seconds": ttft_slo,
+                    "error_slo": error_slo,
+                    "within_slo": ttft <= ttft_slo and errors <= error_slo,
+                    "cooldown_seconds": max(stats.cooldown_until - now, 0.0),
+                    "requests": stats.requests,
+                    "failures": stats.failures,
+                    "routed": stats.routed,
+                    "fallbacks": stats.fallbacks,
+                }
+            return result
+
+
+def _status_code(error):
+    return getattr(error, "status_code", None)
+
+
+def _is_timeout(error):
+    return "Timeout" in type(error).__name__
+
+
+def _retry_after(error):
+    response = getattr(error, "response", None)
+    if response is not None:
+        try:
+            return float(response.headers.get("retry-after"))
+        except (TypeError, ValueError):
+            pass
+    return None
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_model_router(config=None):
+    # EWMAs are shared by every session in the process
+    global _router
+    if _router is None:
+        with _router_lock:
+            if _router is None:
+                _router = ModelRouter(config)
+    return _router
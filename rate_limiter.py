@@ -0,0 +1,111 @@
+# rate_limiter.py (Pluggable Rate Limiting)
+import threading
+import time
+from collections import deque
+
+GLOBAL_KEY = "global"
+
+
+class InMemoryRateLimiter:
+    # Sliding-window log per user plus one for the whole process. Exact, and
+    # a check is a few deque operations, but limits are per worker process.
+    def __init__(self, limit=10, window=60, global_limit=None, max_keys=100000):
+        self.limit = limit
+        self.window = window
+        self.global_limit = global_limit
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._logs = {}
+
+    def allow(self, user_id):
+        now = time.monotonic()
+        cutoff = now - self.window
+        with self._lock:
+            log = self._prune(self._logs.get(user_id), cutoff)
+            if log is not None and len(log) >= self.limit:
+                return False
+            if self.global_limit:
+                global_log = self._prune(self._logs.get(GLOBAL_KEY), cutoff)
+                if global_log is not None and len(global_log) >= self.global_limit:
+                    return False
+                self._append(GLOBAL_KEY, now)
+            self._append(user_id, now)
+            if len(self._logs) > self.max_keys:
+                self._sweep(cutoff)
+            return True
+
+    def _prune(self, log, cutoff):
+        if log is not None:
+            while log and log[0] <= cutoff:
+                log.popleft()
+        return log
+
+    def _append(self, key, now):
+        log = self._logs.get(key)
+        if log is None:
+            log = self._logs[key] = deque()
+        log.append(now)
+
+    def _sweep(self, cutoff):
+        for key in [k for k, log in self._logs.items() if not log or log[-1] <= cutoff]:
+            del self._logs[key]
+
+
+class SQLiteRateLimiter:
+    # Shared through chatbot.db, so limits hold across worker processes
+    def __init__(self, db, limit=10, window=60, global_limit=None):
+        self.db = db
+        self.limit = limit
+        self.window = window
+        self.global_limit = global_limit
+
+    def allow(self, user_id):
+        return self.db.check_rate_limit(
+            user_id, limit=self.limit, window=self.window, global_limit=self.global_limit
+        )
+
+
+def create_rate_limiter(config, db=None):
+    settings = {
+        "limit": config.get("rate_limit", 10),
+        "window": config.get("rate_window", 60),
+        "global_limit": config.get("global_rate_limit"),
+    }
+    if config.get("rate_limit_backend", "memory") == "sqlite":
+        return SQLiteRateLimiter(db, **settings)
+    return InMemoryRateLimiter(**settings)
+
+
+# Limiter state must outlive Streamlit reruns, so it is kept per process
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter(config, db=None):
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = create_rate_limiter(config, db)
+    return _limiter
+
+
+if __name__ == "__main__":
+    # Micro-benchmark: python rate_limiter.py
+    import os
+    import tempfile
+    from database import DatabaseManager
+
+    def bench(limiter, checks):
+        start = time.perf_counter()
+        for i in range(checks):
+            limiter.allow(i % 1000)
+        return (time.perf_counter() - start) / checks * 1e6
+
+    memory = InMemoryRateLimiter(limit=10, window=60, global_limit=10**9)
+    print(f"memory: {bench(memory, 200000):.2f} us/check")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = DatabaseManager(os.path.join(tmp, "bench.db"))
+        sqlite = SQLiteRateLimiter(db, limit=10, window=60, global_limit=10**9)
+        print(f"sqlite: {bench(sqlite, 5000):.2f} us/check")
@@ -0,0 +1,138 @@
+# response_cache.py (Semantic Answer Cache)
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from telemetry import get_telemetry
+
+logger = logging.getLogger("chatbot")
+
+DEFAULT_THRESHOLD = 0.95
+DEFAULT_MAX_TEMPERATURE = 0.3
+
+
+def context_fingerprint(context):
+    return hashlib.sha256(context.encode()).hexdigest()
+
+
+class SemanticResponseCache:
+    # Answers are only reused for the same retrieved context, model and
+    # temperature, and when the question embedding is within `threshold`
+    # cosine similarity of a previous question. Embeddings are normalized, so
+    # cosine similarity is a dot product.
+    def __init__(self, threshold=DEFAULT_THRESHOLD, maxsize=512, ttl=3600,
+                 max_temperature=DEFAULT_MAX_TEMPERATURE):
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_temperature = max_temperature
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._next_id = 0
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.saved_seconds = 0.0
+        self.saved_tokens = 0
+
+    def is_cacheable(self, temperature):
+        if temperature > self.max_temperature:
+            with self._lock:
+                self.bypassed += 1
+            get_telemetry().response_cache_lookups.inc(result="bypassed")
+            return False
+        return True
+
+    def _partition(self, context, model, temperature):
+        return (context_fingerprint(context), model, round(temperature, 2))
+
+    def lookup(self, embedding, context, model, temperature):
+        import numpy as np  # Deferred to keep app startup light
+        partition = self._partition(context, model, temperature)
+        query = np.asarray(embedding, dtype=np.float32)
+        now = time.monotonic()
+        with self._lock:
+            candidates = []
+            for entry_id, entry in list(self._entries.items()):
+                if entry["expires_at"] <= now:
+                    del self._entries[entry_id]
+                elif entry["partition"] == partition:
+                    candidates.append((entry_id, entry))
+
+            if candidates:
+                vectors = np.stack([entry["vector"] for _, entry in candidates])
+                scores = vectors @ query
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    entry_id, entry = candidates[best]
+                    self._entries.move_to_end(entry_id)
+                    self.hits += 1
+                    self.saved_seconds += entry["seconds"]
+                    self.saved_tokens += entry["tokens"]
+                    self._publish("hit", entry)
+                    return entry["answer"]
+            self.misses += 1
+            self._publish("miss")
+            return None
+
+    def _publish(self, result, entry=None):
+        # Called with the lock held, so the hit rate matches the counters
+        telemetry = get_telemetry()
+        telemetry.response_cache_lookups.inc(result=result)
+        telemetry.response_cache_hit_rate.set(self.hits / (self.hits + self.misses))
+        if entry is not None:
+            telemetry.response_cache_saved_seconds.inc(entry["seconds"])
+            telemetry.response_cache_saved_tokens.inc(entry["tokens"])
+
+    def store(self, embedding, context, model, temperature, answer, seconds=0.0, tokens=0):
+        import numpy as np
+        with self._lock:
+            self._entries[self._next_id] = {
+                "partition": self._partition(context, model, temperature),
+                "vector": np.asarray(embedding, dtype=np.float32),
+                "answer": answer,
+                "expires_at": time.monotonic() + self.ttl,
+                "seconds": seconds,
+                "tokens": tokens,
+            }
+            self._next_id += 1
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "bypassed": self.bypassed,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "saved_seconds": self.saved_seconds,
+                "saved_tokens": self.saved_tokens,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache(config=None):
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                config = config or {}
+                _cache = SemanticResponseCache(
+                    threshold=config.get("semantic_cache_threshold", DEFAULT_THRESHOLD),
+                    maxsize=config.get("semantic_cache_size", 512),
+                    ttl=config.get("semantic_cache_ttl", 3600),
+                    max_temperature=config.get("semantic_cache_max_temperature", DEFAULT_MAX_TEMPERATURE)
+                )
+                if config.get("default_temp", 0.0) > _cache.max_temperature:
+                    logger.warning(
+                        f"default_temp {config['default_temp']} is above semantic_cache_max_temperature "
+                        f"{_cache.max_temperature}; answers at the default temperature are never cached"
+                    )
+    return _cache
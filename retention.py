@@ -0,0 +1,408 @@
+# retention.py (Chat History Retention, Archival and Compaction)
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+logger = logging.getLogger("chatbot")
+
+DEFAULT_ARCHIVE_DIR = "chat_archive"
+DEFAULT_ARCHIVE_AFTER_DAYS = 90
+DEFAULT_INTERVAL = 600
+DEFAULT_BUDGET_SECONDS = 5.0
+DEFAULT_STEP_MS = 50
+DEFAULT_BATCH_SIZE = 200
+DEFAULT_SEGMENT_MB = 64
+DEFAULT_PAUSE_MS = 20
+MAX_VACUUM_PAGES = 4096
+ANALYSIS_LIMIT = 400
+
+
+class ArchiveSegments:
+    # Archived messages live in gzip files that are only ever appended to.
+    # Each archive step writes one gzip member per user, and the member's
+    # byte range is recorded in archive_segments, so reading one user's
+    # archive decompresses only that user's members. A member written by a
+    # step that then failed to commit is never indexed and simply ignored.
+    def __init__(self, directory=DEFAULT_ARCHIVE_DIR, segment_bytes=DEFAULT_SEGMENT_MB * 1024 * 1024):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+
+    def _path(self, segment):
+        return os.path.join(self.directory, segment)
+
+    def current_segment(self, conn):
+        row = conn.execute("SELECT segment FROM archive_segments ORDER BY id DESC LIMIT 1").fetchone()
+        if row is None:
+            return "segment-000001.jsonl.gz"
+        path = self._path(row[0])
+        if os.path.exists(path) and os.path.getsize(path) >= self.segment_bytes:
+            number = int(row[0].split("-")[1].split(".")[0]) + 1
+            return f"segment-{number:06d}.jsonl.gz"
+        return row[0]
+
+    def append(self, segment, rows):
+        # Returns (offset, length) of the new member; fsynced before the
+        # caller commits the index row and deletes the source rows
+        os.makedirs(self.directory, exist_ok=True)
+        data = gzip.compress("".join(json.dumps(row) + "\n" for row in rows).encode("utf-8"))
+        with open(self._path(segment), "ab") as f:
+            offset = f.seek(0, os.SEEK_END)
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        return offset, len(data)
+
+    def read(self, segment, offset, length):
+        with open(self._path(segment), "rb") as f:
+            f.seek(offset)
+            data = f.read(length)
+        return [json.loads(line) for line in gzip.decompress(data).decode("utf-8").splitlines()]
+
+
+class RetentionManager:
+    """Keeps chatbot.db small without blocking live traffic.
+
+    Each cycle archives messages beyond a user's max_history and messages
+    older than archive_after_days, purges expired sessions and stale rate
+    limit rows, then runs incremental VACUUM, a bounded ANALYZE and a
+    passive WAL checkpoint. Work is split into short transactions of at
+    most batch_size rows, with a pause between them, and a cycle stops once
+    its time budget is spent; whatever is left is picked up next cycle.
+    """
+
+    def __init__(self, db, max_history=100, archive_after_days=DEFAULT_ARCHIVE_AFTER_DAYS,
+                 archive=None, rate_window=60, interval=DEFAULT_INTERVAL, budget_seconds=DEFAULT_BUDGET_SECONDS,
+                 step_ms=DEFAULT_STEP_MS, batch_size=DEFAULT_BATCH_SIZE, pause_ms=DEFAULT_PAUSE_MS):
+        self.db = db
+        self.max_history = max_history
+        self.archive_after_days = archive_after_days
+        self.archive = archive or ArchiveSegments()
+        self.rate_window = rate_window
+        self.interval = interval
+        self.budget_seconds = budget_seconds
+        self.step_seconds = step_ms / 1000
+        self.batch_size = batch_size
+        self.pause = pause_ms / 1000
+        self.vacuum_pages = 256
+        self._lock = threading.Lock()
+        self._thread = None
+        self._caps_cursor = 0  # Last user id whose history cap was enforced
+        self.stats = {
+            "cycles": 0,
+            "archived_messages": 0,
+            "archive_members": 0,
+            "purged_sessions": 0,
+            "purged_rate_limits": 0,
+            "vacuumed_pages": 0,
+            "last_cycle_seconds": 0.0,
+        }
+
+    # Archiving
+    def _archive_rows(self, conn, rows):
+        # rows: (id, user_id, conversation_id, role, content, timestamp)
+        # with a write transaction already open on conn
+        segment = self.archive.current_segment(conn)
+        by_user = {}
+        for row in rows:
+            by_user.setdefault(row[1], []).append({
+                "id": row[0], "conversation_id": row[2], "role": row[3],
+                "content": row[4], "timestamp": row[5]
+            })
+        for user_id, messages in by_user.items():
+            offset, length = self.archive.append(segment, messages)
+            conn.execute('''
+                INSERT INTO archive_segments
+                    (user_id, segment, byte_offset, byte_length, first_id, last_id, message_count)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (user_id, segment, offset, length, messages[0]["id"], messages[-1]["id"], len(messages)))
+        conn.executemany("DELETE FROM chat_history WHERE id = ?", [(row[0],) for row in rows])
+        self.stats["archived_messages"] += len(rows)
+        self.stats["archive_members"] += len(by_user)
+
+    def _archive_step(self, name, select, params):
+        # BEGIN IMMEDIATE holds the write lock from the select to the delete,
+        # which also serializes segment appends between worker processes
+        with self.db.pool.connection(name, write=True) as conn:
+            rows = select(conn, params)
+            if rows:
+                self._archive_rows(conn, rows)
+        return len(rows)
+
+    def _select_oldest(self, conn, cutoff):
+        # Ids grow with time, so the oldest messages are always at the start
+        # of the table; reading from there never scans the whole of it
+        rows = conn.execute('''
+            SELECT id, user_id, conversation_id, role, content, timestamp
+            FROM chat_history ORDER BY id LIMIT ?
+        ''', (self.batch_size,)).fetchall()
+        expired = []
+        for row in rows:
+            if row[5] is None or row[5] >= cutoff:
+                break
+            expired.append(row)
+        return expired
+
+    def _select_overflow(self, conn, params):
+        user_id, last_id = params
+        return conn.execute('''
+            SELECT id, user_id, conversation_id, role, content, timestamp
+            FROM chat_history WHERE user_id = ? AND id <= ? ORDER BY id LIMIT ?
+        ''', (user_id, last_id, self.batch_size)).fetchall()
+
+    def _overflow_boundary(self, conn, user_id):
+        # Id of the newest message past the user's cap, or None. Reads at
+        # most max_history + 1 index entries, however long the history.
+        row = conn.execute('''
+            SELECT id FROM chat_history WHERE user_id = ?
+            ORDER BY id DESC LIMIT 1 OFFSET ?
+        ''', (user_id, self.max_history)).fetchone()
+        return row and row[0]
+
+    def archive_expired(self, deadline):
+        if not self.archive_after_days:
+            return 0
+        cutoff = (datetime.now(timezone.utc) - timedelta(days=self.archive_after_days)).strftime("%Y-%m-%d %H:%M:%S")
+        archived = 0
+        while time.monotonic() < deadline:
+            count = self._archive_step("archive_expired", self._select_oldest, cutoff)
+            archived += count
+            if count < self.batch_size:
+                break
+            time.sleep(self.pause)
+        return archived
+
+    def enforce_history_caps(self, deadline):
+        # Walks users in keyset batches of batch_size. A cycle that runs out
+        # of time stops between users, and the next one resumes after the
+        # last user it finished, so no cycle scans the whole table.
+        if not self.max_history:
+            return 0
+        archived = 0
+        while time.monotonic() < deadline:
+            with self.db.pool.connection("history_overflow") as conn:
+                users = [row[0] for row in conn.execute(
+                    "SELECT id FROM users WHERE id > ? ORDER BY id LIMIT ?",
+                    (self._caps_cursor, self.batch_size)
+                )]
+            for user_id in users:
+                while True:
+                    if time.monotonic() >= deadline:
+                        return archived
+                    with self.db.pool.connection("history_overflow") as conn:
+                        last_id = self._overflow_boundary(conn, user_id)
+                    if last_id is None:
+                        break
+                    archived += self._archive_step("archive_overflow", self._select_overflow, (user_id, last_id))
+                    time.sleep(self.pause)
+                self._caps_cursor = user_id
+            if len(users) < self.batch_size:
+                # Every user checked; start from the first one next cycle
+                self._caps_cursor = 0
+                break
+        return archived
+
+    def archived_history(self, user_id, limit=100, before_id=None, conversation_id=None):
+        # Same shape and keyset pagination as DatabaseManager.get_history,
+        # for messages that have left chat_history
+        conditions = ["user_id = ?"]
+        params = [user_id]
+        if before_id is not None:
+            conditions.append("first_id < ?")
+            params.append(before_id)
+        with self.db.pool.connection("archived_history") as conn:
+            members = conn.execute(f'''
+                SELECT segment, byte_offset, byte_length FROM archive_segments
+                WHERE {" AND ".join(conditions)}
+                ORDER BY last_id DESC
+            ''', params).fetchall()
+
+        history = []
+        for segment, offset, length in members:
+            messages = [
+                message for message in self.archive.read(segment, offset, length)
+                if (before_id is None or message["id"] < before_id)
+                and (conversation_id is None or message["conversation_id"] == conversation_id)
+            ]
+            history = messages + history
+            if len(history) >= limit:
+                break
+        return [
+            {"id": m["id"], "role": m["role"], "content": m["content"], "timestamp": m["timestamp"]}
+            for m in sorted(history, key=lambda m: m["id"])[-limit:]
+        ]
+
+    # Purging
+    def purge_rate_limits(self, deadline):
+        # A window is still read while it is the previous one, so only
+        # windows older than that are dropped
+        window_cutoff = int(time.time() // self.rate_window) * self.rate_window - self.rate_window
+        legacy_cutoff = datetime.now() - timedelta(seconds=self.rate_window)
+        purged = 0
+        while time.monotonic() < deadline:
+            with self.db.pool.connection("purge_rate_limits") as conn:
+                count = conn.execute('''
+                    DELETE FROM rate_limit_windows WHERE (key, window_start) IN (
+                        SELECT key, window_start FROM rate_limit_windows
+                        WHERE window_start < ? LIMIT ?
+                    )
+                ''', (window_cutoff, self.batch_size)).rowcount
+                count += conn.execute('''
+                    DELETE FROM rate_limits WHERE rowid IN (
+                        SELECT rowid FROM rate_limits WHERE last_request < ? LIMIT ?
+                    )
+                ''', (legacy_cutoff, self.batch_size)).rowcount
+            purged += count
+            if count < self.batch_size:
+                break
+            time.sleep(self.pause)
+        self.stats["purged_rate_limits"] += purged
+        return purged
+
+    # Compaction
+    def incremental_vacuum(self, deadline):
+        # Only has an effect when auto_vacuum is INCREMENTAL; see
+        # enable_incremental_vacuum for databases created before that.
+        # The page count per step adapts so each step stays near step_seconds.
+        with self.db.pool.connection() as conn:
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                return 0
+        freed = 0
+        while time.monotonic() < deadline:
+            with self.db.pool.connection("incremental_vacuum") as conn:
+                free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+                if not free:
+                    break
+                pages = min(free, self.vacuum_pages)
+                start = time.monotonic()
+                # execute() would step the pragma once, freeing a single page
+                conn.executescript(f"PRAGMA incremental_vacuum({pages})")
+                elapsed = time.monotonic() - start
+            freed += pages
+            if elapsed > self.step_seconds:
+                self.vacuum_pages = max(16, self.vacuum_pages // 2)
+            elif elapsed < self.step_seconds / 2:
+                self.vacuum_pages = min(MAX_VACUUM_PAGES, self.vacuum_pages * 2)
+            time.sleep(self.pause)
+        self.stats["vacuumed_pages"] += freed
+        return freed
+
+    def optimize(self):
+        # analysis_limit makes ANALYZE sample each index instead of reading
+        # all of it, and optimize only analyzes tables that need it
+        with self.db.pool.connection("optimize") as conn:
+            conn.execute(f"PRAGMA analysis_limit = {ANALYSIS_LIMIT}")
+            conn.execute("PRAGMA optimize").fetchall()
+            conn.execute("PRAGMA analysis_limit = 0")
+            # PASSIVE never waits for readers or writers
+            conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchall()
+
+    def run_cycle(self, budget_seconds=None):
+        # One bounded pass over every task; returns what it did
+        start = time.monotonic()
+        deadline = start + (budget_seconds if budget_seconds is not None else self.budget_seconds)
+        with self._lock:
+            result = {
+                "history_overflow": self.enforce_history_caps(deadline),
+                "expired_messages": self.archive_expired(deadline),
+                "sessions": self.db.purge_expired_sessions(self.batch_size),
+                "rate_limits": self.purge_rate_limits(deadline),
+            }
+            self.stats["purged_sessions"] += result["sessions"]
+            result["vacuumed_pages"] = self.incremental_vacuum(deadline)
+            self.optimize()
+            self.stats["cycles"] += 1
+            self.stats["last_cycle_seconds"] = time.monotonic() - start
+        archived = result["history_overflow"] + result["expired_messages"]
+        if archived or result["rate_limits"] or result["vacuumed_pages"]:
+            logger.info(
+                f"Retention: archived {archived} messages, purged {result['sessions']} sessions "
+                f"and {result['rate_limits']} rate limit rows, vacuumed {result['vacuumed_pages']} pages "
+                f"in {self.stats['last_cycle_seconds']:.2f}s"
+            )
+        return result
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="retention", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.run_cycle()
+            except Exception as e:
+                logger.error(f"Retention cycle failed: {str(e)}")
+
+
+def enable_incremental_vacuum(database):
+    # One-off for databases created before auto_vacuum was set: a full
+    # VACUUM rewrites the file, so run it while the app is stopped
+    import sqlite3
+    conn = sqlite3.connect(database)
+    try:
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        return conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+    finally:
+        conn.close()
+
+
+def create_retention_manager(config, db):
+    return RetentionManager(
+        db,
+        max_history=config.get("max_history", 100),
+        archive_after_days=config.get("archive_after_days", DEFAULT_ARCHIVE_AFTER_DAYS),
+        archive=ArchiveSegments(
+            config.get("archive_dir", DEFAULT_ARCHIVE_DIR),
+            config.get("archive_segment_mb", DEFAULT_SEGMENT_MB) * 1024 * 1024
+        ),
+        rate_window=config.get("rate_window", 60),
+        interval=config.get("retention_interval", DEFAULT_INTERVAL),
+        budget_seconds=config.get("retention_budget_seconds", DEFAULT_BUDGET_SECONDS),
+        step_ms=config.get("retention_step_ms", DEFAULT_STEP_MS),
+        batch_size=config.get("retention_batch_size", DEFAULT_BATCH_SIZE)
+    )
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_retention_manager(config, db):
+    # One background retention thread per process
+    global _manager
+    if _manager is None:
+        with _manager_lock:
+            if _manager is None:
+                _manager = create_retention_manager(config, db)
+                if config.get("retention_interval", DEFAULT_INTERVAL):
+                    _manager.start()
+    return _manager
+
+
+if __name__ == "__main__":
+    # python retention.py                  run one cycle now
+    # python retention.py --enable-vacuum  one-off switch to incremental vacuum
+    import argparse
+    from database import DATABASE_NAME, get_database
+    from utils import load_config, setup_logger
+
+    parser = argparse.ArgumentParser(description="Archive, purge and compact chatbot.db")
+    parser.add_argument("--config", default="config.json")
+    parser.add_argument("--database", default=DATABASE_NAME)
+    parser.add_argument("--budget", type=float, default=30.0, help="Seconds to spend on this cycle")
+    parser.add_argument("--enable-vacuum", action="store_true")
+    args = parser.parse_args()
+
+    setup_logger()
+    if args.enable_vacuum:
+        print("incremental vacuum enabled" if enable_incremental_vacuum(args.database) else "failed")
+    else:
+        manager = create_retention_manager(load_config(args.config), get_database(args.database))
+        print(json.dumps(manager.run_cycle(args.budget), indent=2))
+        print(json.dumps(manager.stats, indent=2))
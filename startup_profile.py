@@ -0,0 +1,120 @@
+# startup_profile.py (Cold Start Profile and Budget Check)
+# Imports app.py in a fresh interpreter, reports where the time goes and fails
+# (exit code 1) when startup regresses past the budget, so it can run as a CI
+# step next to compileall:
+#   python startup_profile.py --cold-budget-ms 2500 --rerun-budget-ms 50
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+DEFAULT_COLD_BUDGET_MS = 2500
+DEFAULT_RERUN_BUDGET_MS = 50
+# Must not be imported until a code path actually needs them
+DEFERRED_MODULES = (
+    "chromadb",
+    "sentence_transformers",
+    "torch",
+    "langchain_community",
+    "langchain_text_splitters",
+    "langchain_core",
+    "pdfplumber",
+    "pypdf",
+    "groq",
+    "httpx",
+    "numpy",
+)
+
+# Runs in the child: a cold import, then the module body again the way a
+# Streamlit rerun executes it (imported modules stay cached)
+PROBE = """
+import json, runpy, sys, time
+start = time.perf_counter()
+import app
+cold = time.perf_counter() - start
+start = time.perf_counter()
+runpy.run_path(sys.argv[1], run_name="app_rerun")
+rerun = time.perf_counter() - start
+print(json.dumps({
+    "cold_seconds": cold,
+    "rerun_seconds": rerun,
+    "loaded": [name for name in %r if name in sys.modules],
+}))
+""" % (DEFERRED_MODULES,)
+
+
+def parse_importtime(stderr):
+    # -X importtime lines: "import time: self [us] | cumulative | imported package"
+    timings = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        # Nested imports are indented by two spaces per level
+        timings.append((name[1:].rstrip(), int(self_us), int(cumulative_us)))
+    return timings
+
+
+def profile(app_dir, top=15, cwd=None):
+    # cwd: where app.py runs, and so where it finds config.json and creates
+    # chatbot.db; defaults to app_dir
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [app_dir, os.environ.get("PYTHONPATH")])))
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", PROBE, os.path.join(app_dir, "app.py")],
+        cwd=cwd or app_dir, env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing app.py failed:\n{result.stderr[-2000:]}")
+
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+    # Children are printed before their parent: keep the direct imports of app
+    direct, children = [], []
+    for name, _, cumulative in parse_importtime(result.stderr):
+        if not name.startswith(" "):
+            if name == "app":
+                direct = children
+            children = []
+        elif not name.startswith("   "):
+            children.append((name.strip(), cumulative))
+    report["slowest_imports"] = [
+        {"module": name, "ms": cumulative / 1000}
+        for name, cumulative in sorted(direct, key=lambda item: item[1], reverse=True)[:top]
+    ]
+    return report
+
+
+def check(report, cold_budget_ms, rerun_budget_ms):
+    failures = []
+    if report["cold_seconds"] * 1000 > cold_budget_ms:
+        failures.append(f"cold import took {report['cold_seconds'] * 1000:.0f} ms (budget {cold_budget_ms} ms)")
+    if report["rerun_seconds"] * 1000 > rerun_budget_ms:
+        failures.append(f"rerun took {report['rerun_seconds'] * 1000:.1f} ms (budget {rerun_budget_ms} ms)")
+    if report["loaded"]:
+        failures.append(f"deferred modules imported at startup: {', '.join(report['loaded'])}")
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Profile app.py cold start against a budget")
+    parser.add_argument("--cold-budget-ms", type=float, default=DEFAULT_COLD_BUDGET_MS)
+    parser.add_argument("--rerun-budget-ms", type=float, default=DEFAULT_RERUN_BUDGET_MS)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+
+    report = profile(os.path.dirname(os.path.abspath(__file__)), args.top)
+    failures = check(report, args.cold_budget_ms, args.rerun_budget_ms)
+    report["failures"] = failures
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"cold import: {report['cold_seconds'] * 1000:.0f} ms")
+        print(f"rerun:       {report['rerun_seconds'] * 1000:.1f} ms")
+        print("slowest imports:")
+        for entry in report["slowest_imports"]:
+            print(f"  {entry['ms']:8.1f} ms  {entry['module']}")
+        for failure in failures:
+            print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
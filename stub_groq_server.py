@@ -0,0 +1,151 @@
+# stub_groq_server.py (Local Groq API Stub)
+# Mimics POST /openai/v1/chat/completions, including SSE streaming, so the
+# client pool, retries and load tests can run without network access:
+#   python stub_groq_server.py --port 8765 --first-token-ms 200 --token-ms 20
+#   GROQ_BASE_URL=http://127.0.0.1:8765 GROQ_API_KEY=stub streamlit run app.py
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+COMPLETIONS_PATH = "/openai/v1/chat/completions"
+LOREM = (
+    "Rest, fluids and monitoring your temperature are usually enough for a mild fever. "
+    "Seek medical care if symptoms persist for more than three days or get worse. "
+).split(" ")
+
+
+class StubSettings:
+    def __init__(self, first_token_ms=100, token_ms=10, tokens=64, error_rate=0.0,
+                 retry_after=None, fail_first=0):
+        self.first_token_ms = first_token_ms
+        self.token_ms = token_ms
+        self.tokens = tokens
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.fail_first = fail_first
+        self.requests = 0
+        self.lock = threading.Lock()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    settings = StubSettings()
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if self.path.rstrip("/") != COMPLETIONS_PATH:
+            return self._send_json(404, {"error": {"message": "Not found", "type": "invalid_request_error"}})
+
+        settings = self.settings
+        with settings.lock:
+            settings.requests += 1
+            fail = settings.requests <= settings.fail_first or random.random() < settings.error_rate
+        if fail:
+            headers = {"retry-after": str(settings.retry_after)} if settings.retry_after is not None else {}
+            return self._send_json(
+                429, {"error": {"message": "Rate limit reached", "type": "tokens", "code": "rate_limit_exceeded"}},
+                headers
+            )
+
+        model = body.get("model", "stub-model")
+        count = min(settings.tokens, body.get("max_tokens") or settings.tokens)
+        tokens = [LOREM[i % len(LOREM)] + " " for i in range(count)]
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        usage = {
+            "prompt_tokens": sum(len(m.get("content", "").split()) for m in body.get("messages", [])),
+            "completion_tokens": count,
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + count
+
+        time.sleep(settings.first_token_ms / 1000)
+        if not body.get("stream"):
+            return self._send_json(200, {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "".join(tokens)},
+                    "finish_reason": "stop",
+                }],
+                "usage": usage,
+            })
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for i, token in enumerate(tokens):
+            if i:
+                time.sleep(settings.token_ms / 1000)
+            self._send_chunk(completion_id, model, {"content": token}, None)
+        self._send_chunk(completion_id, model, {}, "stop", {"id": f"req_{uuid.uuid4().hex}", "usage": usage})
+        self._write_event("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _send_chunk(self, completion_id, model, delta, finish_reason, x_groq=None):
+        chunk = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "logprobs": None, "finish_reason": finish_reason}],
+        }
+        if x_groq:
+            chunk["x_groq"] = x_groq
+        self._write_event(json.dumps(chunk))
+
+    def _write_event(self, data):
+        payload = f"data: {data}\n\n".encode()
+        self.wfile.write(f"{len(payload):X}\r\n".encode() + payload + b"\r\n")
+        self.wfile.flush()
+
+    def _send_json(self, status, payload, headers=None):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def start_stub_server(port=0, **settings):
+    # Starts the stub on a background thread; returns (server, base_url)
+    handler = type("ConfiguredStubHandler", (StubHandler,), {"settings": StubSettings(**settings)})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stub of the Groq chat completions API")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--first-token-ms", type=float, default=100)
+    parser.add_argument("--token-ms", type=float, default=10)
+    parser.add_argument("--tokens", type=int, default=64)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float, default=None)
+    parser.add_argument("--fail-first", type=int, default=0)
+    args = parser.parse_args()
+
+    server, url = start_stub_server(
+        args.port, first_token_ms=args.first_token_ms, token_ms=args.token_ms, tokens=args.tokens,
+        error_rate=args.error_rate, retry_after=args.retry_after, fail_first=args.fail_first
+    )
+    print(f"Groq stub listening on {url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,295 @@
+# telemetry.py (Spans, Histograms and Prometheus Export)
+import atexit
+import bisect
+import contextvars
+import logging
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger("chatbot")
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+DEFAULT_SAMPLE_RATE = 0.01
+RECENT_TRACES = 100
+
+_current_span = contextvars.ContextVar("chatbot_span", default=None)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Counter:
+    def __init__(self, name, help, label_names=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, "") for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.label_names, key)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    def set(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.label_names)
+        with self._lock:
+            self._values[key] = value
+
+    def render(self):
+        lines = super().render()
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+
+class Histogram:
+    # Cumulative buckets are computed at render time; observing is one
+    # bisect and three increments under a lock.
+    def __init__(self, name, help, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.label_names)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def summary(self):
+        with self._lock:
+            return {
+                key: {"count": count, "sum": total, "avg": total / count if count else 0.0}
+                for key, (_, total, count) in self._series.items()
+            }
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._series.items())
+        for key, (counts, total, count) in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, [('le', le)])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {count}")
+        return lines
+
+
+class Span:
+    __slots__ = ("name", "attributes", "start", "seconds", "children")
+
+    def __init__(self, name, attributes, start):
+        self.name = name
+        self.attributes = attributes
+        self.start = start
+        self.seconds = None
+        self.children = []
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "seconds": self.seconds,
+            "attributes": self.attributes,
+            "children": [child.to_dict() for child in self.children],
+        }
+
+    def format(self):
+        inner = ", ".join(child.format() for child in self.children)
+        return f"{self.name} {self.seconds * 1000:.1f}ms" + (f" [{inner}]" if inner else "")
+
+
+class Telemetry:
+    # Every span feeds the chatbot_span_seconds histogram. Span trees are only
+    # kept for a sampled fraction of root spans (sample_rate), which keeps the
+    # cost of tracing well under 1% of a request: an unsampled span is two
+    # perf_counter calls and one histogram observation.
+    def __init__(self, sample_rate=DEFAULT_SAMPLE_RATE):
+        self.sample_rate = sample_rate
+        self.spans = Histogram("chatbot_span_seconds", "Duration of instrumented operations", ("span",))
+        self.llm_ttft = Histogram("chatbot_llm_ttft_seconds", "LLM time to first token", ("model",))
+        self.llm_total = Histogram("chatbot_llm_seconds", "LLM total response time", ("model",))
+        self.errors = Counter("chatbot_span_errors_total", "Instrumented operations that raised", ("span",))
+        self.sampled = Counter("chatbot_traces_sampled_total", "Root spans whose trace was kept")
+        self.router_routes = Counter("chatbot_router_routes_total", "Auto-routed requests by chosen model", ("model",))
+        self.router_fallbacks = Counter(
+            "chatbot_router_fallbacks_total", "Attempts abandoned for the next model", ("model", "reason")
+        )
+        self.router_ttft = Gauge("chatbot_router_ttft_ewma_seconds", "Router TTFT moving average", ("model",))
+        self.router_errors = Gauge("chatbot_router_error_ewma", "Router error-rate moving average", ("model",))
+        self.response_cache_lookups = Counter(
+            "chatbot_response_cache_lookups_total", "Answer cache lookups by result", ("result",)
+        )
+        self.response_cache_hit_rate = Gauge("chatbot_response_cache_hit_rate", "Answer cache hits per lookup")
+        self.response_cache_saved_seconds = Counter(
+            "chatbot_response_cache_saved_seconds_total", "LLM time the answer cache saved"
+        )
+        self.response_cache_saved_tokens = Counter(
+            "chatbot_response_cache_saved_tokens_total", "LLM tokens the answer cache saved"
+        )
+        self.metrics = [
+            self.spans, self.llm_ttft, self.llm_total, self.errors, self.sampled,
+            self.router_routes, self.router_fallbacks, self.router_ttft, self.router_errors,
+            self.response_cache_lookups, self.response_cache_hit_rate,
+            self.response_cache_saved_seconds, self.response_cache_saved_tokens
+        ]
+        self.recent_traces = deque(maxlen=RECENT_TRACES)
+        self.configured = False
+
+    @contextmanager
+    def span(self, name, **attributes):
+        parent = _current_span.get()
+        if parent is None and random.random() >= self.sample_rate:
+            parent = False  # Unsampled trace: children only feed the histogram
+        start = time.perf_counter()
+        if parent is False:
+            token = _current_span.set(False) if _current_span.get() is None else None
+            try:
+                yield None
+            except BaseException:
+                self.errors.inc(span=name)
+                raise
+            finally:
+                self.spans.observe(time.perf_counter() - start, span=name)
+                if token is not None:
+                    _current_span.reset(token)
+            return
+
+        span = Span(name, attributes, start)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException:
+            self.errors.inc(span=name)
+            span.attributes["error"] = True
+            raise
+        finally:
+            _current_span.reset(token)
+            span.seconds = time.perf_counter() - start
+            self.spans.observe(span.seconds, span=name)
+            if parent is None:
+                self._finish_trace(span)
+            else:
+                parent.children.append(span)
+
+    def record(self, name, seconds, **attributes):
+        # For durations measured elsewhere, e.g. per-query timings in the pool
+        self.spans.observe(seconds, span=name)
+        parent = _current_span.get()
+        if parent:
+            span = Span(name, attributes, time.perf_counter() - seconds)
+            span.seconds = seconds
+            parent.children.append(span)
+
+    def record_llm(self, model, ttft_seconds, total_seconds):
+        if ttft_seconds is not None:
+            self.llm_ttft.observe(ttft_seconds, model=model)
+        self.llm_total.observe(total_seconds, model=model)
+        self.record("llm_generate", total_seconds, model=model, ttft_seconds=ttft_seconds)
+
+    def _finish_trace(self, span):
+        self.sampled.inc()
+        self.recent_traces.append(span.to_dict())
+        logger.info(f"trace {span.format()}")
+
+    def render_prometheus(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.render_prometheus())
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    telemetry = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.rstrip("/") != "/metrics":
+            self.send_error(404)
+            return
+        data = self.telemetry.render_prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def start_metrics_server(telemetry, port, host="127.0.0.1"):
+    # Serves GET /metrics for Prometheus on a background thread
+    handler = type("ConfiguredMetricsHandler", (MetricsHandler,), {"telemetry": telemetry})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+_telemetry = None
+_telemetry_lock = threading.Lock()
+
+
+def get_telemetry(config=None):
+    # Instrumented modules share one instance per process; the app's config
+    # (sampling, scrape port, dump path) is applied the first time it is passed
+    global _telemetry
+    if _telemetry is None:
+        with _telemetry_lock:
+            if _telemetry is None:
+                _telemetry = Telemetry()
+    if config is not None and not _telemetry.configured:
+        with _telemetry_lock:
+            if not _telemetry.configured:
+                _telemetry.sample_rate = config.get("trace_sample_rate", DEFAULT_SAMPLE_RATE)
+                if config.get("metrics_port"):
+                    try:
+                        start_metrics_server(_telemetry, config["metrics_port"])
+                        logger.info(f"Serving metrics on http://127.0.0.1:{config['metrics_port']}/metrics")
+                    except OSError as e:
+                        # Another process already serves the port
+                        logger.warning(f"Metrics server not started on port {config['metrics_port']}: {str(e)}")
+                if config.get("metrics_dump_path"):
+                    atexit.register(_telemetry.dump, config["metrics_dump_path"])
+                _telemetry.configured = True
+    return _telemetry
+
+
+def span(name, **attributes):
+    return get_telemetry().span(name, **attributes)
+
+
+def record(name, seconds, **attributes):
+    get_telemetry().record(name, seconds, **attributes)
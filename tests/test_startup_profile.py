@@ -0,0 +1,28 @@
+import os
+import shutil
+import sys
+import pytest
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+import startup_profile
+
+pytest.importorskip("streamlit")
+
+
+def test_startup_within_budget(tmp_path):
+    # Runs app.py from a scratch directory so its chatbot.db is created there
+    shutil.copy(os.path.join(APP_DIR, "config.json"), tmp_path)
+    report = startup_profile.profile(APP_DIR, cwd=str(tmp_path))
+    assert startup_profile.check(
+        report, startup_profile.DEFAULT_COLD_BUDGET_MS, startup_profile.DEFAULT_RERUN_BUDGET_MS
+    ) == []
+    assert not os.path.exists(os.path.join(APP_DIR, "chatbot.db"))
+
+
+def test_check_reports_each_failure():
+    report = {"cold_seconds": 3.0, "rerun_seconds": 0.1, "loaded": ["torch"]}
+    failures = startup_profile.check(report, cold_budget_ms=2500, rerun_budget_ms=50)
+    assert len(failures) == 3
+    assert "torch" in failures[2]
@@ -4,21 +4,36 @@ import logging
 from typing import Dict, Any
 import os
 
+# Parsed configs per path; reread only when the file changes
+_configs: Dict[str, Any] = {}
+
 def load_config(config_path: str) -> Dict[str, Any]:
     try:
         if not os.path.exists(config_path):
             raise FileNotFoundError(f"Config file {config_path} not found")
+
+        mtime = os.path.getmtime(config_path)
+        cached = _configs.get(config_path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
             
         with open(config_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
+            config = json.load(f)
+        _configs[config_path] = (mtime, config)
+        return config
     except Exception as e:
         raise RuntimeError(f"Config loading failed: {str(e)}")
 
 def setup_logger():
+    # Streamlit reruns the script on every interaction; only attach the
+    # handler once per process so lines are not duplicated
     logger = logging.getLogger("chatbot")
     logger.setLevel(logging.INFO)
-    handler = logging.StreamHandler()
-    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)
-    return logger
\ No newline at end of file
+    if not any(getattr(handler, "_chatbot_handler", False) for handler in logger.handlers):
+        handler = logging.StreamHandler()
+        handler._chatbot_handler = True
+        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+        handler.setFormatter(formatter)
+        logger.addHandler(handler)
+        logger.propagate = False
+    return logger
@@ -0,0 +1,431 @@
+# vector_index.py (Memory-Mapped Local Vector Index)
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows
+    fcntl = None
+
+logger = logging.getLogger("chatbot")
+
+BLOCK_ROWS = 65536
+IVF_MIN_VECTORS = 50000
+IVF_NPROBE = 16
+IVF_REBUILD_GROWTH = 1.2
+RERANK_FACTOR = 10
+
+
+class MmapVectorStore:
+    # Normalized float32 embeddings live in an append-only file that every
+    # worker maps read-only, so the OS page cache holds one shared copy.
+    # Small collections are searched exactly with blocked matrix-vector
+    # products; large ones get an IVF index with int8 codes whose candidates
+    # are re-ranked exactly. Rows added after the IVF build are scanned
+    # exactly, so results never miss new documents.
+    #
+    # Vectors are appended before their docs lines, so a row is committed
+    # once its docs line is complete; whatever a writer that died mid-add
+    # left past that is cut off before the next write.
+    #
+    # Implements the subset of the LangChain Chroma API the app uses.
+    def __init__(self, directory, embedding_function, ivf_min_vectors=IVF_MIN_VECTORS, nprobe=IVF_NPROBE):
+        self.directory = directory
+        self.embedding_function = embedding_function
+        self.ivf_min_vectors = ivf_min_vectors
+        self.nprobe = nprobe
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.RLock()
+        self._build_lock = threading.Lock()
+        self._dim = None
+        self._vectors = None
+        self._vectors_size = -1
+        self._ids = []
+        self._texts = []
+        self._metadatas = []
+        self._row_of = {}
+        self._docs_offset = 0
+        self._deleted = np.zeros(0, dtype=bool)
+        self._deleted_offset = 0
+        self._ivf = None
+        self._ivf_mtime = None
+        with self._lock, self._file_lock():
+            self._refresh()
+            self._reconcile()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    # Storage
+    def _file_lock(self):
+        handle = open(self._path(".lock"), "a")
+        if fcntl:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+        return handle
+
+    def _refresh(self):
+        meta_path = self._path("meta.json")
+        if self._dim is None and os.path.exists(meta_path):
+            with open(meta_path) as f:
+                self._dim = json.load(f)["dim"]
+        if self._dim is None:
+            return
+
+        self._docs_offset = self._read_lines("docs.jsonl", self._docs_offset, self._add_doc)
+        if len(self._deleted) < len(self._ids):
+            self._deleted = np.concatenate([self._deleted, np.zeros(len(self._ids) - len(self._deleted), dtype=bool)])
+        self._deleted_offset = self._read_lines("deleted.jsonl", self._deleted_offset, self._mark_deleted)
+
+        vectors_path = self._path("vectors.f32")
+        size = os.path.getsize(vectors_path) if os.path.exists(vectors_path) else 0
+        if size != self._vectors_size:
+            rows = size // (4 * self._dim)
+            self._vectors = (
+                np.memmap(vectors_path, dtype=np.float32, mode="r", shape=(rows, self._dim))
+                if rows else np.empty((0, self._dim), dtype=np.float32)
+            )
+            self._vectors_size = size
+
+        ivf_path = self._path("ivf_meta.json")
+        mtime = os.path.getmtime(ivf_path) if os.path.exists(ivf_path) else None
+        if mtime != self._ivf_mtime:
+            self._ivf = self._load_ivf() if mtime else None
+            self._ivf_mtime = mtime
+
+    def _read_lines(self, name, offset, handle_line):
+        path = self._path(name)
+        if not os.path.exists(path):
+            return offset
+        with open(path, "rb") as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # Partially written by another process
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A partial line a writer died on, run into the next one
+                    logger.warning(f"Skipping unreadable line in {path}")
+                else:
+                    handle_line(record)
+                offset += len(line)
+        return offset
+
+    def _reconcile(self):
+        # Called with the file lock held, after _refresh: drops docs without
+        # a vector, vectors without a docs line and a partial last docs line
+        if self._dim is None:
+            return
+        rows = self._rows()
+        docs_path = self._path("docs.jsonl")
+        if len(self._ids) > rows:
+            offset = 0
+            with open(docs_path, "rb") as f:
+                for _ in range(rows):
+                    offset += len(f.readline())
+            for doc_id in self._ids[rows:]:
+                self._row_of.pop(doc_id, None)
+            del self._ids[rows:], self._texts[rows:], self._metadatas[rows:]
+            self._deleted = self._deleted[:rows]
+            self._docs_offset = offset
+        if os.path.exists(docs_path) and os.path.getsize(docs_path) > self._docs_offset:
+            logger.warning(f"Discarding a partial write in {self.directory}")
+            with open(docs_path, "r+b") as f:
+                f.truncate(self._docs_offset)
+        vectors_path = self._path("vectors.f32")
+        if os.path.exists(vectors_path) and os.path.getsize(vectors_path) > rows * 4 * self._dim:
+            logger.warning(f"Discarding {len(self._vectors) - rows} uncommitted vectors in {self.directory}")
+            self._vectors = None
+            with open(vectors_path, "r+b") as f:
+                f.truncate(rows * 4 * self._dim)
+            self._vectors_size = -1
+            self._refresh()
+
+    def _add_doc(self, record):
+        self._row_of[record["id"]] = len(self._ids)
+        self._ids.append(record["id"])
+        self._texts.append(record["text"])
+        self._metadatas.append(record["metadata"])
+
+    def _mark_deleted(self, doc_id):
+        row = self._row_of.get(doc_id)
+        if row is not None:
+            self._deleted[row] = True
+
+    def _rows(self):
+        return min(len(self._ids), len(self._vectors)) if self._vectors is not None else 0
+
+    def add_documents(self, documents):
+        if not documents:
+            return []
+        vectors = np.asarray(
+            self._encode([doc.page_content for doc in documents]), dtype=np.float32
+        )
+        ids = [uuid.uuid4().hex for _ in documents]
+
+        with self._lock, self._file_lock():
+            meta_path = self._path("meta.json")
+            if not os.path.exists(meta_path):
+                with open(meta_path, "w") as f:
+                    json.dump({"dim": int(vectors.shape[1])}, f)
+            self._refresh()
+            self._reconcile()
+            with open(self._path("vectors.f32"), "ab") as f:
+                f.write(vectors.tobytes())
+            with open(self._path("docs.jsonl"), "a", encoding="utf-8") as f:
+                f.write("".join(
+                    json.dumps({"id": doc_id, "text": doc.page_content, "metadata": doc.metadata}) + "\n"
+                    for doc_id, doc in zip(ids, documents)
+                ))
+            self._refresh()
+            rebuild = self._rows() >= self.ivf_min_vectors and self._needs_rebuild()
+        if rebuild:
+            self._build_ivf()
+        return ids
+
+    def delete(self, ids=None):
+        if not ids:
+            return
+        with self._lock, self._file_lock():
+            with open(self._path("deleted.jsonl"), "a") as f:
+                for doc_id in ids:
+                    f.write(json.dumps(doc_id) + "\n")
+            self._refresh()
+
+    def get(self, ids=None, where=None, limit=None, include=None):
+        with self._lock:
+            self._refresh()
+            wanted = set(ids) if ids else None
+            result = {"ids": [], "documents": [], "metadatas": []}
+            for row in range(self._rows()):
+                doc_id, metadata = self._ids[row], self._metadatas[row]
+                if self._deleted[row] or (wanted is not None and doc_id not in wanted):
+                    continue
+                if where and any(metadata.get(k) != v for k, v in where.items()):
+                    continue
+                result["ids"].append(doc_id)
+                result["documents"].append(self._texts[row])
+                result["metadatas"].append(metadata)
+                if limit and len(result["ids"]) >= limit:
+                    break
+            return result
+
+    # Search
+    def similarity_search(self, query, k=4):
+        return self.similarity_search_by_vector(self.embedding_function.embed_query(query), k=k)
+
+    def similarity_search_by_vector(self, embedding, k=4):
+        from langchain_core.documents import Document
+
+        with self._lock:
+            self._refresh()
+            rows = self._search(np.asarray(embedding, dtype=np.float32), k)
+            return [Document(page_content=self._texts[row], metadata=self._metadatas[row]) for row in rows]
+
+    def _search(self, query, k):
+        total = self._rows()
+        if not total:
+            return []
+        if self._ivf is None:
+            candidates = self._exact_top(query, 0, total, k)
+        else:
+            candidates = self._ivf_top(query, k)
+            if total > self._ivf["rows"]:
+                candidates += self._exact_top(query, self._ivf["rows"], total, k)
+        candidates.sort(key=lambda item: -item[0])
+        return [row for _, row in candidates[:k]]
+
+    def _exact_top(self, query, start, end, k):
+        # Blocked matrix-vector product keeps the working set small
+        best = []
+        for block_start in range(start, end, BLOCK_ROWS):
+            block_end = min(block_start + BLOCK_ROWS, end)
+            scores = np.asarray(self._vectors[block_start:block_end] @ query)
+            best.extend(self._top(scores, block_start, k))
+        best.sort(key=lambda item: -item[0])
+        return best[:k]
+
+    def _top(self, scores, offset, k):
+        deleted = self._deleted[offset:offset + len(scores)]
+        if deleted.any():
+            scores = np.where(deleted, -np.inf, scores)
+        count = min(k, len(scores))
+        top = np.argpartition(-scores, count - 1)[:count]
+        return [(float(scores[i]), offset + int(i)) for i in top if np.isfinite(scores[i])]
+
+    def _ivf_top(self, query, k):
+        ivf = self._ivf
+        # Probe at least 5% of the lists so recall holds as the corpus grows
+        nprobe = max(self.nprobe, len(ivf["centroids"]) // 20)
+        probes = np.argsort(-(ivf["centroids"] @ query))[:nprobe]
+        positions = np.concatenate([
+            np.arange(ivf["offsets"][c], ivf["offsets"][c + 1]) for c in probes
+        ])
+        if not len(positions):
+            return []
+        # Approximate scores from int8 codes, then exact re-ranking
+        approx = ivf["codes"][positions].astype(np.float32) @ (query / ivf["scales"])
+        shortlist = positions[np.argsort(-approx)[:k * RERANK_FACTOR]]
+        rows = np.sort(ivf["order"][shortlist])
+        scores = np.asarray(self._vectors[rows] @ query)
+        return [
+            (float(score), int(row)) for score, row in zip(scores, rows)
+            if not self._deleted[row]
+        ]
+
+    # IVF index
+    def _needs_rebuild(self):
+        return self._ivf is None or self._rows() >= self._ivf["rows"] * IVF_REBUILD_GROWTH
+
+    def _build_ivf(self, iterations=10, seed=0):
+        # Runs without the store lock, so searches and writes carry on
+        # against the previous index; one build at a time across processes
+        if not self._build_lock.acquire(blocking=False):
+            return
+        try:
+            with open(self._path(".ivf.lock"), "a") as handle:
+                if fcntl:
+                    try:
+                        fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        return  # Another process is building
+                with self._lock:
+                    self._refresh()
+                    if not self._needs_rebuild():
+                        return  # Built by another process meanwhile
+                    rows = self._rows()
+                    vectors = self._vectors[:rows]
+                    previous = self._ivf["generation"] if self._ivf else None
+                self._write_ivf(vectors, previous, iterations, seed)
+        finally:
+            self._build_lock.release()
+        with self._lock:
+            self._refresh()
+
+    def _write_ivf(self, vectors, previous, iterations, seed):
+        rows = len(vectors)
+        nlist = max(1, int(np.sqrt(rows)))
+        rng = np.random.default_rng(seed)
+        sample = vectors[np.sort(rng.choice(rows, size=min(rows, nlist * 40), replace=False))]
+
+        # Spherical k-means on a sample
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            for c in range(nlist):
+                members = sample[assignment == c]
+                if len(members):
+                    centroid = members.sum(axis=0)
+                    centroids[c] = centroid / (np.linalg.norm(centroid) or 1.0)
+
+        assignment = np.concatenate([
+            np.argmax(vectors[start:start + BLOCK_ROWS] @ centroids.T, axis=1)
+            for start in range(0, rows, BLOCK_ROWS)
+        ])
+        order = np.argsort(assignment, kind="stable")
+        offsets = np.searchsorted(assignment[order], np.arange(nlist + 1))
+
+        # Per-dimension scales use the full int8 range for every component
+        peak = np.zeros(vectors.shape[1], dtype=np.float32)
+        for start in range(0, rows, BLOCK_ROWS):
+            peak = np.maximum(peak, np.abs(vectors[start:start + BLOCK_ROWS]).max(axis=0))
+        scales = 127 / np.maximum(peak, 1e-6)
+
+        # Each build writes a fresh generation directory; swapping the
+        # manifest makes it visible to every process at once, so a reader
+        # never mixes files from two builds
+        generation = f"ivf-{uuid.uuid4().hex}"
+        os.makedirs(self._path(generation))
+        codes = np.memmap(
+            os.path.join(self._path(generation), "codes.i8"), dtype=np.int8, mode="w+", shape=(rows, vectors.shape[1])
+        )
+        for start in range(0, rows, BLOCK_ROWS):
+            block = order[start:start + BLOCK_ROWS]
+            codes[start:start + len(block)] = np.round(vectors[block] * scales)
+        codes.flush()
+        del codes
+        for name, array in (("scales", scales), ("centroids", centroids), ("order", order), ("offsets", offsets)):
+            np.save(os.path.join(self._path(generation), f"{name}.npy"), array)
+        with open(self._path("ivf_meta.json.tmp"), "w") as f:
+            json.dump({"rows": rows, "nlist": nlist, "built_at": time.time(), "generation": generation}, f)
+        os.replace(self._path("ivf_meta.json.tmp"), self._path("ivf_meta.json"))
+        # The previous generation stays for readers still loading it
+        for name in os.listdir(self.directory):
+            if name.startswith("ivf-") and name not in (generation, previous):
+                shutil.rmtree(self._path(name), ignore_errors=True)
+
+    def _load_ivf(self):
+        with open(self._path("ivf_meta.json")) as f:
+            meta = json.load(f)
+        if "generation" not in meta:
+            return None  # Built before generations; replaced on the next rebuild
+        generation = self._path(meta["generation"])
+        return {
+            "rows": meta["rows"],
+            "generation": meta["generation"],
+            "centroids": np.load(os.path.join(generation, "centroids.npy")),
+            "scales": np.load(os.path.join(generation, "scales.npy")),
+            "order": np.load(os.path.join(generation, "order.npy"), mmap_mode="r"),
+            "offsets": np.load(os.path.join(generation, "offsets.npy")),
+            "codes": np.memmap(
+                os.path.join(generation, "codes.i8"), dtype=np.int8, mode="r", shape=(meta["rows"], self._dim)
+            ),
+        }
+
+    def _encode(self, texts):
+        encode = getattr(self.embedding_function, "encode", None)
+        if encode is not None:
+            return encode(texts)
+        return self.embedding_function.embed_documents(texts)
+
+
+if __name__ == "__main__":
+    # Benchmark: python vector_index.py
+    # Query latency vs corpus size on clustered unit vectors (embeddings of
+    # real chunks cluster by topic), with recall@k of the IVF index measured
+    # against exact search.
+    import tempfile
+
+    dim, k, queries = 384, 5, 50
+    rng = np.random.default_rng(42)
+
+    for size in (1000, 10000, 100000, 300000):
+        with tempfile.TemporaryDirectory() as tmp:
+            centers = rng.standard_normal((max(1, size // 50), dim)).astype(np.float32)
+            centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+            vectors = centers[rng.integers(len(centers), size=size)]
+            vectors += 0.04 * rng.standard_normal((size, dim)).astype(np.float32)
+            vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+            store = MmapVectorStore(tmp, None, ivf_min_vectors=10**12)
+            with open(os.path.join(tmp, "meta.json"), "w") as f:
+                json.dump({"dim": dim}, f)
+            with open(os.path.join(tmp, "docs.jsonl"), "w") as f:
+                for i in range(size):
+                    f.write(json.dumps({"id": str(i), "text": "", "metadata": {}}) + "\n")
+            vectors.tofile(os.path.join(tmp, "vectors.f32"))
+            store._refresh()
+
+            # Queries near existing points, as real questions are near chunks
+            picks = rng.choice(size, queries)
+            probes = vectors[picks] + 0.04 * rng.standard_normal((queries, dim)).astype(np.float32)
+            probes /= np.linalg.norm(probes, axis=1, keepdims=True)
+
+            start = time.perf_counter()
+            exact = [set(store._search(q, k)) for q in probes]
+            exact_ms = (time.perf_counter() - start) / queries * 1000
+
+            line = f"{size:>7} vectors: exact {exact_ms:7.2f} ms/query"
+            if size >= 10000:
+                store._build_ivf()
+                start = time.perf_counter()
+                approx = [set(store._search(q, k)) for q in probes]
+                ivf_ms = (time.perf_counter() - start) / queries * 1000
+                recall = np.mean([len(a & e) / k for a, e in zip(approx, exact)])
+                line += f" | ivf {ivf_ms:7.2f} ms/query, recall@{k} {recall:.3f}"
+            print(line)
@@ -0,0 +1,124 @@
+# vector_store_registry.py (Per-Tenant Vector Store Collections)
+import hashlib
+import os
+import re
+import threading
+
+PERSIST_DIRECTORY = "./chroma_db"
+INDEX_DIRECTORY = "./vector_index"
+DEFAULT_KB_ID = "shared"
+
+
+def collection_name(kb_id):
+    # Chroma names must be 3-63 chars of [a-zA-Z0-9._-], alphanumeric at both
+    # ends. An id that has to be changed to fit gets a hash of the original,
+    # so "a.b" and "a_b" never share a collection.
+    kb_id = str(kb_id)
+    safe = re.sub(r"[^a-zA-Z0-9_-]", "_", kb_id)
+    if safe == kb_id and len(safe) <= 60 and safe[-1:].isalnum():
+        return "kb_" + safe
+    return f"kb_{safe[:50]}_{hashlib.sha1(kb_id.encode()).hexdigest()[:8]}"
+
+
+class VectorStoreRegistry:
+    # backend is "chroma" (default) or "mmap" for the memory-mapped index in
+    # vector_index.py, which suits read-heavy deployments
+    def __init__(self, persist_directory=PERSIST_DIRECTORY, backend="chroma",
+                 index_directory=INDEX_DIRECTORY, index_options=None):
+        self.persist_directory = persist_directory
+        self.backend = backend
+        self.index_directory = index_directory
+        self.index_options = index_options or {}
+        self._lock = threading.Lock()
+        # get() opens stores under _lock and opening one reads self.client,
+        # so the client needs a lock of its own
+        self._client_lock = threading.Lock()
+        self._client = None
+        self._stores = {}
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    import chromadb
+                    self._client = chromadb.PersistentClient(path=self.persist_directory)
+        return self._client
+
+    def exists(self, kb_id):
+        name = collection_name(kb_id)
+        if name in self._stores:
+            return True
+        if self.backend == "mmap":
+            return os.path.exists(os.path.join(self.index_directory, name, "meta.json"))
+        # list_collections returns names on chromadb>=0.6 and objects before
+        return any(getattr(c, "name", c) == name for c in self.client.list_collections())
+
+    def get(self, kb_id, embedder, create=True):
+        name = collection_name(kb_id)
+        store = self._stores.get(name)
+        if store is None:
+            if not create and not self.exists(kb_id):
+                return None
+            with self._lock:
+                store = self._stores.get(name)
+                if store is None:
+                    store = self._stores[name] = self._open(name, embedder)
+        return store
+
+    def _open(self, name, embedder):
+        if self.backend == "mmap":
+            from vector_index import MmapVectorStore
+            return MmapVectorStore(
+                os.path.join(self.index_directory, name), embedder, **self.index_options
+            )
+
+        from langchain_community.vectorstores import Chroma
+        return Chroma(
+            client=self.client,
+            collection_name=name,
+            embedding_function=embedder
+        )
+
+    def add_documents(self, kb_id, embedder, documents):
+        if documents:
+            self.get(kb_id, embedder).add_documents(documents)
+
+    def delete_source(self, kb_id, embedder, source):
+        store = self.get(kb_id, embedder, create=False)
+        if store is None:
+            return 0
+        ids = store.get(where={"source": source})["ids"]
+        if ids:
+            store.delete(ids=ids)
+        return len(ids)
+
+    def list_sources(self, kb_id, embedder):
+        store = self.get(kb_id, embedder, create=False)
+        if store is None:
+            return []
+        metadatas = store.get(include=["metadatas"])["metadatas"]
+        return sorted({m.get("source") for m in metadatas if m and m.get("source")})
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry(config=None):
+    # Settings only take effect on the first call in a process
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                config = config or {}
+                index_options = {}
+                if "vector_ivf_min_vectors" in config:
+                    index_options["ivf_min_vectors"] = config["vector_ivf_min_vectors"]
+                if "vector_ivf_nprobe" in config:
+                    index_options["nprobe"] = config["vector_ivf_nprobe"]
+                _registry = VectorStoreRegistry(
+                    backend=config.get("vector_backend", "chroma"),
+                    index_options=index_options
+                )
+    return _registry